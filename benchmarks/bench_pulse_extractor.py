@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+"""
+Measure the throughput of the pulse extraction in lines per second.
+
+The lines of the DAQ simulation (or the given raw data file) are passed
+through PulseExtractor.extract, once with the lookup table decoding of
+the edges and once with the previous decoding by int(field, 16) and bit
+masks. Both have to extract the same pulses. The extraction is also
+measured with pooled events, which are released right after each
+trigger, and with the BatchPulseExtractor on blocks of lines, which has
+to extract the same pulses as well. The best of several runs is
+reported.
+
+Usage: python benchmarks/bench_pulse_extractor.py [--runs N] [--lines N] [--block N] [FILE]
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, ROOT)
+
+from muonic.daq.replay import open_raw_file  # noqa: E402
+from muonic.lib.batch import BatchPulseExtractor  # noqa: E402
+from muonic.lib.utils import BIT0_4, BIT5, TMC_TICK, PulseEventPool, PulseExtractor  # noqa: E402
+
+SIMULATION_DATA = os.path.join(ROOT, "muonic", "daq", "simdaq.txt")
+
+
+class IntDecodingPulseExtractor(PulseExtractor):
+    """
+    Pulse extractor with the edge decoding used before the lookup table
+    """
+
+    def _calculate_edges(self, line, counter_diff=0):
+        rising_edges = {
+            "ch0": int(line[1], 16), "ch1": int(line[3], 16),
+            "ch2": int(line[5], 16), "ch3": int(line[7], 16)
+        }
+        falling_edges = {
+            "ch0": int(line[2], 16), "ch1": int(line[4], 16),
+            "ch2": int(line[6], 16), "ch3": int(line[8], 16)
+        }
+
+        for ch in ["ch0", "ch1", "ch2", "ch3"]:
+            re = rising_edges[ch]
+            fe = falling_edges[ch]
+
+            if re & BIT5:
+                self.re[ch].append(counter_diff + (re & BIT0_4) * TMC_TICK)
+            if fe & BIT5:
+                self.fe[ch].append(counter_diff + (fe & BIT0_4) * TMC_TICK)
+
+
+def extract_all(extractor_class, lines):
+    """
+    Extract the pulses of all lines
+
+    :param extractor_class: pulse extractor class
+    :type extractor_class: type
+    :param lines: DAQ lines
+    :type lines: list of str
+    :returns: tuple of the elapsed time in s and the extracted pulses
+    """
+    extractor = extractor_class(logging.getLogger("bench"))
+    extract = extractor.extract
+    start = time.perf_counter()
+    pulses = [extract(line) for line in lines]
+    return time.perf_counter() - start, pulses
+
+
+def extract_pooled(lines):
+    """
+    Extract the pulses of all lines with pooled events, releasing each
+    event right away
+
+    :param lines: DAQ lines
+    :type lines: list of str
+    :returns: tuple of the elapsed time in s and the number of events
+    """
+    pool = PulseEventPool()
+    extractor = PulseExtractor(logging.getLogger("bench"), pool=pool)
+    extract = extractor.extract
+    release = pool.release
+    count = 0
+    start = time.perf_counter()
+    for line in lines:
+        event = extract(line)
+        if event is not None:
+            count += 1
+            release(event)
+    return time.perf_counter() - start, count
+
+
+def extract_batches(lines, block):
+    """
+    Extract the pulses of all lines in blocks
+
+    :param lines: DAQ lines
+    :type lines: list of str
+    :param block: number of lines per block
+    :type block: int
+    :returns: tuple of the elapsed time in s and the extracted batches
+    """
+    extractor = BatchPulseExtractor(logging.getLogger("bench"))
+    extract_batch = extractor.extract_batch
+    start = time.perf_counter()
+    batches = [extract_batch(lines[i:i + block]) for i in range(0, len(lines), block)]
+    return time.perf_counter() - start, batches
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    p.add_argument("file", nargs="?", default=SIMULATION_DATA, help="raw data file (default: simulation data)")
+    p.add_argument("--runs", type=int, default=5, help="runs per measurement")
+    p.add_argument("--lines", type=int, default=200000, help="number of lines, the file is repeated if needed")
+    p.add_argument("--block", type=int, default=4096, help="number of lines per block of the batch extraction")
+    args = p.parse_args()
+
+    with open_raw_file(args.file) as f:
+        data = [line.strip() for line in f if line.strip()]
+    lines = (data * (args.lines // len(data) + 1))[:args.lines]
+
+    results = []
+    for label, extractor_class in (("int decoding", IntDecodingPulseExtractor),
+                                   ("lookup table", PulseExtractor)):
+        best, pulses = min((extract_all(extractor_class, lines) for _ in range(args.runs)),
+                           key=lambda result: result[0])
+        results.append(pulses)
+        print("%-15s %12.0f lines/s" % (label, len(lines) / best))
+
+    best, pooled_events = min((extract_pooled(lines) for _ in range(args.runs)), key=lambda result: result[0])
+    print("%-15s %12.0f lines/s" % ("pooled events", len(lines) / best))
+
+    best, batches = min((extract_batches(lines, args.block) for _ in range(args.runs)), key=lambda result: result[0])
+    print("%-15s %12.0f lines/s" % ("batches", len(lines) / best))
+
+    if results[0] != results[1]:
+        sys.exit("the extracted pulses differ")
+    if pooled_events != len([pulses for pulses in results[1] if pulses is not None]):
+        sys.exit("the number of pooled events differs")
+    if [pulses for pulses in results[1] if pulses is not None] != [event for batch in batches for event in batch]:
+        sys.exit("the pulses extracted in batches differ")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""
+Measure the import time of the muonic modules and the startup time of
+the command line interface.
+
+Each measurement runs in a fresh interpreter, the median of several runs
+is reported. With --detail the slowest imports of each module (according
+to python -X importtime) are listed as well.
+
+Usage: python benchmarks/import_time.py [--runs N] [--detail]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+MODULES = [
+    "muonic",
+    "muonic.daq",
+    "muonic.daq.provider",
+    "muonic.lib.analyzers",
+    "muonic.lib.consumers",
+    "muonic.lib.app",
+    "muonic.muonic",
+]
+
+CLI_RUN = "import sys; sys.argv = ['muonic'] + sys.argv[1:]; from muonic.muonic import main; main()"
+
+COMMANDS = [
+    ("muonic --help", ["-c", CLI_RUN, "--help"]),
+    ("muonic --version", ["-c", CLI_RUN, "--version"]),
+]
+
+
+def run(args, env):
+    """
+    Run python with args and return the wall time in seconds
+
+    :param args: interpreter arguments
+    :type args: list
+    :param env: environment
+    :type env: dict
+    :returns: float
+    """
+    start = time.perf_counter()
+    subprocess.run([sys.executable] + args, env=env, cwd=ROOT, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def slowest_imports(module, env, count=5):
+    """
+    Slowest imports (cumulative time) caused by importing module
+
+    :param module: module name
+    :type module: str
+    :param env: environment
+    :type env: dict
+    :param count: number of imports to return
+    :type count: int
+    :returns: list of (microseconds, name) tuples
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module],
+                            env=env, cwd=ROOT, check=True, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE, universal_newlines=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if name.strip() != module:
+            imports.append((int(cumulative), name.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    p.add_argument("--runs", type=int, default=10, help="runs per measurement")
+    p.add_argument("--detail", action="store_true", help="list the slowest imports of each module")
+    args = p.parse_args()
+
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [ROOT, env.get("PYTHONPATH")]))
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+
+    baseline = statistics.median(run(["-c", "pass"], env) for _ in range(args.runs))
+    print("%-25s %10s %10s" % ("", "median/ms", "import/ms"))
+    print("%-25s %10.1f %10s" % ("python -c pass", baseline * 1e3, "-"))
+
+    measurements = [("import " + module, ["-c", "import " + module]) for module in MODULES] + COMMANDS
+    for label, cmd in measurements:
+        # the first run compiles the byte code
+        run(cmd, env)
+        median = statistics.median(run(cmd, env) for _ in range(args.runs))
+        print("%-25s %10.1f %10.1f" % (label, median * 1e3, (median - baseline) * 1e3))
+
+    if args.detail:
+        for module in MODULES:
+            print("\nslowest imports of %s" % module)
+            for cumulative, name in slowest_imports(module, env):
+                print("  %8.1f ms  %s" % (cumulative / 1e3, name))
+
+
+if __name__ == "__main__":
+    main()
@@ -18,6 +18,8 @@ DOC_PATH = path.abspath(path.join(
 
 DATA_PATH = path.join(getenv('HOME'), 'muonic_data')
 
+CONFIG_PATH = path.join(getenv('HOME'), '.muonic')
+
 __version__ = "4.0.0"
 __author__ = ", ".join([author[0] for author in AUTHORS])
 __author_email__ = ", ".join([author[1] for author in AUTHORS])
@@ -0,0 +1,72 @@
+import logging
+import signal
+import configargparse
+from . import __version__
+
+logger = logging.getLogger()
+
+
+def main():
+
+    p = configargparse.ArgParser(description="Find coincidences between the events of several muonic stations " +
+                                             "started with --publish-events")
+
+    p.add('-c', '--config-file', required=False, is_config_file=True, help='config file path')
+    p.add("-l", "--listen", dest="listen", default="5560", metavar="[HOST:]PORT",
+          help="address to accept the stations on (default: port 5560 on all interfaces)")
+    p.add("-o", "--output", dest="output", default="coincidences.txt",
+          help="file to append the coincidences to")
+    p.add("-w", "--window", dest="window", type=float, default=10.0,
+          help="coincidence window in microseconds")
+    p.add("--min-stations", dest="min_stations", type=int, default=2,
+          help="minimum number of stations of a coincidence")
+    p.add("--max-delay", dest="max_delay", type=float, default=5.0,
+          help="maximum time in s to wait for the events of slow stations")
+    p.add("--max-events", dest="max_events", type=int, default=100000,
+          help="maximum number of events waiting to be merged")
+    p.add("-m", "--duration", dest="duration", type=float, default=None,
+          help="stop after this number of seconds")
+    p.add("--metrics-file", dest="metrics_file", default=None,
+          help="Periodically write metrics in Prometheus text format to this file")
+    p.add("--log-level", dest="log_level", help="level of the messages written to muonic-aggregator.log",
+          choices=["DEBUG", "INFO", "WARNING", "ERROR"], default="INFO")
+    p.add("-v", "--version", help="show current version", action="version", version="muonic %s" % __version__)
+
+    options = vars(p.parse_args())
+
+    if options.get("min_stations") < 2:
+        p.error("a coincidence needs at least two stations")
+
+    from .lib.aggregator import Aggregator, parse_address
+    from .lib.log import setup_logging, shutdown_logging
+
+    try:
+        parse_address(options.get("listen"))
+    except ValueError as e:
+        p.error("invalid address to listen on: %s" % e)
+
+    setup_logging(log_file="muonic-aggregator.log", level=getattr(logging, options.get("log_level")),
+                  console_level=logging.INFO)
+
+    aggregator = Aggregator(options.get("listen"), output=options.get("output"),
+                            window=int(options.get("window") * 1000), min_stations=options.get("min_stations"),
+                            max_delay=options.get("max_delay"), max_events=options.get("max_events"),
+                            logger=logger)
+
+    exporter = None
+    if options.get("metrics_file"):
+        from .lib.metrics import PrometheusTextfileExporter
+        exporter = PrometheusTextfileExporter(options.get("metrics_file"), logger=logger)
+        exporter.start()
+
+    signal.signal(signal.SIGINT, aggregator.stop)
+    signal.signal(signal.SIGTERM, aggregator.stop)
+
+    aggregator.run(options.get("duration"))
+
+    if exporter is not None:
+        exporter.stop()
+        from .lib.scheduler import SCHEDULER
+        SCHEDULER.stop()
+
+    shutdown_logging()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""
+Search for muon decays in raw data files with the batch pulse extraction
+and the batch decay trigger.
+Usage python batch_decays.py [options] RAWFILE [RAWFILE ...]
+
+Writes the time of each decay event and the decay time in microseconds
+to decays.txt. The raw files may be compressed with gzip or bzip2.
+Garbage lines, e.g. from glitches of the serial connection, are skipped
+with a warning.
+
+With --clock-model, the events are timed with the clock reconstructed
+from all lines of each file (muonic.lib.clock.ClockModel) instead of
+the line by line timing of a live measurement. Each file is read into
+memory at once then.
+"""
+from __future__ import print_function
+import argparse
+import datetime
+import itertools
+import logging
+
+import numpy as np
+
+from muonic.daq.replay import open_raw_file
+from muonic.lib.batch import BatchPulseExtractor
+from muonic.lib.clock import EPOCH, ClockModel
+from muonic.lib.utils import BIT7, DecayTriggerThorough
+
+# lines extracted at once
+BLOCK_SIZE = 65536
+
+
+def clock_model_times(lines, first_line):
+    """
+    Times of the trigger lines of a file by the clock model of its lines
+
+    :param lines: lines of the file
+    :type lines: list of str
+    :param first_line: index of the first line among all lines passed to
+                       the extractor
+    :type first_line: int
+    :returns: dict of the times as datetime.datetime by line index
+    """
+    model, raw = ClockModel.from_lines(lines)
+    triggers = np.flatnonzero(raw.edges[:, 0] & BIT7)
+    return {first_line + line: EPOCH + datetime.timedelta(seconds=seconds) for line, seconds in
+            zip(raw.line_index[triggers].tolist(), model.timestamps()[triggers].tolist())}
+
+
+def batch_decays(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    p.add_argument("files", nargs="+", metavar="RAWFILE")
+    p.add_argument("--single-channel", type=int, default=0)
+    p.add_argument("--double-channel", type=int, default=1)
+    p.add_argument("--veto-channel", type=int, default=2, help="4 for no veto")
+    p.add_argument("--min-decay-time", type=int, default=0, help="in ns")
+    p.add_argument("--clock-model", action="store_true",
+                   help="time the events with the clock reconstructed from each whole file")
+    p.add_argument("-o", "--output", default="decays.txt")
+    args = p.parse_args(argv)
+
+    logger = logging.getLogger()
+    extractor = BatchPulseExtractor(logger, data_timestamps=True)
+    trigger = DecayTriggerThorough(logger)
+    count = 0
+    # clock model times of the trigger lines
+    times = {}
+
+    with open(args.output, "w") as output:
+        for filename in args.files:
+            with open_raw_file(filename) as f:
+                source = f
+                if args.clock_model:
+                    if times:
+                        # the event started in the previous file still
+                        # needs the time of its trigger line
+                        last = max(times)
+                        times = {last: times[last]}
+                    source = f.readlines()
+                    times.update(clock_model_times(source, extractor.lines_read))
+                    source = iter(source)
+                while True:
+                    lines = list(itertools.islice(source, BLOCK_SIZE))
+                    if not lines:
+                        break
+                    batch = extractor.extract_batch(lines)
+                    decays, events = trigger.trigger_batch(batch, single_channel=args.single_channel,
+                                                           double_channel=args.double_channel,
+                                                           veto_channel=args.veto_channel,
+                                                           min_decay_time=args.min_decay_time)
+                    for decay, event in zip(decays.tolist(), events.tolist()):
+                        # lines the clock model cannot decode keep the
+                        # time of the extractor
+                        event_time = times.get(int(batch.trigger_lines[event]), batch.event_times[event])
+                        output.write("%s %.3f\n" % (event_time.strftime("%Y-%m-%d %H:%M:%S.%f"), decay / 1000))
+                    count += len(decays)
+
+    print("Found %d decays" % count)
+
+
+if __name__ == "__main__":
+    batch_decays()
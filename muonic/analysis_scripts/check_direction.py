@@ -12,7 +12,7 @@ def check_direction():
     f = open(sys.argv[1])
     directions = []
 
-    for line in f.readlines():
+    for line in f:
         try:
             line = line.split()
             directions.append(float(line[3][2:-1]) - float(line[1][2:-1]))
@@ -6,36 +6,21 @@
 # -> each channel is represented by a list of leading/falling edge
 #    tuples of the recorded pulses
 #
+# usage: python daq_converter.py RAWFILE [RAWFILE ...]
+# the raw files may be compressed with gzip or bzip2
+#
 from __future__ import print_function
 import logging
-import re
 import sys
 
-from muonic.analysis.analyzer import PulseExtractor
+from muonic.lib.utils import iter_events_from_files
 
 
 def daq_converter():
-    pe = PulseExtractor(logging.getLogger(), '')
-
-    f = open(sys.argv[1])
-
-    converted_file = open("converted.txt", "w")
-
-    # match against this to supress daq garbage
-    good_pattern = re.compile("^[a-zA-Z0-9+-.,:()=$/#?!%_@*|~' ]*[\n\r]*$")
-
-    for line in f.readlines():
-        if good_pattern.match(line) is None:
-            continue
-        try:
-            pulses = pe.extract(line)
-        except Exception as e:
-            print(line, "Failed to convert", e)
-            continue
+    with open("converted.txt", "w") as converted_file:
+        for pulses in iter_events_from_files(sys.argv[1:], logging.getLogger()):
+            converted_file.write(repr(pulses.as_tuple()) + "\n")
 
-        if pulses is not None:
-            converted_file.write(pulses.__repr__() + "\n")
-    
 
 if __name__ == "__main__":
     daq_converter()
@@ -1,10 +1,11 @@
 import sys
-import gzip
-import bz2
 from operator import itemgetter
 import ROOT
 import array
 
+from muonic.daq.replay import open_raw_file
+from muonic.lib.utils import gps_time_to_seconds
+
 BIT0_4 = 31
 BIT5 = 1 << 5
 BIT7 = 1 << 7
@@ -26,12 +27,7 @@ def time_to_seconds(time, correction):
     '''
     Convert hhmmss,xxx string int seconds since day start
     '''
-#    print time,correction
-    tfields = time.split(".")
-    t = tfields[0]
-    secs_since_day_start = int(t[0:2])*3600+int(t[2:4])*60+int(t[4:6])
-    evt_time = secs_since_day_start + int(tfields[1])/1000.0+int(correction)/1000.0
-    return round(evt_time)
+    return round(gps_time_to_seconds(time, correction))
 
 
 class Pulse(object):
@@ -78,12 +74,7 @@ def analyze_files(filelist):
     gps_valid = True
 
     for filename in filelist:
-        if filename.endswith('.bz2'):
-            f = bz2.BZ2File(filename)
-        elif filename.endswith('.gz'):
-            f = gzip.open(filename)
-        else:
-            f = open(filename)
+        f = open_raw_file(filename)
         all_pulses = []
         for line in f:
             if verbose: print(line)
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+"""
+Scan the cuts of the decay analysis in one pass over raw data files.
+Usage python decay_cut_scan.py [options] RAWFILE [RAWFILE ...]
+
+Each cut option takes a list of values, all combinations are evaluated,
+e.g. --min-single-pulse-width 0 10 20 --decay-min-time 0 500 1000.
+The number of decays and the lifetime in microseconds of each
+combination are written to decay_cut_scan.txt. Garbage lines in the raw
+files are skipped with a warning.
+"""
+from __future__ import print_function
+import argparse
+import itertools
+import logging
+
+from muonic.daq.replay import open_raw_file
+from muonic.lib.batch import BatchPulseExtractor
+from muonic.lib.decay_scan import CUT_OPTIONS, DecayScan, cut_grid
+
+# lines extracted at once
+BLOCK_SIZE = 65536
+
+
+def decay_cut_scan(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    p.add_argument("files", nargs="+", metavar="RAWFILE")
+    for name, default in CUT_OPTIONS.items():
+        p.add_argument("--" + name.replace("_", "-"), dest=name, nargs="+", type=int, default=[default])
+    p.add_argument("-o", "--output", default="decay_cut_scan.txt")
+    args = p.parse_args(argv)
+
+    logger = logging.getLogger()
+    extractor = BatchPulseExtractor(logger)
+    scan = DecayScan(cut_grid(**dict((name, getattr(args, name)) for name in CUT_OPTIONS)), logger)
+
+    for filename in args.files:
+        with open_raw_file(filename) as f:
+            while True:
+                lines = list(itertools.islice(f, BLOCK_SIZE))
+                if not lines:
+                    break
+                scan.add_batch(extractor.extract_batch(lines))
+
+    with open(args.output, "w") as output:
+        scan.write_table(output)
+    print("Evaluated %d cut configurations on %d events" % (len(scan.configurations), scan.event_count))
+
+
+if __name__ == "__main__":
+    decay_cut_scan()
@@ -20,7 +20,7 @@ def convert():
     vals = []
 
     with open(infile) as f:
-        for line in f.readlines():
+        for line in f:
             vals.append(float(line.split()[2]))
 
     print(vals)
@@ -7,7 +7,7 @@ import sys
 
 
 def get_numbers():
-    for line in open(sys.argv[1]).readlines():
+    for line in open(sys.argv[1]):
         fields = line.split(' ')
         for field in fields:
             try:
@@ -1,7 +1,9 @@
 #!/usr/bin/env python
 
 import sys
-import gzip
+
+from muonic.daq.replay import open_raw_file
+from muonic.lib.utils import gps_time_to_seconds
 
 #IMPORTANT
 # The order of the szintillators is 0->2->1
@@ -23,12 +25,7 @@ def time_to_seconds(time, correction):
     '''
     Convert hhmmss,xxx string int seconds since day start
     '''
-#    print time,correction
-    tfields = time.split(".")
-    t = tfields[0]
-    secs_since_day_start = int(t[0:2])*3600+int(t[2:4])*60+int(t[4:6])
-    evt_time = secs_since_day_start + int(tfields[1])/1000.0+int(correction)/1000.0
-    return round(evt_time)
+    return round(gps_time_to_seconds(time, correction))
 
 for filename in files:
 
@@ -62,10 +59,7 @@ for filename in files:
     last_onepps = 0
     onepps_count = 0
 
-    if filename.endswith('.gz'):
-        f = gzip.open(filename)
-    else:
-        f = open(filename)
+    f = open_raw_file(filename)
     for line in f:
         print(line)
         fields = line.rstrip("\n").split(" ")
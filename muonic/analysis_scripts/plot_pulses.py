@@ -16,7 +16,7 @@ def plot_pulses():
     chan0 = []
     chan1 = []
 
-    for line in f.readlines():
+    for line in f:
         try:
             line = line.split()
             fe0 = line[2].split(')')[0]
@@ -18,7 +18,7 @@ def plot_trigger_timmdiff():
     iniini = True
     last_trigger = 0
 
-    for line in f.readlines():
+    for line in f:
         if iniini:
             iniini = False
             continue
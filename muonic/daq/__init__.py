@@ -1,10 +1,32 @@
 """
 Provide a connection to the QNet DAQ cards via python-serial. For software
 testing and development, (very) dumb DAQ card simulator is available.
+
+The connection, simulation and provider classes are imported on first
+access, so that only the dependencies of the classes in use get loaded.
 """
+import importlib
+
 from .exceptions import DAQIOError, DAQMissingDependencyError
-from .simulation import DAQSimulationConnection, DAQSimulationServer
-from .connection import DAQConnection, DAQServer
-from .provider import DAQClient, DAQProvider
 
-__all__ = ["exceptions", "simulation", "connection", "provider"]
+__all__ = ["exceptions", "simulation", "connection", "provider", "replay", "multi"]
+
+_LAZY_ATTRIBUTES = {
+    "DAQSimulationConnection": "simulation",
+    "DAQSimulationServer": "simulation",
+    "DAQConnection": "connection",
+    "DAQServer": "connection",
+    "DAQClient": "provider",
+    "DAQProvider": "provider",
+    "ReplayProvider": "replay",
+    "MultiDAQProvider": "multi",
+}
+
+
+def __getattr__(name):
+    module_name = _LAZY_ATTRIBUTES.get(name)
+    if module_name is None:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    value = getattr(importlib.import_module("." + module_name, __name__), name)
+    globals()[name] = value
+    return value
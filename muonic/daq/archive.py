@@ -0,0 +1,255 @@
+"""
+Compact archives of the raw DAQ data stream.
+
+In acquisition only mode the reader process writes all lines it receives
+into a gzip archive, without passing the events to the main process.
+The archive consists of one gzip member per flush interval, so it can be
+read while it is written and a crash loses at most the last interval.
+While the archive is written, a lock file next to it holds the pid of
+the writing process.
+"""
+import collections
+import gzip
+import logging
+import os
+import time
+import zlib
+
+
+__all__ = ["ArchiveWriter", "ArchiveSink", "ArchiveReader"]
+
+
+def is_event_line(line):
+    """
+    Tests if line holds pulse data, opposed to scalars, status messages
+    and replies to commands.
+
+    :param line: DAQ line
+    :type line: str
+    :returns: bool
+    """
+    return len(line) >= 50 and line[8] == ' '
+
+
+class ArchiveWriter(object):
+    """
+    Appends lines to a gzip archive.
+
+    :param path: path of the archive
+    :type path: str
+    :param flush_interval: seconds after which the current gzip member is
+                           completed
+    :type flush_interval: float
+    :param compresslevel: gzip compression level
+    :type compresslevel: int
+    """
+
+    def __init__(self, path, flush_interval=1.0, compresslevel=6):
+        self.path = path
+        self.lock_path = path + ".lock"
+        self.flush_interval = flush_interval
+        self.compresslevel = compresslevel
+        self.line_count = 0
+
+        with open(self.lock_path, "w") as f:
+            f.write("%d\n" % os.getpid())
+
+        self._file = open(path, "ab")
+        self._member = None
+        self._next_flush = 0
+
+    def write(self, line):
+        """
+        Write line to the archive
+
+        :param line: DAQ line
+        :type line: str or bytes
+        :returns: None
+        """
+        if self._member is None:
+            self._member = gzip.GzipFile(fileobj=self._file, mode="wb",
+                                         compresslevel=self.compresslevel)
+            self._next_flush = time.monotonic() + self.flush_interval
+
+        if not isinstance(line, bytes):
+            line = line.encode("ascii", "replace")
+        self._member.write(line + b"\n")
+        self.line_count += 1
+
+        if time.monotonic() >= self._next_flush:
+            self.flush()
+
+    def flush(self):
+        """
+        Complete the current gzip member, so readers can decompress
+        everything written so far
+
+        :returns: None
+        """
+        if self._member is not None:
+            self._member.close()
+            self._member = None
+            self._file.flush()
+
+    def close(self):
+        """
+        Flush and close the archive and remove the lock file
+
+        :returns: None
+        """
+        if self._file is None:
+            return
+        self.flush()
+        self._file.close()
+        self._file = None
+        try:
+            os.unlink(self.lock_path)
+        except OSError:
+            pass
+
+
+class ArchiveSink(object):
+    """
+    Replaces the output queue of a DAQ connection in the reader process.
+    All lines are written to the archive; only lines other than events,
+    like scalars and replies to commands, are passed on to the queue.
+
+    :param out_queue: queue to pass lines on to
+    :type out_queue: multiprocessing.Queue
+    :param writer: archive writer
+    :type writer: ArchiveWriter
+    """
+
+    def __init__(self, out_queue, writer):
+        self.out_queue = out_queue
+        self.writer = writer
+
+    def put(self, item):
+        """
+        Archive (receive time, line) tuple
+
+        :param item: receive time and line
+        :type item: tuple
+        :returns: None
+        """
+        line = item[1]
+        if isinstance(line, bytes):
+            line = line.decode("ascii", "replace")
+        self.writer.write(line)
+        if not is_event_line(line):
+            self.out_queue.put(item)
+
+
+class ArchiveReader(object):
+    """
+    Reads the lines of an archive, optionally following it while it is
+    written. Plain text files are read as well.
+
+    readline never blocks. It returns an empty string if no complete line
+    is available; finished tells if more lines may follow.
+
+    :param path: path of the archive
+    :type path: str
+    :param follow: wait for new lines while the archive is written
+    :type follow: bool
+    :param logger: logger object
+    :type logger: logging.Logger
+    """
+
+    CHUNK_SIZE = 1 << 16
+
+    def __init__(self, path, follow=False, logger=None):
+        if logger is None:
+            logger = logging.getLogger(self.__module__ + '.' + self.__class__.__name__)
+        self.logger = logger
+        self.path = path
+        self.follow = follow
+        self.finished = False
+
+        self._file = open(path, "rb")
+        self._gzip = None
+        self._decompressor = None
+        self._buffer = b""
+        self._lines = collections.deque()
+
+    @property
+    def writer_active(self):
+        """
+        Tests if the archive is still written
+
+        :returns: bool
+        """
+        return os.path.exists(self.path + ".lock")
+
+    def _decompress(self, data):
+        if self._gzip is None:
+            # decide on the first bytes whether the file is compressed
+            self._gzip = data[:2] == b"\x1f\x8b"
+
+        if not self._gzip:
+            return data
+
+        result = []
+        while data:
+            if self._decompressor is None:
+                self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            result.append(self._decompressor.decompress(data))
+            if self._decompressor.eof:
+                # continue with the next gzip member
+                data = self._decompressor.unused_data
+                self._decompressor = None
+            else:
+                data = b""
+        return b"".join(result)
+
+    def _fill(self):
+        """
+        Read new data and split it into lines. Returns False if there was no
+        new data.
+
+        :returns: bool
+        """
+        data = self._file.read(self.CHUNK_SIZE)
+        if not data:
+            return False
+        try:
+            self._buffer += self._decompress(data)
+        except zlib.error as e:
+            self.logger.warning("Corrupt data in archive %s: %s" % (self.path, e))
+            self._decompressor = None
+            return True
+        *lines, self._buffer = self._buffer.split(b"\n")
+        self._lines.extend(line.decode("ascii", "replace") for line in lines)
+        return True
+
+    def readline(self):
+        """
+        Next line including the line break, or an empty string if no line
+        is available right now
+
+        :returns: str
+        """
+        while not self._lines:
+            if self.finished:
+                return ""
+            if self._fill():
+                continue
+
+            # check the lock before looking for data once more, so no line
+            # written right before the writer stopped is missed
+            writing = self.follow and self.writer_active
+            if self._fill():
+                continue
+            if writing:
+                return ""
+
+            if self._buffer:
+                self.logger.warning("Archive %s ends with an incomplete line" % self.path)
+                self._buffer = b""
+            self.finished = True
+            return ""
+        return self._lines.popleft() + "\n"
+
+    def close(self):
+        self._file.close()
+        self.finished = True
@@ -4,24 +4,17 @@ Provides DAQ server and connection classes to interface with the serial port.
 
 from __future__ import print_function
 import abc
-from future.utils import with_metaclass
 import logging
 import os
 import queue
 import serial
 import subprocess
-from time import sleep
-
-try:
-    import zmq
-except ImportError:
-    # DAQMissingDependencyError will be raised when trying to use zmq
-    pass
+from time import monotonic, sleep
 
 from muonic.daq import DAQMissingDependencyError
 
 
-class BaseDAQConnection(with_metaclass(abc.ABCMeta, object)):
+class BaseDAQConnection(object, metaclass=abc.ABCMeta):
     """
     Base DAQ Connection class.
 
@@ -29,13 +22,17 @@ class BaseDAQConnection(with_metaclass(abc.ABCMeta, object)):
 
     :param logger: logger object
     :type logger: logging.Logger
+    :param device: serial device of the DAQ card, found with which_tty_daq
+                   if not given
+    :type device: str
     :raises: SystemError
     """
 
-    def __init__(self, logger=None):
+    def __init__(self, logger=None, device=None):
         if logger is None:
             logger = logging.getLogger()
         self.logger = logger
+        self.device = device
         self.running = 1
 
         try:
@@ -44,6 +41,15 @@ class BaseDAQConnection(with_metaclass(abc.ABCMeta, object)):
             self.logger.fatal("SerialException thrown! Value: %s" % e.message)
             raise SystemError(e)
 
+    @property
+    def device_id(self):
+        """
+        Device the DAQ card is connected to
+
+        :returns: str
+        """
+        return self.serial_port.port
+
     def get_serial_port(self):
         """
         Check out which device (/dev/tty) is used for DAQ communication.
@@ -63,18 +69,21 @@ class BaseDAQConnection(with_metaclass(abc.ABCMeta, object)):
             return f"/dev/{path}"
 
         while not connected:
-            try:
-                dev = get_dev_path("which_tty_daq")
-            except OSError:
-                # try using package script ../../bin/which_tty_daq
-                which_tty_daq = os.path.abspath(
-                        os.path.join(os.path.dirname(__file__), os.pardir,
-                                     os.pardir, 'bin', 'which_tty_daq'))
-
-                if not os.path.exists(which_tty_daq):
-                    raise OSError("Can not find binary which_tty_daq")
-
-                dev = get_dev_path(which_tty_daq)
+            if self.device is not None:
+                dev = self.device
+            else:
+                try:
+                    dev = get_dev_path("which_tty_daq")
+                except OSError:
+                    # try using package script ../../bin/which_tty_daq
+                    which_tty_daq = os.path.abspath(
+                            os.path.join(os.path.dirname(__file__), os.pardir,
+                                         os.pardir, 'bin', 'which_tty_daq'))
+
+                    if not os.path.exists(which_tty_daq):
+                        raise OSError("Can not find binary which_tty_daq")
+
+                    dev = get_dev_path(which_tty_daq)
 
             self.logger.info("Daq found at %s", dev)
             self.logger.info("trying to connect...")
@@ -118,14 +127,16 @@ class DAQConnection(BaseDAQConnection):
 
     :param in_queue: queue for incoming data
     :type in_queue: multiprocessing.Queue
-    :param out_queue: queue for outgoing data
+    :param out_queue: queue for outgoing (receive time, line) tuples
     :type out_queue: multiprocessing.Queue
     :param logger: logger object
     :type logger: logging.Logger
+    :param device: serial device of the DAQ card
+    :type device: str
     """
 
-    def __init__(self, in_queue, out_queue, logger=None):
-        BaseDAQConnection.__init__(self, logger)
+    def __init__(self, in_queue, out_queue, logger=None, device=None):
+        BaseDAQConnection.__init__(self, logger, device)
         self.in_queue = in_queue
         self.out_queue = out_queue
 
@@ -143,7 +154,7 @@ class DAQConnection(BaseDAQConnection):
             try:
                 if self.serial_port.inWaiting():
                     while self.serial_port.inWaiting():
-                        self.out_queue.put(self.serial_port.readline().strip())
+                        self.out_queue.put((monotonic(), self.serial_port.readline().strip()))
                     sleep_time = max(sleep_time / 2, min_sleep_time)
                 else:
                     sleep_time = min(1.5 * sleep_time, max_sleep_time)
@@ -201,10 +212,11 @@ class DAQServer(BaseDAQConnection):
     def __init__(self, address='127.0.0.1', port=5556, logger=None):
         BaseDAQConnection.__init__(self, logger)
         try:
-            self.socket = zmq.Context().socket(zmq.PAIR)
-            self.socket.bind("tcp://%s:%d" % (address, port))
-        except NameError:
+            import zmq
+        except ImportError:
             raise DAQMissingDependencyError("no zmq installed...")
+        self.socket = zmq.Context().socket(zmq.PAIR)
+        self.socket.bind("tcp://%s:%d" % (address, port))
 
     def serve(self):
         """
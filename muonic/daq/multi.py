@@ -0,0 +1,97 @@
+"""
+Reads several DAQ cards at once, e.g. the cards of a detector array
+which are connected to the same computer.
+"""
+from muonic.daq import DAQIOError
+from muonic.daq.provider import BaseDAQProvider
+
+
+__all__ = ["MultiDAQProvider"]
+
+
+class MultiDAQProvider(BaseDAQProvider):
+    """
+    Combines the providers of several DAQ cards. Each card keeps its own
+    reader process. Lines are taken from the cards round robin, the card
+    of the line returned by the last call to get is available as
+    last_card.
+
+    Commands are sent to all cards.
+
+    :param providers: providers of the cards, the index of a provider in
+                      the list is the id of its card
+    :type providers: list of BaseDAQProvider
+    :param logger: logger object
+    :type logger: logging.Logger
+    """
+
+    def __init__(self, providers, logger=None):
+        BaseDAQProvider.__init__(self, logger)
+        self.providers = list(providers)
+        if not self.providers:
+            raise ValueError("at least one DAQ provider is needed")
+
+        # index of the card of the line returned by the last call to get
+        self.last_card = None
+        self._next = 0
+
+    def get(self, *args):
+        """
+        Get the next line of the next card with data.
+
+        Raises DAQIOError if no card has data.
+
+        :param args: queue arguments
+        :type args: list
+        :returns: str or None -- next line of the card last_card
+        :raises: DAQIOError
+        """
+        count = len(self.providers)
+        for i in range(count):
+            index = (self._next + i) % count
+            provider = self.providers[index]
+            if not provider.data_available():
+                continue
+            line = provider.get(0)
+            self._next = (index + 1) % count
+            self.last_card = index
+            self.last_receive_time = provider.last_receive_time
+            return line
+        raise DAQIOError("Queue is empty")
+
+    def put(self, *args):
+        """
+        Send information to all DAQ cards.
+
+        :param args: queue arguments
+        :type args: list
+        :returns: None
+        """
+        for provider in self.providers:
+            provider.put(*args)
+
+    def data_available(self):
+        """
+        Tests if data is available from any DAQ card.
+
+        :returns: int -- number of lines waiting
+        """
+        return sum(int(provider.data_available()) for provider in self.providers)
+
+    @property
+    def finished(self):
+        return all(provider.finished for provider in self.providers)
+
+    @finished.setter
+    def finished(self, value):
+        # set by BaseDAQProvider, derived from the cards
+        pass
+
+    def close(self):
+        """
+        Close the providers of all cards.
+
+        :returns: None
+        """
+        for provider in self.providers:
+            provider.close()
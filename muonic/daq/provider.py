@@ -4,23 +4,16 @@ Provides the public interfaces to read from and send to a DAQ card
 
 from __future__ import print_function
 import abc
-from future.utils import with_metaclass
 import logging
 import multiprocessing as mp
 import re
 import queue
-
-try:
-    import zmq
-except ImportError:
-    # DAQMissingDependencyError will be raised when trying to use zmq
-    pass
+import signal
 
 from muonic.daq import DAQIOError, DAQMissingDependencyError
-from muonic.daq import DAQSimulationConnection, DAQConnection
 
 
-class BaseDAQProvider(with_metaclass(abc.ABCMeta, object)):
+class BaseDAQProvider(object, metaclass=abc.ABCMeta):
     """
     Base class defining the public API and helpers for the
     DAQ provider implementations
@@ -36,6 +29,18 @@ class BaseDAQProvider(with_metaclass(abc.ABCMeta, object)):
             logger = logging.getLogger(self.__module__ + '.' + self.__class__.__name__)
         self.logger = logger
 
+        # monotonic host time at which the line returned by the last call
+        # to get was received, None if unknown
+        self.last_receive_time = None
+
+        # identifies the DAQ card, e.g. to cache its configuration, None
+        # if unknown
+        self.device_id = None
+
+        # True if the provider will not deliver any more data, e.g. at the
+        # end of a replayed file
+        self.finished = False
+
     @abc.abstractmethod
     def get(self, *args):
         """
@@ -67,6 +72,14 @@ class BaseDAQProvider(with_metaclass(abc.ABCMeta, object)):
         """
         return
 
+    def close(self):
+        """
+        Release the resources of the provider at the end of a measurement.
+
+        :returns: None
+        """
+        pass
+
     def _validate_line(self, line):
         """
         Validate line against pattern. Returns None it the provided line is
@@ -79,38 +92,87 @@ class BaseDAQProvider(with_metaclass(abc.ABCMeta, object)):
         if self.LINE_PATTERN.match(line) is None:
             # Do something more sensible here, like stopping the DAQ then
             # wait until service is restarted?
-            self.logger.warning("Got garbage from the DAQ: %s" %
+            self.logger.warning("Got garbage from the DAQ: %s",
                                 line.rstrip('\r\n'))
             return None
         return line
 
 
+def _read_to_archive(daq, archive):
+    """
+    Main function of the reader process in acquisition only mode. Lines
+    are written to the archive instead of being passed to the main
+    process, except for replies to commands and status messages.
+
+    :param daq: DAQ connection
+    :type daq: object
+    :param archive: path of the archive
+    :type archive: str
+    :returns: None
+    """
+    from muonic.daq.archive import ArchiveSink, ArchiveWriter
+
+    def terminate(signum, frame):
+        raise SystemExit(0)
+
+    # the main process terminates the reader at the end of the measurement
+    signal.signal(signal.SIGTERM, terminate)
+
+    writer = ArchiveWriter(archive)
+    daq.out_queue = ArchiveSink(daq.out_queue, writer)
+    try:
+        daq.read()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        writer.close()
+
+
 class DAQProvider(BaseDAQProvider):
     """
     DAQProvider
 
+    If an archive is given, the reader process writes the data to the
+    archive and passes only replies to commands and status messages on.
+
     :param logger: logger object
     :type logger: logging.Logger
     :param sim: enables DAQ simulation if set to True
     :type sim: bool
+    :param archive: path of the archive for acquisition only mode
+    :type archive: str
+    :param device: serial device of the DAQ card, found automatically if
+                   not given; the name of the card in simulation mode
+    :type device: str
     """
 
-    def __init__(self, logger=None, sim=False):
+    def __init__(self, logger=None, sim=False, archive=None, device=None):
         BaseDAQProvider.__init__(self, logger)
+        self.archive = archive
         self.out_queue = mp.Queue()
         self.in_queue = mp.Queue()
 
+        # only load the modules (and their dependencies) of the
+        # connection in use
         if sim:
+            from muonic.daq.simulation import DAQSimulationConnection
             self.daq = DAQSimulationConnection(self.in_queue, self.out_queue,
-                                               self.logger)
+                                               self.logger, device)
         else:
+            from muonic.daq.connection import DAQConnection
             self.daq = DAQConnection(self.in_queue, self.out_queue,
-                                     self.logger)
+                                     self.logger, device)
+        self.device_id = self.daq.device_id
         
         # Set up the thread to do asynchronous I/O. More can be made if
         # necessary. Set daemon flag so that the threads finish when the main
         # app finishes
-        self.read_thread = mp.Process(target=self.daq.read, name="pREADER")
+        if archive is not None:
+            self.logger.info("Writing DAQ data to %s" % archive)
+            self.read_thread = mp.Process(target=_read_to_archive, args=(self.daq, archive),
+                                          name="pREADER")
+        else:
+            self.read_thread = mp.Process(target=self.daq.read, name="pREADER")
         self.read_thread.daemon = True
         self.read_thread.start()
 
@@ -132,7 +194,7 @@ class DAQProvider(BaseDAQProvider):
         :raises: DAQIOError
         """
         try:
-            line = self.out_queue.get(*args)
+            self.last_receive_time, line = self.out_queue.get(*args)
         except queue.Empty:
             raise DAQIOError("Queue is empty")
 
@@ -161,6 +223,17 @@ class DAQProvider(BaseDAQProvider):
             size = not self.out_queue.empty()
         return size
 
+    def close(self):
+        """
+        Stop the reader process in acquisition only mode, so it completes
+        the archive.
+
+        :returns: None
+        """
+        if self.archive is not None and self.read_thread.is_alive():
+            self.read_thread.terminate()
+            self.read_thread.join()
+
 
 class DAQClient(BaseDAQProvider):
     """
@@ -180,10 +253,12 @@ class DAQClient(BaseDAQProvider):
     def __init__(self, address='127.0.0.1', port=5556, logger=None):
         BaseDAQProvider.__init__(self, logger)
         try:
-            self.socket = zmq.Context().socket(zmq.PAIR)
-            self.socket.connect("tcp://%s:%d" % (address, port))
-        except NameError:
+            import zmq
+        except ImportError:
             raise DAQMissingDependencyError("no zmq installed...")
+        self.socket = zmq.Context().socket(zmq.PAIR)
+        self.socket.connect("tcp://%s:%d" % (address, port))
+        self.device_id = "tcp://%s:%d" % (address, port)
 
     def get(self, *args):
         """
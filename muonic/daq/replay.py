@@ -0,0 +1,151 @@
+"""
+Provides archived raw DAQ data in place of a DAQ card, so measurements
+can be analyzed again later.
+"""
+import bz2
+import gzip
+
+from muonic.daq import DAQIOError
+from muonic.daq.archive import ArchiveReader
+from muonic.daq.provider import BaseDAQProvider
+
+
+__all__ = ["open_raw_file", "ReplayProvider"]
+
+
+def open_raw_file(path):
+    """
+    Open raw data file for reading. Files compressed with gzip or bzip2
+    are recognized by their extension.
+
+    :param path: path of the raw data file
+    :type path: str
+    :returns: file object
+    """
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", errors="replace")
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rt", errors="replace")
+    return open(path, errors="replace")
+
+
+class ReplayProvider(BaseDAQProvider):
+    """
+    Reads the lines of raw data files, one file after another, as fast as
+    they are requested. Commands for the DAQ card are ignored.
+
+    If follow is set, archives written in acquisition only mode are read
+    while they are written, until the acquisition ends.
+
+    :param files: paths of the raw data files
+    :type files: list of str
+    :param follow: follow archives while they are written
+    :type follow: bool
+    :param logger: logger object
+    :type logger: logging.Logger
+    """
+
+    def __init__(self, files, follow=False, logger=None):
+        BaseDAQProvider.__init__(self, logger)
+        if isinstance(files, str):
+            files = [files]
+        self.files = list(files)
+        self.follow = follow
+        self.current_file = None
+        self.line_count = 0
+
+        self._pending = list(self.files)
+        self._file = None
+        self._next_line = None
+        self._read_ahead()
+
+    def _read_ahead(self):
+        """
+        Read the next non-empty line, opening the next file if necessary
+
+        :returns: None
+        """
+        self._next_line = None
+        while True:
+            if self._file is None:
+                if not self._pending:
+                    self.finished = True
+                    return
+                self.current_file = self._pending.pop(0)
+                self.logger.info("Replaying %s" % self.current_file)
+                if self.follow:
+                    self._file = ArchiveReader(self.current_file, follow=True, logger=self.logger)
+                else:
+                    self._file = open_raw_file(self.current_file)
+
+            try:
+                line = self._file.readline()
+            except (EOFError, OSError) as e:
+                # e.g. an archive of an acquisition which crashed
+                self.logger.warning("Could not read %s to the end: %s" % (self.current_file, e))
+                line = ""
+
+            if not line:
+                if not getattr(self._file, "finished", True):
+                    # the archive is still written, more lines may follow
+                    return
+                self._file.close()
+                self._file = None
+                continue
+
+            line = line.strip()
+            if line:
+                self._next_line = line
+                return
+
+    def get(self, *args):
+        """
+        Get the next line of the raw data.
+
+        Raises DAQIOError if all files are read.
+
+        :param args: ignored, for compatibility with the other providers
+        :type args: list
+        :returns: str or None -- next line of the raw data
+        :raises: DAQIOError
+        """
+        line = self._next_line
+        if line is None:
+            raise DAQIOError("End of raw data")
+        self._read_ahead()
+        self.line_count += 1
+        return self._validate_line(line)
+
+    def put(self, *args):
+        """
+        Commands cannot be sent to the card of an archived measurement,
+        they are ignored.
+
+        :param args: queue arguments
+        :type args: list
+        :returns: None
+        """
+        self.logger.debug("Ignoring DAQ command %s during replay", args[0] if args else '')
+
+    def data_available(self):
+        """
+        Tests if there are lines left.
+
+        :returns: bool
+        """
+        if self._next_line is None and not self.finished:
+            self._read_ahead()
+        return self._next_line is not None
+
+    def close(self):
+        """
+        Stop the replay and close the current file.
+
+        :returns: None
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._pending = []
+        self._next_line = None
+        self.finished = True
@@ -3,7 +3,6 @@ Provides a simple DAQ card simulation, so that software can be tested.
 """
 from __future__ import print_function
 import abc
-from future.utils import with_metaclass
 import logging
 import numpy as np
 from os import path
@@ -11,12 +10,6 @@ import queue
 from random import choice
 import time
 
-try:
-    import zmq
-except ImportError:
-    # DAQMissingDependencyError will be raised when trying to use zmq
-    pass
-
 from muonic.daq import DAQMissingDependencyError
 
 
@@ -33,6 +26,8 @@ class DAQSimulation(object):
     DEFAULT_SIMULATION_FILE = path.abspath(path.join(
             path.dirname(__file__), "simdaq.txt"))
     LINES_TO_PUSH = 10
+    # initial content of the configuration registers reported by DC
+    CHANNEL_CONFIG = [0x2F, 0x0C, 0x00, 0x00]
 
     def __init__(self, logger, simulation_file=None):
         self.logger = logger
@@ -46,6 +41,9 @@ class DAQSimulation(object):
         self._daq = open(self._simulation_file)
         self._in_waiting = True
         self._return_info = False
+        self._responses = []
+        self._thresholds = [300, 300, 300, 300]
+        self._registers = list(self.CHANNEL_CONFIG)
 
         self._scalars_ch = [0, 0, 0, 0]
         self._scalars_trigger = 0
@@ -81,11 +79,14 @@ class DAQSimulation(object):
         def format_scalar(val):
             return format_to_8digits(hex(val)[2:])
 
+        def threshold_factor(threshold):
+            # noise dominates at low thresholds, the efficiency drops at
+            # high thresholds, with a plateau in between
+            return (1 + np.exp((100 - threshold) / 25.)) / (1 + np.exp((threshold - 600) / 40.))
+
         # draw rates from a poisson distribution.
-        self._scalars_ch[0] += poisson_choice(12, 100)
-        self._scalars_ch[1] += poisson_choice(10, 100)
-        self._scalars_ch[2] += poisson_choice(8, 100)
-        self._scalars_ch[3] += poisson_choice(11, 100)
+        for ch, rate in enumerate([12, 10, 8, 11]):
+            self._scalars_ch[ch] += poisson_choice(rate * threshold_factor(self._thresholds[ch]), 100)
         self._scalars_trigger += poisson_choice(2, 100)
         self._scalars_to_return = 'DS S0=%s S1=%s S2=%s S3=%s S4=%s' % \
                                   (format_scalar(self._scalars_ch[0]),
@@ -93,7 +94,7 @@ class DAQSimulation(object):
                                    format_scalar(self._scalars_ch[2]),
                                    format_scalar(self._scalars_ch[3]),
                                    format_scalar(self._scalars_trigger))
-        self.logger.debug("Scalars to return %s" % self._scalars_to_return)
+        self.logger.debug("Scalars to return %s", self._scalars_to_return)
 
 #        print("DEBUG DAQSimulation._physics END")
 
@@ -112,6 +113,9 @@ class DAQSimulation(object):
             self._return_info = False
             return self._scalars_to_return
 
+        if self._responses:
+            return self._responses.pop(0)
+
         self._pushed_lines += 1
         if self._pushed_lines < self.LINES_TO_PUSH:
             line = self._daq.readline()
@@ -134,10 +138,24 @@ class DAQSimulation(object):
         :type command: str
         :returns: None
         """
-        self.logger.debug("got the following command %s" % command)
+        self.logger.debug("got the following command %s", command)
         if "DS" in command:
             self._return_info = True
 
+        # answer the configuration queries like the card does
+        args = command.split()
+        if args and args[0] == "TL":
+            if len(args) == 3:
+                self._thresholds[int(args[1])] = int(args[2])
+            else:
+                self._responses.append("TL L0=%d L1=%d L2=%d L3=%d" % tuple(self._thresholds))
+        elif args and args[0] == "DC":
+            self._responses.append("DC C0=%02X C1=%02X C2=%02X C3=%02X" % tuple(self._registers))
+        elif args and args[0] == "WC" and len(args) == 3:
+            register = int(args[1], 16)
+            if register < len(self._registers):
+                self._registers[register] = int(args[2], 16)
+
     def in_waiting(self):
         """
         Simulate a busy DAQ.
@@ -157,20 +175,23 @@ class DAQSimulation(object):
             return False
 
 
-class BaseDAQSimulationConnection(with_metaclass(abc.ABCMeta, object)):
+class BaseDAQSimulationConnection(object, metaclass=abc.ABCMeta):
     """
     Base class for a simulated connection to DAQ card.
 
     :param logger: logger object
     :type logger: logging.Logger
+    :param device: name of the simulated card
+    :type device: str
     """
 
-    def __init__(self, logger=None):
+    def __init__(self, logger=None, device=None):
         if logger is None:
             logger = logging.getLogger()
         self.logger = logger
         self.serial_port = DAQSimulation(self.logger)
         self.running = 1
+        self.device_id = device or "simulation"
 
     @abc.abstractmethod
     def read(self):
@@ -188,14 +209,16 @@ class DAQSimulationConnection(BaseDAQSimulationConnection):
 
     :param in_queue: queue for incoming data
     :type in_queue: multiprocessing.Queue
-    :param out_queue: queue for outgoing data
+    :param out_queue: queue for outgoing (receive time, line) tuples
     :type out_queue: multiprocessing.Queue
     :param logger: logger object
     :type logger: logging.Logger
+    :param device: name of the simulated card
+    :type device: str
     """
 
-    def __init__(self, in_queue, out_queue, logger=None):
-        BaseDAQSimulationConnection.__init__(self, logger)
+    def __init__(self, in_queue, out_queue, logger=None, device=None):
+        BaseDAQSimulationConnection.__init__(self, logger, device)
         self.in_queue = in_queue
         self.out_queue = out_queue
 
@@ -207,7 +230,7 @@ class DAQSimulationConnection(BaseDAQSimulationConnection):
         """
         while self.running:
             try:
-                self.logger.debug("inqueue size is %d" % self.in_queue.qsize())
+                self.logger.debug("inqueue size is %d", self.in_queue.qsize())
                 while self.in_queue.qsize():
                     try:
                         self.serial_port.write(str(self.in_queue.get(0)) +
@@ -224,7 +247,7 @@ class DAQSimulationConnection(BaseDAQSimulationConnection):
                         pass
 
             while self.serial_port.in_waiting():
-                self.out_queue.put(self.serial_port.readline().strip())
+                self.out_queue.put((time.monotonic(), self.serial_port.readline().strip()))
             time.sleep(0.02)
 
 
@@ -246,10 +269,11 @@ class DAQSimulationServer(BaseDAQSimulationConnection):
     def __init__(self, address='127.0.0.1', port=5556, logger=None):
         BaseDAQSimulationConnection.__init__(self, logger)
         try:
-            self.socket = zmq.Context().socket(zmq.PAIR)
-            self.socket.bind("tcp://%s:%d" % (address, port))
-        except NameError:
+            import zmq
+        except ImportError:
             raise DAQMissingDependencyError("no zmq installed...")
+        self.socket = zmq.Context().socket(zmq.PAIR)
+        self.socket.bind("tcp://%s:%d" % (address, port))
 
     def serve(self):
         """
@@ -0,0 +1,457 @@
+"""
+Live coincidences between the events of several muonic stations.
+
+Stations publish their events with the GPS time to an aggregator over a
+TCP connection, one JSON object per line:
+
+    {"type": "hello", "station": "school-a"}
+    {"type": "event", "station": "school-a", "card": 0, "time_ns": 1718000000123456000,
+     "pulses": [0.0, [[0.0, 21.25]], [], [], []]}
+    {"type": "heartbeat", "station": "school-a", "time_ns": 1718000001000000000}
+
+"time_ns" is the GPS time in ns since 1970-01-01. Heartbeats tell the
+aggregator that the station has no earlier events any more.
+
+The aggregator merges the events of all stations by their time and
+looks for events of several stations within a short time window, e.g.
+the particles of an extensive air shower.
+"""
+import collections
+import datetime
+import json
+import logging
+import queue
+import socket
+import socketserver
+import threading
+import time
+
+from .analyzers import EPOCH
+from .merge import TimeOrderedMerger
+from .metrics import REGISTRY
+
+
+__all__ = ["parse_address", "time_to_ns", "EventPublisher", "StationCoincidenceFinder", "Aggregator"]
+
+
+def parse_address(address, default_host="127.0.0.1"):
+    """
+    Split an address like 'host:port' or 'port'
+
+    Raises ValueError if the port is invalid.
+
+    :param address: address
+    :type address: str
+    :param default_host: host if only a port is given
+    :type default_host: str
+    :returns: tuple of host (str) and port (int)
+    :raises: ValueError
+    """
+    host, _, port = str(address).rpartition(":")
+    port = int(port)
+    if not 0 < port < 65536:
+        raise ValueError("invalid port %d" % port)
+    return host or default_host, port
+
+
+def time_to_ns(timestamp):
+    """
+    Convert a data time into ns since 1970-01-01 without rounding errors
+
+    :param timestamp: time of the data
+    :type timestamp: datetime.datetime
+    :returns: int
+    """
+    delta = timestamp - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000000 + delta.microseconds * 1000
+
+
+class EventPublisher(object):
+    """
+    Sends the events of a measurement to an aggregator. Used in the
+    analyzer chain of the App after the pulse extraction; needs the
+    data times of the pulse extractor.
+
+    Events are sent by a separate thread, so a slow or unreachable
+    aggregator does not delay the measurement. If the aggregator cannot
+    keep up, events are dropped and counted. The connection is retried
+    until the publisher is stopped.
+
+    :param address: address of the aggregator, 'host:port'
+    :type address: str
+    :param station_id: name of the station
+    :type station_id: str
+    :param queue_size: maximum number of events waiting to be sent
+    :type queue_size: int
+    :param heartbeat_interval: interval of the heartbeats in s of data time
+    :type heartbeat_interval: float
+    :param retry_interval: seconds between connection attempts
+    :type retry_interval: float
+    :param logger: logger object
+    :type logger: logging.Logger
+    """
+
+    def __init__(self, address, station_id, queue_size=10000, heartbeat_interval=1.0, retry_interval=5.0,
+                 logger=None):
+        if logger is None:
+            logger = logging.getLogger(self.__module__ + '.' + self.__class__.__name__)
+        self.logger = logger
+        self.address = parse_address(address)
+        self.station_id = str(station_id)
+        self.heartbeat_interval = int(heartbeat_interval * 1e9)
+        self.retry_interval = retry_interval
+
+        self._queue = queue.Queue(queue_size)
+        self._last_heartbeat = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        self._sent_counter = REGISTRY.counter("muonic_published_events_total", "Events sent to the aggregator")
+        self._dropped_counter = REGISTRY.counter("muonic_dropped_total", "Data dropped in the pipeline",
+                                                 reason="publish")
+        REGISTRY.gauge("muonic_queue_depth", "Number of items waiting in a queue",
+                       function=lambda: self._queue.qsize(), queue="publish")
+
+    def __call__(self, msg):
+        if 'pulses' in msg:
+            if msg.get('event_time') is not None:
+                time_ns = time_to_ns(msg['event_time'])
+                self._send({"type": "event", "station": self.station_id, "card": msg.get('card', 0),
+                            "time_ns": time_ns, "pulses": list(msg['pulses'])})
+                self._last_heartbeat = time_ns
+        elif msg.get('data_time') is not None:
+            time_ns = time_to_ns(msg['data_time'])
+            if self._last_heartbeat is None or time_ns - self._last_heartbeat >= self.heartbeat_interval:
+                self._send({"type": "heartbeat", "station": self.station_id, "time_ns": time_ns})
+                self._last_heartbeat = time_ns
+        return True
+
+    def _send(self, message):
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            self._dropped_counter.value += 1
+
+    def start(self):
+        """
+        Start the sender thread
+
+        :returns: None
+        """
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="tPUBLISHER")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        """
+        Send the waiting events, at most for timeout seconds, and stop
+        the sender thread
+
+        :param timeout: seconds to wait for the waiting events to be sent
+        :type timeout: float
+        :returns: None
+        """
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _connect(self):
+        while not self._stop_event.is_set():
+            try:
+                connection = socket.create_connection(self.address, timeout=self.retry_interval)
+            except OSError as e:
+                self.logger.warning("Could not connect to aggregator %s:%d: %s" % (self.address + (e,)))
+                self._stop_event.wait(self.retry_interval)
+                continue
+            connection.sendall(self._encode({"type": "hello", "station": self.station_id}))
+            self.logger.info("Publishing events to aggregator %s:%d" % self.address)
+            return connection
+        return None
+
+    @staticmethod
+    def _encode(message):
+        return json.dumps(message, separators=(",", ":")).encode("utf-8") + b"\n"
+
+    def _run(self):
+        connection = None
+        while True:
+            try:
+                message = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                if self._stop_event.is_set():
+                    break
+                continue
+
+            while True:
+                if connection is None:
+                    connection = self._connect()
+                    if connection is None:
+                        # stopped while the aggregator was unreachable
+                        return
+                try:
+                    connection.sendall(self._encode(message))
+                    self._sent_counter.value += 1
+                    break
+                except OSError as e:
+                    self.logger.warning("Lost connection to aggregator: %s" % e)
+                    connection.close()
+                    connection = None
+
+        if connection is not None:
+            connection.close()
+
+
+class StationCoincidenceFinder(object):
+    """
+    Finds events of several stations within a time window in a time
+    ordered event stream. A coincidence starts with its earliest event
+    and contains all events within window ns after it.
+
+    :param window: coincidence window in ns
+    :type window: int
+    :param min_stations: minimum number of different stations
+    :type min_stations: int
+    :param callback: called with the list of (station, event) tuples of
+                     each coincidence
+    :type callback: callable
+    """
+
+    def __init__(self, window=10000, min_stations=2, callback=None):
+        self.window = window
+        self.min_stations = min_stations
+        self.callback = callback
+        self.count = 0
+        self._events = []
+
+    def add(self, station, event):
+        """
+        Add the next event of the time ordered stream
+
+        :param station: station of the event
+        :type station: str
+        :param event: the event message
+        :type event: dict
+        :returns: None
+        """
+        if self._events and event["time_ns"] - self._events[0][1]["time_ns"] > self.window:
+            self.flush()
+        self._events.append((station, event))
+
+    def flush(self):
+        """
+        Complete the current candidate, e.g. at the end of the stream
+
+        :returns: None
+        """
+        events, self._events = self._events, []
+        if len(set(station for station, _ in events)) >= self.min_stations:
+            self.count += 1
+            if self.callback is not None:
+                self.callback(events)
+
+
+class _StationRequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        station = None
+        messages = self.server.messages
+        try:
+            for line in self.rfile:
+                try:
+                    message = json.loads(line.decode("utf-8"))
+                    station = str(message["station"])
+                except (ValueError, KeyError, TypeError):
+                    self.server.logger.warning("Invalid message from %s:%d" % self.client_address[:2])
+                    continue
+                messages.put((station, message))
+        except OSError as e:
+            self.server.logger.warning("Connection to %s failed: %s" % (station, e))
+        finally:
+            if station is not None:
+                messages.put((station, None))
+
+
+class _AggregatorServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class Aggregator(object):
+    """
+    Receives the events of several stations, merges them by time and
+    finds coincidences between the stations.
+
+    Coincidences are logged and written to output, one per line: time of
+    the first event, number of stations and, for each event, its station,
+    card and delay to the first event in ns.
+
+    :param address: address to listen on, 'host:port'
+    :type address: str
+    :param output: file to append the coincidences to
+    :type output: str
+    :param window: coincidence window in ns
+    :type window: int
+    :param min_stations: minimum number of stations of a coincidence
+    :type min_stations: int
+    :param max_delay: maximum time in s to wait for the events of slow
+                      stations
+    :type max_delay: float
+    :param max_events: maximum number of events waiting to be merged
+    :type max_events: int
+    :param logger: logger object
+    :type logger: logging.Logger
+    """
+
+    def __init__(self, address, output=None, window=10000, min_stations=2, max_delay=5.0, max_events=100000,
+                 logger=None):
+        if logger is None:
+            logger = logging.getLogger(self.__module__ + '.' + self.__class__.__name__)
+        self.logger = logger
+        self.address = parse_address(address, default_host="0.0.0.0")
+        self.output = output
+        self.running = False
+
+        self.messages = queue.Queue()
+        self.merger = TimeOrderedMerger(max_delay=max_delay, max_items=max_events, name="aggregator",
+                                        logger=self.logger)
+        self.finder = StationCoincidenceFinder(window, min_stations, self.coincidence_found)
+        # connections per station, a station may reconnect before its
+        # old connection is closed
+        self._connections = collections.Counter()
+
+        self._event_counters = {}
+        self._coincidence_counter = REGISTRY.counter("muonic_coincidences_total",
+                                                     "Coincidences between stations")
+
+        self._server = None
+        self._thread = None
+        self._file = None
+
+    def start(self):
+        """
+        Listen for stations
+
+        :returns: None
+        """
+        if self.output is not None:
+            self._file = open(self.output, "a")
+        self._server = _AggregatorServer(self.address, _StationRequestHandler)
+        self._server.messages = self.messages
+        self._server.logger = self.logger
+        self._thread = threading.Thread(target=self._server.serve_forever, name="tAGGREGATOR")
+        self._thread.daemon = True
+        self._thread.start()
+        self.running = True
+        self.logger.info("Listening for stations on %s:%d" % self.address)
+
+    def stop(self, *args):
+        """
+        Stop waiting for events, also used as signal handler
+
+        :returns: None
+        """
+        self.running = False
+
+    def close(self):
+        """
+        Stop listening, analyze the waiting events and close the output
+
+        :returns: None
+        """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+        self._process_messages()
+        self._analyze(self.merger.flush())
+        self.finder.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self.logger.info("Found %d coincidences" % self.finder.count)
+
+    def run(self, duration=None):
+        """
+        Merge and analyze events until stopped or for duration seconds
+
+        :param duration: duration in seconds
+        :type duration: float
+        :returns: None
+        """
+        if self._server is None:
+            self.start()
+        end = time.monotonic() + duration if duration else None
+        try:
+            while self.running and (end is None or time.monotonic() < end):
+                try:
+                    station, message = self.messages.get(timeout=0.5)
+                except queue.Empty:
+                    pass
+                else:
+                    self._handle(station, message)
+                self._process_messages()
+                self._analyze(self.merger.pop_ready())
+        finally:
+            self.close()
+
+    def _process_messages(self):
+        while True:
+            try:
+                station, message = self.messages.get_nowait()
+            except queue.Empty:
+                return
+            self._handle(station, message)
+
+    def _handle(self, station, message):
+        if message is None:
+            self._connections[station] -= 1
+            if self._connections[station] <= 0:
+                del self._connections[station]
+                self.merger.remove_source(station)
+                self.logger.info("Station %s disconnected" % station)
+            return
+
+        kind = message.get("type")
+        if kind == "hello":
+            self._connections[station] += 1
+            self.merger.add_source(station)
+            self.logger.info("Station %s connected" % station)
+        elif kind == "heartbeat":
+            self.merger.advance(station, message["time_ns"] / 1e9)
+        elif kind == "event":
+            counter = self._event_counters.get(station)
+            if counter is None:
+                counter = REGISTRY.counter("muonic_aggregator_events_total", "Events received from stations",
+                                           station=station)
+                self._event_counters[station] = counter
+            counter.value += 1
+            self.merger.push(station, message["time_ns"] / 1e9, message)
+
+    def _analyze(self, events):
+        for station, event in events:
+            self.finder.add(station, event)
+
+    def coincidence_found(self, events):
+        """
+        Log and write a coincidence
+
+        :param events: (station, event) tuples of the coincidence
+        :type events: list
+        :returns: None
+        """
+        self._coincidence_counter.value += 1
+        first = events[0][1]["time_ns"]
+        first_time = EPOCH + datetime.timedelta(microseconds=first // 1000)
+        stations = sorted(set(station for station, _ in events))
+        self.logger.info("Coincidence of %s at %s" % (", ".join(stations), first_time.isoformat()))
+        if self._file is not None:
+            self._file.write("%s %d %s\n" % (first_time.isoformat(), len(stations), " ".join(
+                    "%s %d %d" % (station, event.get("card", 0), event["time_ns"] - first)
+                    for station, event in events)))
+            self._file.flush()
@@ -2,11 +2,40 @@
 from enum import Enum
 import logging
 import datetime
+import math
 import time
-import threading
 from muonic.daq.provider import BaseDAQProvider
+from .scheduler import SCHEDULER
 from .utils import DecayTriggerThorough, VelocityTrigger
 
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# channels of the DAQ card
+CHANNELS = range(4)
+
+
+def _check_options(options, channels=(), non_negative=()):
+    """
+    Check options before configuring an analyzer. Values which are no
+    numbers are rejected by BaseAnalyzer.configure.
+
+    :param options: options to change
+    :type options: dict
+    :param channels: options which have to be a channel of the DAQ card
+    :type channels: tuple of str
+    :param non_negative: options which must not be negative
+    :type non_negative: tuple of str
+    :raises: ValueError
+    :returns: None
+    """
+    for option, value in options.items():
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            continue
+        if (option in channels and value not in CHANNELS) or (option in non_negative and value < 0):
+            raise ValueError("invalid value for %s: %r" % (option, options[option]))
+
 
 class DataTypes(Enum):
     """
@@ -17,6 +46,7 @@ class DataTypes(Enum):
     PULSE = 3
     DECAY = 4
     VELOCITY = 5
+    PLATEAU = 6
 
     def __eq__(self, other):
         return self.value == other or self.name == other
@@ -32,6 +62,13 @@ class BaseAnalyzer(object):
 
     RESULT_DATA_TYPES = []
 
+    # analyzers with a defined end, like scans, which set completed
+    CAN_COMPLETE = False
+
+    # options which can be changed on a running analyzer, mapped to the
+    # attribute holding the option and its type
+    CONFIGURABLE = {}
+
     def __init__(self, consumers=[], logger=None):
         if logger is None:
             logger = logging.getLogger(self.__module__ + '.' + self.__class__.__name__)
@@ -43,10 +80,52 @@ class BaseAnalyzer(object):
         self._last_daq = None
         self.consumers = consumers
         self.current_run_id = None
+        # periodic jobs are registered with the shared scheduler
+        self.scheduler = SCHEDULER
+        # set by analyzers which can complete when they are done; the App
+        # ends the measurement once all of them are done
+        self.completed = False
 
     def __call__(self, *args, **kwargs):
         return self.calculate(*args)
 
+    def configure(self, **options):
+        """
+        Change options of the analyzer, also while it is running.
+
+        Raises ValueError if an option cannot be changed or has an
+        invalid value.
+
+        :param options: options to change, see CONFIGURABLE
+        :type options: dict
+        :raises: ValueError
+        :returns: None
+        """
+        unknown = sorted(set(options) - set(self.CONFIGURABLE))
+        if unknown:
+            raise ValueError("%s cannot configure %s" % (self.__class__.__name__, ", ".join(unknown)))
+
+        values = {}
+        for option, value in options.items():
+            attribute, option_type = self.CONFIGURABLE[option]
+            try:
+                values[attribute] = option_type(value)
+            except (TypeError, ValueError):
+                raise ValueError("invalid value for %s: %r" % (option, value))
+
+        for attribute, value in values.items():
+            setattr(self, attribute, value)
+        self.logger.info("Configured %s" % ", ".join("%s=%s" % item for item in sorted(options.items())))
+
+    def result_streams(self):
+        """
+        Names and result data types under which the results are passed to
+        the consumers
+
+        :returns: list of (str, list of DataTypes) tuples
+        """
+        return [(self.__class__.__name__, self.RESULT_DATA_TYPES)]
+
     def calculate(self, msg):
         """
         Calculates data related to this analyzer.
@@ -106,8 +185,7 @@ class BaseAnalyzer(object):
                 self._last_daq = self.daq
                 self._active = False
 
-                for consumer in self.consumers:
-                    consumer.stop(self.current_run_id, self.__class__.__name__)
+                self._stop_consumers()
 
                 self.current_run_id = None
                 self.daq = None
@@ -136,8 +214,7 @@ class BaseAnalyzer(object):
             if not self.active:
                 self._active = True
 
-                for consumer in self.consumers:
-                    consumer.start(run_id, self.__class__.__name__, self.RESULT_DATA_TYPES)
+                self._start_consumers(run_id)
         else:
             self._last_run_id = run_id
             self._last_daq = daq
@@ -162,14 +239,33 @@ class BaseAnalyzer(object):
             return
 
         if not self.disabled:
-            for consumer in self.consumers:
-                consumer.stop(self.current_run_id, self.__class__.__name__)
+            self._stop_consumers()
 
             self.current_run_id = None
             self._active = False
 
         # print("DEBUG BaseAnalyzer.stop END")
 
+    def _start_consumers(self, run_id):
+        """
+        Announce the start of a run to all consumers
+
+        :param run_id: unique id of the current run
+        :type run_id: UUID
+        :returns: None
+        """
+        for consumer in self.consumers:
+            consumer.start(run_id, self.__class__.__name__, self.RESULT_DATA_TYPES)
+
+    def _stop_consumers(self):
+        """
+        Announce the end of the current run to all consumers
+
+        :returns: None
+        """
+        for consumer in self.consumers:
+            consumer.stop(self.current_run_id, self.__class__.__name__)
+
     def daq_put(self, msg):
         """
         Send message to DAQ cards. Reuses the connection of the parent widget
@@ -215,7 +311,7 @@ class DummyAnalyzer(BaseAnalyzer):
     def calculate(self, msg):
         raw_msg = msg.get('raw')
         if 'pulses' in msg:
-            self.logger.debug('Pulses: %s' % str(msg.get('pulses')))
+            self.logger.debug('Pulses: %s', msg.get('pulses'))
         else:
             self.logger.debug('Message has no pulses')
         self.publish(raw_msg, DataTypes.RAW)
@@ -226,6 +322,7 @@ class RateAnalyzer(BaseAnalyzer):
 
     RESULT_DATA_TYPES = [DataTypes.RATE]
     SCALAR_BUF_SIZE = 5
+    CONFIGURABLE = {'time_window': ('update_interval', float)}
 
     def __init__(self, consumers=[], logger=None, **options):
         # print("DEBUG RateAnalyzer.__init__ START")
@@ -235,6 +332,13 @@ class RateAnalyzer(BaseAnalyzer):
         # time window for updates
         self.update_interval = float(options.get('time_window', 1.0))
 
+        # when replaying raw data, the scalars are not queried but taken
+        # from the data, together with the time of the data
+        self.replay = bool(options.get('replay'))
+
+        # with several DAQ cards, the scalars of this card are used
+        self.rate_card = int(options.get('rate_card') or 0)
+
         # measurement start and duration
         self.measurement_duration = datetime.timedelta()
         self.start_time = datetime.datetime.utcnow()
@@ -266,10 +370,8 @@ class RateAnalyzer(BaseAnalyzer):
         # rates store
         self.rates = None
 
-        # setup update thread
-        self.update_thread = threading.Thread(target=self.update_loop)
-
-        self._joinable = False
+        # periodic scalar query
+        self._update_call = None
 
         # print("DEBUG RateAnalyzer.__init__ END")
 
@@ -288,8 +390,10 @@ class RateAnalyzer(BaseAnalyzer):
         # reset scalar buffer
         self.scalar_buffer = self.new_scalar_buffer()
 
-        # start update thread
-        self.init_update_thread()
+        # query the scalars periodically
+        if not self.replay and self.active and self._update_call is None:
+            self._update_call = self.scheduler.call_every(
+                self.update_interval, self.update, first_delay=0)
 
         # print("DEBUG RateAnalyzer.start END")
 
@@ -298,29 +402,44 @@ class RateAnalyzer(BaseAnalyzer):
 
         super().stop()
 
-        self.update_thread.join()
+        if self._update_call is not None:
+            self._update_call.cancel()
+            self._update_call = None
 
         # print("DEBUG RateAnalyzer.stop END")
 
-    def update_loop(self):
-        # print("DEBUG RateAnalyzer.update_loop START")
+    def configure(self, **options):
+        if 'time_window' in options and float(options['time_window']) <= 0:
+            raise ValueError("invalid value for time_window: %r" % options['time_window'])
+        super().configure(**options)
 
-        while self.active:
-            # send the rates to the consumers, clear buffer
-            if self.last_data and self.last_data['query_time'] != self.last_query_time \
-                    and self.last_data['time_window'] >= self.update_interval:
-                self.publish(self.last_data, DataTypes.RATE)
+        # query the scalars in the new interval
+        if 'time_window' in options and self._update_call is not None:
+            self._update_call.cancel()
+            self._update_call = self.scheduler.call_every(self.update_interval, self.update)
 
-            self.last_data = {}
+    def update(self):
+        """
+        Publish the rates of the last interval and query the DAQ card for
+        new scalars. Called by the scheduler every update interval.
 
-            # request new scalars
-            self.logger.debug('Query for scalars')
-            self.query_daq_for_scalars()
-            time.sleep(self.update_interval)
+        :returns: None
+        """
+        if not self.active:
+            return
+
+        # send the rates to the consumers, clear buffer. The queries are
+        # scheduled at a fixed pace, so the measured time windows scatter
+        # slightly around the update interval.
+        if self.last_data and self.last_data['query_time'] != self.last_query_time \
+                and self.last_data['time_window'] >= 0.95 * self.update_interval:
+            self.publish(self.last_data, DataTypes.RATE)
 
-        self._joinable = True
+        self.last_data = {}
 
-        # print("DEBUG RateAnalyzer.update_loop END")
+        # request new scalars
+        self.logger.debug('Query for scalars')
+        self.query_daq_for_scalars()
 
     def new_scalar_buffer(self):
         """
@@ -340,6 +459,19 @@ class RateAnalyzer(BaseAnalyzer):
         self.daq_put("DS")
         self.query_time = time.time()
 
+    def scalars_received(self, scalar_diffs, time_window):
+        """
+        Called with the counts of each interval between two scalar
+        queries. Does nothing, subclasses can evaluate the counts here.
+
+        :param scalar_diffs: counts of channel 0-3 and the trigger
+        :type scalar_diffs: list of int
+        :param time_window: length of the interval in seconds
+        :type time_window: float
+        :returns: None
+        """
+        pass
+
     def extract_scalars_from_message(self, msg):
         """
         Extracts the scalar values for channel 0-3 and
@@ -378,6 +510,18 @@ class RateAnalyzer(BaseAnalyzer):
 
             return True
 
+        if msg_dict.get('card', self.rate_card) != self.rate_card:
+            # the query for the scalars is sent to all cards
+            return True
+
+        if self.replay:
+            data_time = msg_dict.get('data_time')
+            if data_time is None:
+                # no time to relate the scalars to
+                return True
+            self.last_query_time = self.query_time
+            self.query_time = (data_time - EPOCH).total_seconds()
+
         # extract scalars from daq message
         scalars = self.extract_scalars_from_message(msg)
 
@@ -422,6 +566,8 @@ class RateAnalyzer(BaseAnalyzer):
         self.scalar_buffer = [x + scalar_diffs[i]
                               for i, x in enumerate(self.scalar_buffer)]
 
+        self.scalars_received(scalar_diffs, time_window)
+
         # get minimum and maximum rate
         # min_rate = min(self.rates[:5])
         # max_rate = max(self.rates[:5])
@@ -448,24 +594,217 @@ class RateAnalyzer(BaseAnalyzer):
             'query_time': datetime.datetime.utcfromtimestamp(self.query_time)
         }
 
+        # without the periodic update, publish the rates right away
+        if self.replay:
+            self.publish(self.last_data, DataTypes.RATE)
+            self.last_data = {}
+
 #        print("DEBUG RateAnalyzer.calculate END")
 
         return True
 
-    def init_update_thread(self):
-        # print("DEBUG RateAnalyzer.init_update_thread START")
 
-        if self.update_thread.is_alive():
+class PlateauScanAnalyzer(RateAnalyzer):
+    """
+    Scans the thresholds of the channels to find the plateau of their
+    rate curves.
+
+    All scanned channels are set to the same threshold, the scalars give
+    the rate of each channel. The scan starts with an even grid of
+    thresholds and measures each point until the counts reach the
+    requested precision or the maximum dwell time is over. Afterwards
+    the intervals next to points where the logarithmic rate curve bends
+    are refined, until nothing bends any more, the minimum step is reached
+    or the maximum number of points is measured.
+
+    At the end, the curves are published and the thresholds are set to
+    the flattest point of each curve.
+    """
+
+    RESULT_DATA_TYPES = [DataTypes.RATE, DataTypes.PLATEAU]
+
+    CAN_COMPLETE = True
+
+    def __init__(self, consumers=[], logger=None, **options):
+        super().__init__(consumers, logger, **options)
+
+        channels = options.get('scan_channels')
+        self.channels = sorted(set(int(ch) for ch in (range(4) if channels is None else channels)))
+        low, high = options.get('scan_range') or (20, 400)
+        self.min_threshold, self.max_threshold = int(min(low, high)), int(max(low, high))
+        self.initial_points = max(int(options.get('scan_points', 6)), 3)
+        self.min_step = max(int(options.get('scan_min_step', 5)), 1)
+        # relative statistical error at which a point is complete
+        self.precision = float(options.get('scan_precision', 0.05))
+        self.max_dwell = float(options.get('scan_max_dwell', 60.0))
+        self.max_points = max(int(options.get('scan_max_points', 30)), self.initial_points)
+
+        self._reset_scan()
+
+    def _reset_scan(self):
+        # threshold -> [counts of channel 0-3, live time]
+        self.points = {}
+        self.recommended = {}
+        self.current_threshold = None
+        self.completed = False
+        self._change_time = None
+
+        step = float(self.max_threshold - self.min_threshold) / (self.initial_points - 1)
+        self._pending = sorted(set(int(round(self.min_threshold + i * step))
+                                   for i in range(self.initial_points)))
+
+    def start(self, run_id, daq=None):
+        super().start(run_id, daq)
+        if not self.active:
             return
 
-        if self._joinable:
-            self.update_thread.join()
-            self._joinable = False
+        self._reset_scan()
+        self.logger.info("Scanning thresholds %d-%d mV of channels %s" %
+                         (self.min_threshold, self.max_threshold,
+                          ", ".join(str(ch) for ch in self.channels)))
+        self._next_point()
+
+    def _set_threshold(self, threshold):
+        """
+        Set the thresholds of the scanned channels
+
+        :param threshold: threshold in mV
+        :type threshold: int
+        :returns: None
+        """
+        for ch in self.channels:
+            self.daq_put("TL %d %d" % (ch, threshold))
+        self.current_threshold = threshold
+        self.points.setdefault(threshold, [[0] * 4, 0.0])
+        self._change_time = time.time()
+        self.logger.debug("Scan point %d mV", threshold)
+
+    def _next_point(self):
+        """
+        Continue with the next pending point, refine the curves if there
+        is none. Completes the scan if there is nothing to refine.
+
+        :returns: None
+        """
+        if not self._pending and len(self.points) < self.max_points:
+            self._pending = self._refine()[:self.max_points - len(self.points)]
+
+        if self._pending:
+            self._set_threshold(self._pending.pop(0))
+        else:
+            self._complete()
+
+    def scalars_received(self, scalar_diffs, time_window):
+        if self.completed or self.current_threshold is None:
+            return
+
+        if self.last_query_time <= self._change_time:
+            # the interval started before the thresholds were changed
+            return
+
+        point = self.points[self.current_threshold]
+        for ch in range(4):
+            point[0][ch] += scalar_diffs[ch]
+        point[1] += time_window
+
+        target = 1.0 / self.precision ** 2
+        if point[1] >= self.max_dwell or \
+                all(point[0][ch] >= target for ch in self.channels):
+            self._next_point()
+
+    def _log_rate(self, ch, threshold):
+        """
+        Logarithm of the rate of a channel and its statistical error
+
+        :param ch: channel
+        :type ch: int
+        :param threshold: threshold of the point
+        :type threshold: int
+        :returns: tuple of floats
+        """
+        counts, live_time = self.points[threshold]
+        # avoid the logarithm of zero for points without counts
+        n = counts[ch] + 0.5
+        return math.log(n / live_time), 1.0 / math.sqrt(n)
+
+    def _bends(self, ch, a, b, c):
+        """
+        Tests if the logarithmic rate curve of a channel bends at
+        threshold b, i.e. if the rate at b deviates significantly from
+        the interpolation of the rates at a and c.
+
+        :returns: bool
+        """
+        (la, sa), (lb, sb), (lc, sc) = [self._log_rate(ch, t) for t in (a, b, c)]
+        w = float(b - a) / (c - a)
+        deviation = abs(lb - (la + w * (lc - la)))
+        sigma = math.sqrt(sb ** 2 + ((1 - w) * sa) ** 2 + (w * sc) ** 2)
+        return deviation > max(3 * sigma, self.precision)
 
-        self.update_thread = threading.Thread(target=self.update_loop)
-        self.update_thread.start()
+    def _refine(self):
+        """
+        New points in the intervals next to the points where a curve
+        bends, as long as the intervals are wider than the minimum step
+
+        :returns: list of int
+        """
+        thresholds = sorted(t for t, point in self.points.items() if point[1] > 0)
+        candidates = set()
+        for a, b, c in zip(thresholds, thresholds[1:], thresholds[2:]):
+            if any(self._bends(ch, a, b, c) for ch in self.channels):
+                for low, high in ((a, b), (b, c)):
+                    if high - low >= 2 * self.min_step:
+                        candidates.add((low + high) // 2)
+        return sorted(candidates - set(self.points))
+
+    def plateau_threshold(self, ch):
+        """
+        Threshold at the flattest part of the rate curve of a channel
+
+        :param ch: channel
+        :type ch: int
+        :returns: int or None
+        """
+        thresholds = sorted(t for t, point in self.points.items() if point[1] > 0)
+        best = None
+        for a, b, c in zip(thresholds, thresholds[1:], thresholds[2:]):
+            slope = abs(self._log_rate(ch, c)[0] - self._log_rate(ch, a)[0]) / (c - a)
+            if best is None or slope < best[0]:
+                best = (slope, b)
+        return best[1] if best is not None else None
+
+    def _complete(self):
+        """
+        Publish the curves and set the thresholds to the plateaus
+
+        :returns: None
+        """
+        for threshold in sorted(self.points):
+            counts, live_time = self.points[threshold]
+            if live_time <= 0:
+                continue
+            self.publish({
+                'threshold': threshold,
+                'rates': [n / live_time for n in counts],
+                'errors': [math.sqrt(n) / live_time for n in counts],
+                'counts': counts,
+                'live_time': live_time
+            }, DataTypes.PLATEAU)
+
+        for ch in self.channels:
+            threshold = self.plateau_threshold(ch)
+            if threshold is None:
+                self.logger.warning("No plateau found for channel %d" % ch)
+                continue
+            self.recommended[ch] = threshold
+            self.daq_put("TL %d %d" % (ch, threshold))
+
+        self.logger.info("Plateau scan completed with %d points, thresholds set to %s" %
+                         (len(self.points), ", ".join("ch%d=%d mV" % item
+                                                      for item in sorted(self.recommended.items()))))
+        self.current_threshold = None
+        self.completed = True
 
-        # print("DEBUG RateAnalyzer.init_update_thread END")
 
 class DecayAnalyzer(BaseAnalyzer):
     """
@@ -475,6 +814,11 @@ class DecayAnalyzer(BaseAnalyzer):
     """
 
     RESULT_DATA_TYPES = [DataTypes.DECAY]
+    CONFIGURABLE = dict((option, (option, int)) for option in [
+        'min_single_pulse_width', 'max_single_pulse_width',
+        'min_double_pulse_width', 'max_double_pulse_width',
+        'single_pulse_channel', 'double_pulse_channel', 'veto_pulse_channel',
+        'decay_min_time'])
 
     def __init__(self, consumers=[], logger=None, **options):
         super().__init__(consumers, logger)
@@ -518,6 +862,12 @@ class DecayAnalyzer(BaseAnalyzer):
         self.previous_coinc_time_03 = time_03
         self.previous_coinc_time_02 = time_02
 
+    def configure(self, **options):
+        _check_options(options, channels=('single_pulse_channel', 'double_pulse_channel', 'veto_pulse_channel'),
+                       non_negative=('min_single_pulse_width', 'max_single_pulse_width',
+                                     'min_double_pulse_width', 'max_double_pulse_width', 'decay_min_time'))
+        super().configure(**options)
+
     def calculate(self, msg):
         """
         Trigger muon decay
@@ -546,32 +896,51 @@ class DecayAnalyzer(BaseAnalyzer):
         if pulses is None:
             return True
 
-        self.logger.info('Got pulses: %s' % str(pulses))
+        self.logger.debug('Got pulses: %s', pulses)
 
-        decay = self.trigger.trigger(
-                pulses[1:], single_channel=self.single_pulse_channel,
-                double_channel=self.double_pulse_channel,
-                veto_channel=self.veto_pulse_channel,
-                min_decay_time=self.decay_min_time,
-                min_single_pulse_width=self.min_single_pulse_width,
-                max_single_pulse_width=self.max_single_pulse_width,
-                min_double_pulse_width=self.min_double_pulse_width,
-                max_double_pulse_width=self.max_double_pulse_width)
+        decay = self.trigger.trigger(pulses[1:], **self._trigger_options())
 
         if decay is not None:
-            when = datetime.datetime.utcnow()
-            self.muon_counter += 1
-            self.last_event_time = when
-            self.logger.info("We have found a decaying muon with a " +
-                             "decay time of %f at %s" % (decay, when))
-            self.logger.info("Muon count: %s" % self.muon_counter)
-
-            self.publish({'decay_time': decay / 1000, 'event_time': when}, DataTypes.DECAY)
+            self._publish_decay(decay, msg.get('event_time'))
         else:
-            self.logger.info('Decay was None')
+            self.logger.debug('Decay was None')
 
         return True
 
+    def _trigger_options(self):
+        """
+        Configuration of the decay trigger
+
+        :returns: dict
+        """
+        return dict(single_channel=self.single_pulse_channel,
+                    double_channel=self.double_pulse_channel,
+                    veto_channel=self.veto_pulse_channel,
+                    min_decay_time=self.decay_min_time,
+                    min_single_pulse_width=self.min_single_pulse_width,
+                    max_single_pulse_width=self.max_single_pulse_width,
+                    min_double_pulse_width=self.min_double_pulse_width,
+                    max_double_pulse_width=self.max_double_pulse_width)
+
+    def _publish_decay(self, decay, when):
+        """
+        Count and publish a decay
+
+        :param decay: decay time in ns
+        :type decay: float
+        :param when: time of the event, None for now
+        :type when: datetime.datetime
+        :returns: None
+        """
+        when = when or datetime.datetime.utcnow()
+        self.muon_counter += 1
+        self.last_event_time = when
+        self.logger.info("We have found a decaying muon with a "
+                         "decay time of %f at %s", decay, when)
+        self.logger.info("Muon count: %s", self.muon_counter)
+
+        self.publish({'decay_time': decay / 1000, 'event_time': when}, DataTypes.DECAY)
+
     def start(self, run_id, daq=None):
         """
         Start check for muon decay
@@ -651,6 +1020,8 @@ class VelocityAnalyzer(BaseAnalyzer):
 
     """
     RESULT_DATA_TYPES = [DataTypes.VELOCITY]
+    CONFIGURABLE = {'upper_channel': ('upper_channel', int),
+                    'lower_channel': ('lower_channel', int)}
 
     def __init__(self, consumers=[], logger=None, **options):
         super().__init__(consumers, logger)
@@ -669,6 +1040,10 @@ class VelocityAnalyzer(BaseAnalyzer):
         self.trigger = VelocityTrigger()
         self.running_status = None
 
+    def configure(self, **options):
+        _check_options(options, channels=('upper_channel', 'lower_channel'))
+        super().configure(**options)
+
     def calculate(self, msg):
         """
         Trigger muon flight
@@ -689,8 +1064,8 @@ class VelocityAnalyzer(BaseAnalyzer):
 
         if flight_time is not None and flight_time > 0:
             self.muon_counter += 1
-            self.last_event_time = datetime.datetime.utcnow()
-            self.logger.info("measured flight time %s" % flight_time)
+            self.last_event_time = msg.get('event_time') or datetime.datetime.utcnow()
+            self.logger.info("measured flight time %s", flight_time)
             self.publish(
                 {'flight_time': flight_time, 'event_time': self.last_event_time, 'muon_count': self.muon_counter},
                 DataTypes.VELOCITY
@@ -751,7 +1126,7 @@ class PulseAnalyzer(BaseAnalyzer):
         # pulse_widths = [fe - le for chan in pulses[1:] for le,fe in chan]
 
         pulse_widths = {i: [] for i in range(4)}
-        pulse_timestamp = datetime.datetime.utcnow()
+        pulse_timestamp = msg.get('event_time') or datetime.datetime.utcnow()
 
         for i, channel in enumerate(pulses[1:]):
             for le, fe in channel:
@@ -1,11 +1,23 @@
 
+import collections
+import concurrent.futures
 import logging
 import time
+from time import perf_counter
 import datetime
+import importlib
+import os
 import signal
+import socket
+import threading
 import uuid
 
-from .analyzers import BaseAnalyzer
+from .analyzers import EPOCH, BaseAnalyzer
+from .card_config import CARD_SETTINGS, CardConfigCache
+from .merge import TimeOrderedMerger
+from .metrics import REGISTRY, PrometheusTextfileExporter, MetricsServer
+from .scheduler import SCHEDULER
+from .tracing import Tracer, current_trace, set_current_trace
 from .utils import PulseExtractor
 from ..daq import DAQIOError
 
@@ -44,25 +56,136 @@ class App(object):
 
         self.logger = logger
 
-        self.analyzers = [self.get_thresholds_from_msg, self.get_channels_from_msg, PulseExtractor(self.logger)]
+        # replay archived raw data instead of reading from the DAQ card
+        self.replay = options.get('replay') or None
+
+        # acquisition only, the reader process writes the data to this archive
+        self.archive = options.get('acquire_only') or None
+
+        # serial devices of the DAQ cards, several cards are read at once
+        self.ports = [] if self.replay is not None else list(options.get('port') or [])
+
+        # with several cards, the events of each card are extracted
+        # separately and merged by their GPS time before the analyzers
+        self.merger = None
+        self.pulse_extractors = []
+        # bounds of the events, 0 for no bound
+        event_bounds = dict(max_pulses=options.get('max_event_pulses') or None,
+                            max_window=options.get('max_event_window') or None)
+        if len(self.ports) > 1:
+            self.pulse_extractors = [PulseExtractor(self.logger, data_timestamps=True, **event_bounds)
+                                     for _ in self.ports]
+            self.merger = TimeOrderedMerger(range(len(self.ports)),
+                                            max_delay=options.get('merge_delay', 2.0),
+                                            logger=self.logger)
+            extractor = self.extract_card_pulses
+            extractors = self.pulse_extractors
+        else:
+            extractor = PulseExtractor(self.logger, data_timestamps=(self.replay is not None or
+                                                                     bool(options.get('publish_events'))),
+                                       **event_bounds)
+            extractors = [extractor]
+
+        self.analyzers = [self.get_thresholds_from_msg, self.get_channels_from_msg, extractor]
+        # analyzers after this index get the merged events
+        self._merged_chain_start = len(self.analyzers)
+
+        # send the events to an aggregator, see muonic.lib.aggregator
+        self.publisher = None
+        if options.get('publish_events'):
+            from .aggregator import EventPublisher
+            self.publisher = EventPublisher(options.get('publish_events'),
+                                            options.get('station_id') or socket.gethostname(),
+                                            logger=self.logger)
+            self.publisher.start()
+            self.analyzers.append(self.publisher)
+
         self.add_analyzers(analyzers)
 
-        self._settings = App._default_settings
+        # each app changes its own copy of the settings
+        self._settings = dict(App._default_settings)
         self.running = False
+        self.closed = False
+        self.run_id = None
+
+        # calls to run between two batches of DAQ data, e.g. commands of
+        # the control socket
+        self._pending_calls = collections.deque()
+
+        # periodic jobs of the measurement
+        self.scheduler = SCHEDULER
+        self._scheduled_calls = []
+        # wakes up the main loop, e.g. at the end of the measurement
+        self._wakeup = threading.Event()
+
+        # pipeline metrics
+        self.metrics = REGISTRY
+        self._line_counters = {}
+        self._event_line_counter = self.metrics.counter("muonic_lines_total", "Lines read from the DAQ",
+                                                        kind="event")
+        self._analyzer_timers = {}
+        self._event_counter = self.metrics.counter("muonic_events_total", "Events extracted from the DAQ data")
+        self._garbage_counter = self.metrics.counter("muonic_dropped_total", "Data dropped in the pipeline",
+                                                     reason="garbage")
+        for reason in ("pulses", "window"):
+            self.metrics.gauge("muonic_evicted_events", "Events evicted for too many pulses or a too long window",
+                               function=lambda reason=reason: sum(e.evicted_events[reason] for e in extractors),
+                               reason=reason)
+        self.metrics_exporters = []
+        if options.get('metrics_file'):
+            self.metrics_exporters.append(PrometheusTextfileExporter(options.get('metrics_file'),
+                                                                     options.get('metrics_interval', 10.0),
+                                                                     logger=self.logger))
+        if options.get('metrics_listen'):
+            self.metrics_exporters.append(MetricsServer(options.get('metrics_listen'), logger=self.logger))
         self.logger.debug('Got options: %s' % options)
 
+        # latency tracing
+        self.tracer = None
+        self._trace_dir = options.get('data_path') or os.getcwd()
+        if options.get('latency_tracing'):
+            self.tracer = Tracer(sample_every=options.get('trace_sample', 1000), logger=self.logger)
+
+        # profiling
+        self.profiler = None
+        if options.get('profile'):
+            from .profiling import Profiler
+            self.profiler = Profiler(options.get('profile'), options.get('data_path'), logger=self.logger)
+
         # import daq provider
-        try:
-            provider_name = options.get('data_provider', '').split('.')[-1]
-            mod = __import__('%s' % '.'.join(options.get('data_provider', '').split('.')[:-1]), globals(), locals(), [provider_name])
-            daq_class = getattr(mod, provider_name)
-            self.daq = daq_class(sim=options.get('sim', False))
-        except ImportError:
-            self.logger.error('Importing DAQ provider failed')
+        if self.replay is not None:
+            from ..daq.replay import ReplayProvider
+            self.daq = ReplayProvider(self.replay, follow=options.get('follow', False), logger=self.logger)
+        else:
+            try:
+                daq_class = self.import_class(options.get('data_provider', ''))
+                daq_options = {'sim': options.get('sim', False)}
+                if self.archive is not None:
+                    daq_options['archive'] = self.archive
+                if len(self.ports) > 1:
+                    from ..daq.multi import MultiDAQProvider
+                    self.daq = MultiDAQProvider([daq_class(device=port, **daq_options) for port in self.ports],
+                                                logger=self.logger)
+                elif self.ports:
+                    self.daq = daq_class(device=self.ports[0], **daq_options)
+                else:
+                    self.daq = daq_class(**daq_options)
+            except ImportError:
+                self.logger.error('Importing DAQ provider failed')
+
+        self.metrics.gauge("muonic_queue_depth", "Number of items waiting in a queue",
+                           function=lambda: int(self.daq.data_available()), queue="provider")
 
         # last daq message
         self.last_daq_msg = False
 
+        # last confirmed card configuration
+        self.config_cache = None
+        if options.get('config_cache', True) and self.daq.device_id is not None:
+            self.config_cache = CardConfigCache(logger=self.logger)
+        self._confirmed_card_config = None
+        self._card_replies = set()
+
         # store command line settings
         if 'write_daq_status' in options:
             self.update_setting("write_daq_status", options.get('write_daq_status'))
@@ -71,18 +194,42 @@ class App(object):
         if 'meas_duration' in options:
             self.update_setting("meas_duration", options.get('meas_duration'))
 
-        # we have to ensure that the DAQ card does not sent any automatic
-        # status reports every x seconds if 'write_daq_status' is set to False
-        if not self.get_setting('write_daq_status'):    # TODO: this should be in some status analyzer (if we need that)
-            # disable status reporting
-            self.daq.put('ST 0')
+        if self.replay is None:
+            # we have to ensure that the DAQ card does not sent any automatic
+            # status reports every x seconds if 'write_daq_status' is set to False
+            if not self.get_setting('write_daq_status'):    # TODO: this should be in some status analyzer (if we need that)
+                # disable status reporting
+                self.daq.put('ST 0')
 
-        # get the last configuration from the card
-        self.get_configuration_from_daq_card()
+            # get the last configuration from the card
+            self.get_configuration_from_daq_card()
 
         # catch signals
         signal.signal(signal.SIGINT, self.close)
         signal.signal(signal.SIGTERM, self.close)
+        if self.tracer is not None and hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, self.dump_traces)
+
+    @staticmethod
+    def import_class(name):
+        """
+        Import class by its dotted name, e.g. 'muonic.daq.provider.DAQProvider'.
+
+        Raises ImportError if the module or the class cannot be found.
+
+        :param name: module path and class name
+        :type name: str
+        :raises: ImportError
+        :returns: type
+        """
+        module_name, _, class_name = name.rpartition('.')
+        if not module_name:
+            raise ImportError("'%s' is not a dotted class name" % name)
+        module = importlib.import_module(module_name)
+        try:
+            return getattr(module, class_name)
+        except AttributeError:
+            raise ImportError("module '%s' has no class '%s'" % (module_name, class_name))
 
     def update_setting(self, key, value):
         """
@@ -115,60 +262,259 @@ class App(object):
         """
         return self._settings.get(key, default)
 
+    def apply_settings(self, settings):
+        """
+        Update the settings and configure the DAQ card accordingly.
+        Afterwards the card is asked for its configuration, so its replies
+        confirm the new settings.
+
+        :param settings: settings to change, e.g. {'threshold_ch0': 250}
+        :type settings: dict
+        :returns: None
+        """
+        for key, value in settings.items():
+            self.update_setting(key, value)
+
+        for i in range(4):
+            if "threshold_ch%d" % i in settings:
+                self.daq.put("TL %d %d" % (i, self.get_setting("threshold_ch%d" % i)))
+
+        if any(key in settings for key in CARD_SETTINGS if not key.startswith("threshold")):
+            self.daq.put("WC 00 %02X" % self._get_channel_register())
+            gate_width = int(self.get_setting("gate_width")) // 10
+            self.daq.put("WC 02 %02X" % (gate_width & 0xff))
+            self.daq.put("WC 03 %02X" % ((gate_width >> 8) & 0xff))
+
+        self.daq.put('TL')
+        self.daq.put('DC')
+
+    def _get_channel_register(self):
+        """
+        Encode the channel, coincidence and veto settings into the
+        channel register of the DAQ card, see get_channels_from_msg.
+
+        :returns: int
+        """
+        register = 0
+        for i in range(4):
+            if self.get_setting("active_ch%d" % i):
+                register |= 1 << i
+
+        for i in range(4):
+            if self.get_setting("coincidence%d" % i):
+                register |= i << 4
+                break
+
+        if self.get_setting("veto"):
+            for i in range(3):
+                if self.get_setting("veto_ch%d" % i):
+                    register |= (i + 1) << 6
+                    break
+
+        return register
+
+    def call_soon(self, function, *args):
+        """
+        Call function in the main loop, between two batches of DAQ data.
+        Thread safe; used to change the analyzer chain while the
+        measurement is running.
+
+        :param function: callable to call
+        :type function: callable
+        :returns: concurrent.futures.Future -- result of the call
+        """
+        future = concurrent.futures.Future()
+        self._pending_calls.append((future, function, args))
+        self._wakeup.set()
+        return future
+
+    def _run_pending_calls(self):
+        """
+        Run the calls requested with call_soon
+
+        :returns: None
+        """
+        while self._pending_calls:
+            future, function, args = self._pending_calls.popleft()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(function(*args))
+            except Exception as e:
+                future.set_exception(e)
+
     def add_analyzer(self, analyzer):
         self.analyzers.append(analyzer)
 
     def add_analyzers(self, analyzers=[]):
         self.analyzers.extend(analyzers)
 
-    def run(self, run_id = None):
-
+    def run(self, run_id=None, duration=None, close=True):
+        """
+        Run a measurement until it is stopped, its duration elapsed or the
+        DAQ provider has no more data.
+
+        :param run_id: id of the run, a new one is created if not given
+        :type run_id: UUID
+        :param duration: duration of the run in seconds, defaults to the
+                         meas_duration setting
+        :type duration: float
+        :param close: close the App at the end of the run. Otherwise the DAQ
+                      connection stays open for further runs.
+        :type close: bool
+        :returns: UUID -- the run id
+        """
         if not run_id:
             run_id = uuid.uuid4()
-        self.logger.info('Analyzers: %s' % [x.__class__.__name__ for x in self.analyzers if isinstance(x, BaseAnalyzer)])
+        if duration is None:
+            duration = self.get_setting('meas_duration')
+        self.logger.info('Analyzers: %s' % [x.__class__.__name__ for x in self.analyzers
+                                            if isinstance(x, BaseAnalyzer) and not x.disabled])
         self.running = True
-        start_ts = datetime.datetime.utcnow()
-        duration = self.get_setting('meas_duration')
+        self.run_id = run_id
+        self._wakeup.clear()
+        start_ts = time.monotonic()
+
+        if self.profiler is not None:
+            self.profiler.start(self.analyzers)
 
         # setup analyzers - pass in daq handle and run_id
         for analyzer in self.analyzers:
             if isinstance(analyzer, BaseAnalyzer):
                 analyzer.start(run_id, self.daq)
 
+        for exporter in self.metrics_exporters:
+            exporter.start()
+
         self.logger.info('Running with run-id %s' % run_id)
+        if self.archive is not None:
+            # record the scalars for a later rate analysis
+            self._scheduled_calls.append(self.scheduler.call_every(
+                    self.get_setting('time_window'), self.daq.put, 'DS', first_delay=0))
+        if duration:
+            self._scheduled_calls.append(self.scheduler.call_later(duration, self._wakeup.set))
+
         while self.running:
+            self._run_pending_calls()
             self.process_incoming()
-            time.sleep(1)
 
-            if duration \
-                    and datetime.datetime.utcnow() > start_ts + datetime.timedelta(seconds=duration):
-                self.close()
+            if self.running and self.daq.finished:
+                self.logger.info('No more data from the DAQ provider')
+                break
+
+            completable = [x for x in self.analyzers
+                           if isinstance(x, BaseAnalyzer) and x.active and x.CAN_COMPLETE]
+            if completable and all(x.completed for x in completable):
+                self.logger.info('Measurement completed by %s' %
+                                 ', '.join(x.__class__.__name__ for x in completable))
+                break
+
+            self._wakeup.wait(1)
+            self._wakeup.clear()
+
+            if duration and time.monotonic() >= start_ts + duration:
+                break
+
+        if self.merger is not None and not self.closed:
+            # analyze the events still waiting for the other cards
+            self._analyze_merged(self.merger.flush())
+
+        if close:
+            self.close()
+        else:
+            self.stop()
+        return run_id
 
     def stop(self):
         if self.running:
             self.logger.info('Stopping measurement')
             self.running = False
 
+            for call in self._scheduled_calls:
+                call.cancel()
+            self._scheduled_calls = []
+            self._wakeup.set()
+
             # stop analyzers
             for analyzer in self.analyzers:
                 if isinstance(analyzer, BaseAnalyzer):
                     analyzer.stop()
 
     def close(self, *args):
+        if self.closed:
+            return
+        self.closed = True
         self.stop()
 
+        while self._pending_calls:
+            self._pending_calls.popleft()[0].cancel()
+
         # finish analyzers
         for analyzer in self.analyzers:
             if isinstance(analyzer, BaseAnalyzer):
                 analyzer.finish()
 
+        for exporter in self.metrics_exporters:
+            exporter.stop()
+
+        if self.profiler is not None:
+            self.profiler.stop()
+
+        if self.publisher is not None:
+            self.publisher.stop()
+
+        # the scheduler is shared with the rest of the process, only
+        # the calls of this app are cancelled
+        for call in self._scheduled_calls:
+            call.cancel()
+        self._scheduled_calls = []
+        self.daq.close()
+
+        if self.tracer is not None:
+            for stage, summary in self.tracer.summary().items():
+                self.logger.info("Latency %s: %s" % (stage, ", ".join(
+                        "%s=%.3f ms" % (k, v * 1e3) for k, v in summary.items() if k != "count")))
+            self.dump_traces()
+
+    def dump_traces(self, *args):
+        """
+        Write latency summary and sampled traces next to the data.
+        Also used as handler for SIGUSR1.
+
+        :returns: None
+        """
+        if self.tracer is None:
+            return
+        path = os.path.join(self._trace_dir, "latency_%s.jsonl" %
+                            datetime.datetime.utcnow().strftime('%Y-%m-%d_%H-%M-%S'))
+        try:
+            self.tracer.dump(path)
+        except (IOError, OSError) as e:
+            self.logger.warning("Could not write latency traces: %s" % e)
+
     def get_configuration_from_daq_card(self):
         """
         Get the initial threshold and channel configuration
         from the DAQ card.
 
+        If the configuration of the card is cached, the measurement starts
+        with the cached configuration right away. The card is still asked
+        for its configuration; the replies are handled by the analyzer
+        chain and correct the settings if they differ from the cache.
+
         :returns: None
         """
+        if self.config_cache is not None:
+            cached = self.config_cache.load(self.daq.device_id)
+            if cached is not None:
+                for key, value in cached.items():
+                    self.update_setting(key, value)
+                self._confirmed_card_config = cached
+                self.logger.info("Using cached configuration of DAQ card %s" % self.daq.device_id)
+                self.daq.put('TL')
+                self.daq.put('DC')
+                return
+
         # get the thresholds
         self.daq.put('TL')
         # give the daq some time to react
@@ -195,6 +541,36 @@ class App(object):
             except DAQIOError:
                 self.logger.debug("Queue empty!")
 
+    def _card_config_received(self, reply):
+        """
+        Store the card configuration in the cache after the card
+        reported a part of it, if it changed. Nothing is stored until
+        the card replied to both TL and DC.
+
+        :param reply: command the card replied to
+        :type reply: str
+        :returns: None
+        """
+        if self.config_cache is None:
+            return
+
+        self._card_replies.add(reply)
+        if len(self._card_replies) < 2:
+            return
+
+        card_config = dict((key, self.get_setting(key)) for key in CARD_SETTINGS)
+        if card_config == self._confirmed_card_config:
+            return
+
+        if self._confirmed_card_config is not None:
+            changed = sorted(key for key in CARD_SETTINGS
+                             if card_config[key] != self._confirmed_card_config.get(key))
+            self.logger.info("DAQ card reported changed configuration: %s" %
+                             ", ".join("%s=%s" % (key, card_config[key]) for key in changed))
+
+        self._confirmed_card_config = card_config
+        self.config_cache.store(self.daq.device_id, card_config)
+
     def get_thresholds_from_msg(self, msg):
         """
         Explicitly scan message for threshold information.
@@ -219,6 +595,7 @@ class App(object):
             self.logger.debug("Got Thresholds %d %d %d %d" %
                               tuple([self.get_setting("threshold_ch%d" % i)
                                      for i in range(4)]))
+            self._card_config_received('TL')
             return False
         else:
             return True
@@ -327,10 +704,115 @@ class App(object):
                                     [self.get_setting("veto_ch%d" % i)
                                      for i in range(3)]))
 
+            self._card_config_received('DC')
             return False
         else:
             return True
 
+    def _count_line(self, line):
+        """
+        Count DAQ line by kind
+
+        :param line: DAQ line
+        :type line: str
+        :returns: None
+        """
+        if len(line) >= 50 and line[8:9] == ' ':
+            counter = self._event_line_counter
+        else:
+            kind = line[:3]
+            counter = self._line_counters.get(kind)
+            if counter is None:
+                if kind[2:] in ('', ' ') and kind[:2].isalpha():
+                    # command responses and status messages
+                    label = kind[:2].upper()
+                else:
+                    label = "other"
+                counter = self.metrics.counter("muonic_lines_total", "Lines read from the DAQ", kind=label)
+                self._line_counters[kind] = counter
+        counter.value += 1
+
+    def _get_analyzer_timer(self, analyzer):
+        """
+        Get timer metric and name for analyzer
+
+        :param analyzer: analyzer
+        :type analyzer: callable
+        :returns: tuple of Timer and analyzer name
+        """
+        name = getattr(analyzer, '__name__', analyzer.__class__.__name__)
+        timer = (self.metrics.timer("muonic_analyzer_seconds", "Time spent in analyzers", analyzer=name), name)
+        self._analyzer_timers[id(analyzer)] = timer
+        return timer
+
+    def _analyze(self, msg, trace=None, start=0):
+        """
+        Pass message through the analyzer chain
+
+        :param msg: message
+        :type msg: dict
+        :param trace: latency trace of the message
+        :type trace: muonic.lib.tracing.Trace
+        :param start: index of the first analyzer in the chain
+        :type start: int
+        :returns: None
+        """
+        for analyzer in self.analyzers[start:]:
+            if not isinstance(analyzer, BaseAnalyzer) or analyzer.active:
+                timer = self._analyzer_timers.get(id(analyzer))
+                if timer is None:
+                    timer = self._get_analyzer_timer(analyzer)
+                t0 = perf_counter()
+                result = analyzer(msg)
+                timer[0].observe(perf_counter() - t0)
+                if trace is not None:
+                    trace.stamp(timer[1])
+                if not result:
+                    return
+
+        if 'pulses' in msg:
+            self._event_counter.value += 1
+
+    def extract_card_pulses(self, msg):
+        """
+        Extract the pulses of a message with the pulse extractor of its
+        card. Events are passed to the merger and leave the chain here,
+        they are analyzed in time order with the events of the other
+        cards. The other messages continue through the chain.
+
+        :param msg: message with the id of the card
+        :type msg: dict
+        :returns: bool
+        """
+        card = msg['card']
+        self.pulse_extractors[card](msg)
+
+        data_time = msg.get('data_time')
+        if 'pulses' in msg and msg.get('event_time') is not None:
+            trace = current_trace()
+            self.merger.push(card, (msg['event_time'] - EPOCH).total_seconds(), (msg, trace))
+            return False
+
+        if data_time is not None:
+            # no earlier events will follow from this card
+            self.merger.advance(card, (data_time - EPOCH).total_seconds())
+        return True
+
+    def _analyze_merged(self, events):
+        """
+        Pass merged events through the analyzers after the pulse extraction
+
+        :param events: (card, (message, trace)) tuples
+        :type events: list
+        :returns: None
+        """
+        for card, (msg, trace) in events:
+            if trace is not None:
+                set_current_trace(trace)
+            self._analyze(msg, trace, self._merged_chain_start)
+            if trace is not None:
+                set_current_trace(None)
+
     def process_incoming(self):
         """
         This functions gets everything out of the daq.
@@ -347,16 +829,31 @@ class App(object):
                 self.logger.debug("Queue empty!")
                 return None
 
+            if msg is None:
+                # the provider rejected the line
+                self._garbage_counter.value += 1
+                continue
+
+            self._count_line(msg)
+
             # make daq msg public for child widgets
             self.last_daq_msg = msg
 
+            trace = None
+            if self.tracer is not None:
+                trace = self.tracer.begin(self.daq.last_receive_time, msg)
+                trace.stamp('queue')
+                set_current_trace(trace)
+
             # transform to dict - analyzers can add data to it as it passes the analysis stack
             msg = {'raw': msg}
+            if self.merger is not None:
+                msg['card'] = self.daq.last_card
 
-            # iterate over analyzers and process message
-            for analyzer in self.analyzers:
-                if not isinstance(analyzer, BaseAnalyzer) or analyzer.active:
-                    if not analyzer(msg): break
+            self._analyze(msg, trace)
+
+            if trace is not None:
+                set_current_trace(None)
 
             """
 
@@ -374,3 +871,6 @@ class App(object):
                 self.pulses = self.pulse_extractor.extract(msg)
 
             """
+
+        if self.merger is not None:
+            self._analyze_merged(self.merger.pop_ready())
@@ -0,0 +1,788 @@
+"""
+Vectorized pulse extraction for blocks of DAQ lines.
+
+The BatchPulseExtractor decodes a whole block of lines with numpy and
+returns the events of the block as an EventBatch, a columnar
+representation of the pulses. The results are identical to passing the
+lines one by one to the PulseExtractor, including its handling of
+counter rollovers, the frequency calculation every five PPS and the
+delayed PPS switches.
+"""
+import itertools
+import re
+
+import numpy as np
+
+from .utils import (BIT0_4, BIT5, BIT7, DEFAULT_FREQUENCY, MAX_TRIGGER_WINDOW, SECONDS_PER_DAY, TMC_TICK,
+                    PulseEvent, PulseExtractor, gps_time_to_seconds)
+
+
+__all__ = ["EventBatch", "RawLines", "decode_lines", "pair_edges", "BatchPulseExtractor"]
+
+# offset added to the counters after a rollover, see PulseExtractor.extract
+COUNTER_OFFSET = 0xFFFFFFFF
+
+# fields of an event line
+FIELD_COUNT = 16
+TRIGGER_COUNT, ONE_PPS, GPS_TIME, GPS_DATE, GPS_CORRECTION = 0, 9, 10, 11, 15
+
+# values of the hex digits by character, -1 for other characters
+_HEX_VALUES = np.full(256, -1, dtype=np.int8)
+for _i, _c in enumerate(b"0123456789abcdef"):
+    _HEX_VALUES[_c] = _i
+for _i, _c in enumerate(b"ABCDEF"):
+    _HEX_VALUES[_c] = 10 + _i
+del _i, _c
+
+_WHITESPACE = np.zeros(256, dtype=bool)
+_WHITESPACE[[c for c in range(128) if chr(c).isspace()]] = True
+
+_TOKEN = re.compile(r"\S+")
+
+
+class EventBatch(object):
+    """
+    Events in columnar form. The pulses of all events are stored in two
+    arrays of rising and falling edges, ordered by event and channel;
+    the pulses of channel ch of event i are the slice
+    offsets[4 * i + ch]:offsets[4 * i + ch + 1].
+
+    :param trigger_times: trigger time of each event in seconds since day
+                          start
+    :type trigger_times: numpy.ndarray
+    :param event_times: time of the data of each event, None without
+                        data timestamps
+    :type event_times: list of datetime.datetime or None
+    :param offsets: start of the pulses of each event and channel
+    :type offsets: numpy.ndarray
+    :param rising: rising edges in ns after the trigger
+    :type rising: numpy.ndarray
+    :param falling: falling edges in ns after the trigger
+    :type falling: numpy.ndarray
+    :param trigger_lines: index of the trigger line of each event among
+                          all lines passed to the extractor, -1 if unknown
+    :type trigger_lines: numpy.ndarray
+    """
+
+    def __init__(self, trigger_times, event_times, offsets, rising, falling, trigger_lines=None):
+        self.trigger_times = trigger_times
+        self.event_times = event_times
+        self.offsets = offsets
+        self.rising = rising
+        self.falling = falling
+        if trigger_lines is None:
+            trigger_lines = np.full(len(trigger_times), -1, dtype=np.int64)
+        self.trigger_lines = trigger_lines
+
+    @classmethod
+    def empty(cls):
+        return cls(np.zeros(0), None, np.zeros(1, dtype=np.int64), np.zeros(0), np.zeros(0))
+
+    def __len__(self):
+        return len(self.trigger_times)
+
+    @property
+    def counts(self):
+        """
+        Number of pulses per event and channel
+
+        :returns: numpy.ndarray of shape (events, 4)
+        """
+        return np.diff(self.offsets).reshape(-1, 4)
+
+    @property
+    def event_index(self):
+        """
+        Index of the event of each pulse
+
+        :returns: numpy.ndarray
+        """
+        return np.repeat(np.arange(len(self)), self.counts.sum(axis=1))
+
+    @property
+    def channel(self):
+        """
+        Channel of each pulse
+
+        :returns: numpy.ndarray
+        """
+        return np.repeat(np.tile(np.arange(4), len(self)), np.diff(self.offsets))
+
+    def event(self, index):
+        """
+        Event as PulseEvent
+
+        :param index: index of the event
+        :type index: int
+        :returns: PulseEvent
+        """
+        offsets = self.offsets[4 * index:4 * index + 5].tolist()
+        rising = self.rising[offsets[0]:offsets[4]].tolist()
+        falling = self.falling[offsets[0]:offsets[4]].tolist()
+        channels = []
+        for ch in range(4):
+            start, end = offsets[ch] - offsets[0], offsets[ch + 1] - offsets[0]
+            channels.append(list(zip(rising[start:end], falling[start:end])))
+        return PulseEvent(float(self.trigger_times[index]), *channels)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.event(index)
+
+
+class _BatchBuilder(object):
+    """
+    Collects the events of the parts of a block
+    """
+
+    def __init__(self, data_timestamps):
+        self.trigger_times = []
+        self.event_times = [] if data_timestamps else None
+        self.trigger_lines = []
+        # pulses: event, channel, rising and falling edges
+        self.pulses = []
+        self.event_count = 0
+
+    def add_event(self, event, event_time, trigger_line):
+        pulses = [(self.event_count, ch, re, fe) for ch, channel in enumerate(event.channels)
+                  for re, fe in channel]
+        if pulses:
+            self.pulses.append(np.array(pulses, dtype=np.float64).T)
+        self.trigger_times.append(np.array([event.trigger_time], dtype=np.float64))
+        self.trigger_lines.append(np.array([trigger_line], dtype=np.int64))
+        if self.event_times is not None:
+            self.event_times.append(event_time)
+        self.event_count += 1
+
+    def add_events(self, trigger_times, event_times, trigger_lines, event, channel, rising, falling):
+        self.pulses.append(np.array([event + self.event_count, channel, rising, falling], dtype=np.float64))
+        self.trigger_times.append(trigger_times)
+        self.trigger_lines.append(trigger_lines)
+        if self.event_times is not None:
+            self.event_times.extend(event_times)
+        self.event_count += len(trigger_times)
+
+    def build(self):
+        if not self.event_count:
+            batch = EventBatch.empty()
+            batch.event_times = self.event_times
+            return batch
+        if self.pulses:
+            event, channel, rising, falling = np.concatenate(self.pulses, axis=1)
+        else:
+            event = channel = rising = falling = np.zeros(0)
+        counts = np.bincount((event * 4 + channel).astype(np.int64), minlength=4 * self.event_count)
+        offsets = np.zeros(4 * self.event_count + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return EventBatch(np.concatenate(self.trigger_times), self.event_times, offsets, rising, falling,
+                          np.concatenate(self.trigger_lines))
+
+
+class _FallBack(Exception):
+    """
+    Raised if a block has to be extracted line by line
+    """
+
+
+def _hex_fields(matrix, spans):
+    """
+    Values of hex fields
+
+    :param matrix: characters of the lines
+    :type matrix: numpy.ndarray
+    :param spans: columns of the fields as (start, end) tuples
+    :type spans: list of tuple
+    :returns: tuple of the list of the values of each field and a mask of
+              the rows whose fields are all hex numbers, the values of the
+              other rows are undefined
+    """
+    columns = np.zeros(max(end for _, end in spans), dtype=bool)
+    for start, end in spans:
+        columns[start:end] = True
+    digits = _HEX_VALUES.take(matrix[:, :len(columns)])
+    invalid = (digits < 0) & columns
+    valid = ~invalid.any(axis=1) if invalid.any() else np.ones(len(matrix), dtype=bool)
+    values = []
+    for start, end in spans:
+        field = digits[:, start:end]
+        value = field[:, 0].astype(np.int64)
+        for i in range(1, end - start):
+            value <<= 4
+            value |= field[:, i]
+        values.append(value)
+    return values, valid
+
+
+def _string_field(matrix, start, end):
+    return np.ascontiguousarray(matrix[:, start:end]).view("S%d" % (end - start)).ravel()
+
+
+class RawLines(object):
+    """
+    Fields of the event lines of raw DAQ data, one row per line in the
+    order of the lines
+
+    :param line_index: index of the line of each row
+    :type line_index: numpy.ndarray
+    :param trigger_counts: trigger counter values, without rollover
+                           correction
+    :type trigger_counts: numpy.ndarray
+    :param edges: values of the eight edge fields, shape (rows, 8)
+    :type edges: numpy.ndarray
+    :param one_pps: counter values at the last PPS, without rollover
+                    correction
+    :type one_pps: numpy.ndarray
+    :param times: GPS times
+    :type times: numpy.ndarray of bytes
+    :param dates: GPS dates
+    :type dates: numpy.ndarray of bytes
+    :param corrections: GPS time corrections
+    :type corrections: numpy.ndarray of bytes
+    """
+
+    def __init__(self, line_index, trigger_counts, edges, one_pps, times, dates, corrections):
+        self.line_index = line_index
+        self.trigger_counts = trigger_counts
+        self.edges = edges
+        self.one_pps = one_pps
+        self.times = times
+        self.dates = dates
+        self.corrections = corrections
+
+    def __len__(self):
+        return len(self.line_index)
+
+
+def _decode_fields(lines, layout):
+    """
+    Decode lines of the same length whose fields are in the columns of
+    layout. Status messages and scalars are no event lines and skipped.
+
+    :param lines: DAQ lines of the same length
+    :type lines: list of str
+    :param layout: columns of the fields as (start, end) tuples
+    :type layout: list of tuple
+    :returns: tuple of the indices of the event lines, the matrix of their
+              characters, the values of their trigger count, one pps and
+              edge fields and the indices of the lines which are not in
+              the layout or have no hex numbers in these fields, or None
+              if the lines are not ASCII
+    """
+    try:
+        data = "".join(lines).encode("ascii")
+    except UnicodeEncodeError:
+        return None
+    matrix = np.frombuffer(data, dtype=np.uint8).reshape(len(lines), -1)
+
+    token = np.zeros(matrix.shape[1], dtype=bool)
+    for start, end in layout:
+        token[start:end] = True
+    end = layout[-1][1]
+    if ((matrix[:, :end] == ord(" ")) == ~token[:end]).all():
+        # usually the fields are separated by spaces, only the line
+        # endings are left to check
+        matching = _WHITESPACE.take(matrix[:, end:]).all(axis=1)
+    else:
+        matching = (_WHITESPACE.take(matrix) != token).all(axis=1)
+    fields, valid = _hex_fields(matrix, [layout[TRIGGER_COUNT], layout[ONE_PPS]] + layout[1:9])
+    matching &= valid
+
+    ignored = (((matrix[:, 0] == ord("S")) & (matrix[:, 1] == ord("T"))) |
+               ((matrix[:, 0] == ord("D")) & (matrix[:, 1] == ord("S"))))
+    rows = np.flatnonzero(matching & ~ignored)
+    if len(rows) < len(matrix):
+        matrix = matrix[rows]
+        fields = [field[rows] for field in fields]
+    return rows, matrix, fields, np.flatnonzero(~matching & ~ignored)
+
+
+def _decode_same_length(lines):
+    """
+    Decode lines of the same length in the column layout of the first
+    line
+
+    :param lines: DAQ lines of the same length
+    :type lines: list of str
+    :returns: tuple of the columns of the decoded rows, or None, and the
+              indices of the rows in another layout
+    """
+    layout = [match.span() for match in _TOKEN.finditer(lines[0])]
+    decoded = _decode_fields(lines, layout) if len(layout) == FIELD_COUNT else None
+    if decoded is None:
+        return None, list(range(len(lines)))
+
+    rows, matrix, fields, failed = decoded
+    columns = (rows, fields[0], np.stack(fields[2:], axis=1), fields[1], _string_field(matrix, *layout[GPS_TIME]),
+               _string_field(matrix, *layout[GPS_DATE]), _string_field(matrix, *layout[GPS_CORRECTION]))
+    return columns, failed.tolist()
+
+
+def _decode_line(line):
+    """
+    Decode a line split on whitespace
+
+    :returns: tuple of the values of the ten counter and edge fields and
+              the GPS time, date and correction, or None if the line is
+              no event line
+    """
+    if line.startswith("ST") or line.startswith("DS"):
+        return None
+    fields = line.split()
+    if len(fields) != FIELD_COUNT:
+        return None
+    try:
+        return ([int(field, 16) for field in fields[:10]] +
+                [fields[i].encode("ascii") for i in (GPS_TIME, GPS_DATE, GPS_CORRECTION)])
+    except (ValueError, UnicodeEncodeError):
+        return None
+
+
+def decode_lines(lines):
+    """
+    Decode the event lines of raw DAQ data into columns, e.g. the lines of
+    a whole file. Lines of the same length are decoded at once with numpy,
+    lines in an unusual layout one by one. Lines which are ignored by
+    PulseExtractor.extract, e.g. status messages, and lines which cannot
+    be decoded are skipped.
+
+    :param lines: DAQ lines
+    :type lines: list of str
+    :returns: RawLines
+    """
+    lengths = np.fromiter(map(len, lines), dtype=np.int64, count=len(lines))
+    order = np.argsort(lengths, kind="stable")
+    groups = np.split(order, np.flatnonzero(np.diff(lengths[order])) + 1)
+    columns = []
+    other = []
+    for group in groups:
+        if not len(group) or lengths[group[0]] < 50:
+            continue
+        decoded, failed = _decode_same_length([lines[i] for i in group.tolist()])
+        if decoded is not None:
+            columns.append((group[decoded[0]],) + decoded[1:])
+        other.extend(group[failed].tolist())
+
+    rows = [(index, _decode_line(lines[index])) for index in other]
+    rows = [(index, fields) for index, fields in rows if fields is not None]
+    if rows:
+        values = np.array([[index] + fields[:10] for index, fields in rows], dtype=np.int64)
+        columns.append((values[:, 0], values[:, 1 + TRIGGER_COUNT], values[:, 2:10], values[:, 1 + ONE_PPS]) +
+                       tuple(np.array([fields[i] for _, fields in rows]) for i in (10, 11, 12)))
+    if not columns:
+        empty = np.zeros(0, dtype=np.int64)
+        return RawLines(empty, empty, np.zeros((0, 8), dtype=np.int64), empty, np.zeros(0, dtype="S1"),
+                        np.zeros(0, dtype="S1"), np.zeros(0, dtype="S1"))
+
+    line_index = np.concatenate([column[0] for column in columns])
+    order = np.argsort(line_index, kind="stable")
+    return RawLines(*[np.concatenate([column[i] for column in columns])[order] for i in range(7)])
+
+
+def pair_edges(rise_groups, rising, fall_groups, falling):
+    """
+    Pair the rising and falling edges of many events and channels at once
+    like PulseExtractor: the n-th rising edge of a channel is paired with
+    its n-th falling edge. A virtual falling edge at MAX_TRIGGER_WINDOW
+    is used if the falling edge is missing or before the rising edge.
+    Falling edges without rising edge are dropped.
+
+    The edges are identified by a group, e.g. 4 * event + channel, and
+    have to be in the order of the lines within each group.
+
+    :param rise_groups: group of each rising edge
+    :type rise_groups: numpy.ndarray
+    :param rising: rising edges
+    :type rising: numpy.ndarray
+    :param fall_groups: group of each falling edge
+    :type fall_groups: numpy.ndarray
+    :param falling: falling edges
+    :type falling: numpy.ndarray
+    :returns: tuple of the groups, rising and falling edges of the pulses,
+              ordered by group and, within a group, by rising and falling
+              edge
+    """
+    # rank of each edge within its group
+    ranked = []
+    for groups, values in ((rise_groups, rising), (fall_groups, falling)):
+        groups = np.asarray(groups, dtype=np.int64)
+        order = np.argsort(groups, kind="stable")
+        groups, values = groups[order], np.asarray(values, dtype=np.float64)[order]
+        ranked.append((groups, np.arange(len(groups)) - np.searchsorted(groups, groups, side="left"), values))
+    (rise_groups, rise_ranks, rising), (fall_groups, fall_ranks, fall_values) = ranked
+
+    size = max(len(rise_ranks), len(fall_ranks)) + 1
+    fall_keys = fall_groups * size + fall_ranks
+    positions = np.searchsorted(fall_keys, rise_groups * size + rise_ranks)
+    found = positions < len(fall_keys)
+    found[found] = fall_keys[positions[found]] == (rise_groups * size + rise_ranks)[found]
+    falling = np.full(len(rising), MAX_TRIGGER_WINDOW)
+    falling[found] = fall_values[positions[found]]
+    falling[falling < rising] = MAX_TRIGGER_WINDOW
+
+    # the pulses are mostly in order already
+    same_group = rise_groups[1:] == rise_groups[:-1]
+    unordered = same_group & ((rising[1:] < rising[:-1]) |
+                              ((rising[1:] == rising[:-1]) & (falling[1:] < falling[:-1])))
+    if unordered.any():
+        # sort the pulses of the groups which are not in order
+        selected = np.flatnonzero(np.isin(rise_groups, rise_groups[1:][unordered]))
+        order = selected[np.lexsort((falling[selected], rising[selected], rise_groups[selected]))]
+        rising[selected], falling[selected] = rising[order], falling[order]
+    return rise_groups, rising, falling
+
+
+class BatchPulseExtractor(PulseExtractor):
+    """
+    Extracts the pulses of blocks of DAQ lines at once.
+
+    Lines in the usual fixed column layout are decoded with numpy. Blocks
+    with lines in another layout, with a counter value which would need
+    more than the usual rollover correction, with an event which has to
+    be evicted and the lines before the first trigger are passed to
+    PulseExtractor.extract line by line. Both ways share the state of
+    the extractor, so extract and extract_batch can be mixed.
+
+    The lines passed to extract_batch are counted in lines_read, and the
+    events refer to their trigger line by this count, e.g. to look up
+    the time of the line in a ClockModel of the whole file.
+
+    :param logger: logger object
+    :type logger: logging.Logger
+    :param data_timestamps: calculate the times of the events
+    :type data_timestamps: bool
+    :param max_pulses: maximum number of edges per channel of an event
+    :type max_pulses: int
+    :param max_window: maximum number of trigger counts of an event
+    :type max_window: int
+    """
+
+    def __init__(self, logger, data_timestamps=False, max_pulses=None, max_window=None):
+        PulseExtractor.__init__(self, logger, data_timestamps=data_timestamps, max_pulses=max_pulses,
+                                max_window=max_window)
+        # token columns by line length
+        self._layouts = {}
+        # lines passed to extract_batch and the trigger line of the
+        # current event
+        self.lines_read = 0
+        self._trigger_line = -1
+
+    def extract_batch(self, lines):
+        """
+        Extract the events of a block of DAQ lines. The events of the
+        last trigger of the block are completed by the next block.
+
+        Lines which do not match the line pattern of the DAQ providers or
+        cannot be decoded are skipped with a warning, like in iter_events.
+
+        :param lines: DAQ lines, other lines are ignored
+        :type lines: list of str
+        :returns: EventBatch
+        """
+        from muonic.daq.provider import BaseDAQProvider
+
+        pattern = BaseDAQProvider.LINE_PATTERN
+        indices = range(self.lines_read, self.lines_read + len(lines))
+        self.lines_read += len(lines)
+        garbage = [line for line in lines if pattern.match(line) is None]
+        if garbage:
+            for line in garbage:
+                self.logger.warning("Skipping garbage line: %s", line.rstrip("\r\n"))
+            kept = [(index, line) for index, line in zip(indices, lines) if pattern.match(line) is not None]
+            indices = [index for index, _ in kept]
+            lines = [line for _, line in kept]
+
+        builder = _BatchBuilder(self.data_timestamps)
+        start = 0
+        for length, group in itertools.groupby(lines, len):
+            group = list(group)
+            group_indices = indices[start:start + len(group)]
+            start += len(group)
+            if length < 50:
+                # no event lines
+                continue
+            if self.ini:
+                # the lines before the first trigger change the state
+                # differently, extract them one by one
+                for index, line in enumerate(group):
+                    self._extract_line(line, group_indices[index], builder)
+                    if not self.ini:
+                        break
+                group = group[index + 1:]
+                group_indices = group_indices[index + 1:]
+                if not group:
+                    continue
+            try:
+                self._extract_block(group, group_indices, builder)
+            except _FallBack:
+                for line, index in zip(group, group_indices):
+                    self._extract_line(line, index, builder)
+        return builder.build()
+
+    def _extract_line(self, line, index, builder):
+        edge_buffers = self.re
+        try:
+            event = self.extract(line)
+        except (ValueError, IndexError) as e:
+            self.logger.warning("Could not extract line %s: %s", line.rstrip("\r\n"), e)
+            return
+        if event is not None:
+            builder.add_event(event, self.event_time, self._trigger_line)
+        if self.re is not edge_buffers:
+            # the edge buffers are swapped at each trigger
+            self._trigger_line = index
+
+    def _get_layout(self, line):
+        """
+        Columns of the fields of the lines with the length of line
+
+        :returns: list of (start, end) tuples
+        """
+        layout = self._layouts.get(len(line))
+        if layout is None:
+            layout = [match.span() for match in _TOKEN.finditer(line)]
+            if len(layout) != FIELD_COUNT:
+                layout = []
+            self._layouts[len(line)] = layout
+        return layout
+
+    def _decode(self, lines):
+        """
+        Decode lines of the same length, see decode_lines. All event lines
+        have to be in the layout of the first line.
+
+        :returns: tuple of the indices of the event lines, the matrix of
+                  their characters, the values of their counter and edge
+                  fields and the layout
+        :raises: _FallBack
+        """
+        layout = self._get_layout(lines[0])
+        if not layout:
+            raise _FallBack()
+        decoded = _decode_fields(lines, layout)
+        if decoded is None or len(decoded[3]):
+            raise _FallBack()
+        return decoded[0], decoded[1], decoded[2], layout
+
+    @staticmethod
+    def _unwrap(raw, previous):
+        """
+        Replicate the rollover correction of the counters: once a counter
+        value is smaller than the previous one, the offset is added to it
+        and, as the following values are compared to the corrected one,
+        to all following values.
+
+        :param raw: counter values
+        :type raw: numpy.ndarray
+        :param previous: corrected value before the first one
+        :type previous: int
+        :returns: numpy.ndarray -- the corrected values
+        """
+        rolled = np.zeros(len(raw), dtype=bool)
+        if raw[0] < previous:
+            rolled[:] = True
+        else:
+            decreasing = np.flatnonzero(raw[1:] < raw[:-1])
+            if decreasing.size:
+                rolled[decreasing[0] + 1:] = True
+        corrected = raw + rolled * COUNTER_OFFSET
+        # a corrected value is only exceeded by a raw one if the counter
+        # jumped by the full range, not replicated here
+        if (raw[1:][rolled[1:]] >= corrected[:-1][rolled[1:]]).any():
+            raise _FallBack()
+        return corrected
+
+    def _check_bounds(self, edges, trigger_counts, triggers):
+        """
+        Check that no event of the lines has to be evicted, see
+        PulseExtractor
+
+        :raises: _FallBack
+        """
+        if self._evicted:
+            raise _FallBack()
+        line_events = np.zeros(len(edges), dtype=np.int64)
+        line_events[triggers] = 1
+        np.cumsum(line_events, out=line_events)
+        continued = np.ones(len(edges), dtype=bool)
+        continued[triggers] = False
+
+        if self.max_window is not None:
+            event_trigger_counts = np.concatenate([[self._event_trigger_count], trigger_counts[triggers]])
+            windows = trigger_counts - event_trigger_counts[line_events]
+            if (windows[continued] > self.max_window).any():
+                raise _FallBack()
+
+        if self.max_pulses is not None:
+            # edges of the event up to each line, by channel and edge,
+            # including the edges carried over from the previous block
+            valid = ((edges & BIT5) != 0).astype(np.int64)
+            totals = np.cumsum(valid, axis=0)
+            carried = [len(buffers["ch%d" % ch]) for ch in range(4) for buffers in (self.re, self.fe)]
+            bases = np.concatenate([-np.array([carried]), totals[triggers] - valid[triggers]])
+            if ((totals - bases[line_events])[continued] > self.max_pulses).any():
+                raise _FallBack()
+
+    def _extract_block(self, lines, indices, builder):
+        """
+        Extract the events of lines of the same length
+
+        :raises: _FallBack
+        """
+        rows, matrix, fields, layout = self._decode(lines)
+        count = len(matrix)
+        if not count:
+            return
+
+        edges = np.stack(fields[2:], axis=1)
+        times = _string_field(matrix, *layout[GPS_TIME])
+        corrections = _string_field(matrix, *layout[GPS_CORRECTION])
+
+        # trigger counts with rollover correction
+        trigger_counts = self._unwrap(fields[0], self.last_trigger_count)
+        triggers = np.flatnonzero(edges[:, 0] & BIT7)
+        if self.max_pulses is not None or self.max_window is not None:
+            self._check_bounds(edges, trigger_counts, triggers)
+        previous_trigger_counts = np.empty_like(trigger_counts)
+        previous_trigger_counts[0] = self.last_trigger_count
+        previous_trigger_counts[1:] = trigger_counts[:-1]
+
+        # one pps counts with rollover correction, after a rollover every
+        # line counts as a change, as the raw values are compared
+        raw_one_pps = fields[1]
+        one_pps = self._unwrap(raw_one_pps, self.last_one_pps)
+        previous_one_pps = np.empty_like(one_pps)
+        previous_one_pps[0] = self.last_one_pps
+        previous_one_pps[1:] = one_pps[:-1]
+        changed = raw_one_pps != previous_one_pps
+
+        # frequency, calculated at every fifth change of the one pps count
+        changes = np.flatnonzero(changed)
+        polls = changes[(self.passed_one_pps + np.arange(1, len(changes) + 1)) % 5 == 0]
+        poll_counts = one_pps[polls]
+        previous_polls = np.empty_like(poll_counts)
+        if len(polls):
+            previous_polls[0] = self.last_one_pps_poll
+            previous_polls[1:] = poll_counts[:-1]
+        frequencies = (poll_counts - previous_polls) / 5.0
+        frequencies[~((0.5 * frequencies < DEFAULT_FREQUENCY) & (DEFAULT_FREQUENCY < 1.5 * frequencies))] = \
+            DEFAULT_FREQUENCY
+        frequencies = np.concatenate([[self.calculated_frequency], frequencies])
+        frequency = frequencies[np.searchsorted(polls, np.arange(count), side="right")]
+
+        # one pps count the line time refers to, the previous one for
+        # delayed one pps switches
+        same_time = np.empty(count, dtype=bool)
+        same_time[0] = isinstance(self.last_time, str) and times[0] == self.last_time.encode("ascii")
+        same_time[1:] = times[1:] == times[:-1]
+        reference_one_pps = np.where(changed & same_time, previous_one_pps, one_pps)
+
+        # GPS time of each line, converted once per second
+        gps_changes = np.empty(count, dtype=bool)
+        gps_changes[0] = (self._gps_time is None or times[0] != self._gps_time.encode("ascii") or
+                          corrections[0] != self._gps_correction.encode("ascii"))
+        gps_changes[1:] = (times[1:] != times[:-1]) | (corrections[1:] != corrections[:-1])
+        converted = []
+        for i in np.flatnonzero(gps_changes).tolist():
+            time, correction = times[i].decode("ascii"), corrections[i].decode("ascii")
+            try:
+                converted.append((time, correction, gps_time_to_seconds(time, correction)))
+            except (ValueError, IndexError):
+                # decoded line by line, skipping the broken lines
+                raise _FallBack()
+        anchors = [self._anchor]
+        day_offsets = [self.day_offset]
+        for time, correction, seconds in converted:
+            if self._gps_seconds is not None and seconds < self._gps_seconds - SECONDS_PER_DAY / 2:
+                # passed midnight
+                self.day_offset += SECONDS_PER_DAY
+            self._gps_time = time
+            self._gps_correction = correction
+            self._gps_seconds = seconds
+            self._anchor = seconds + self.day_offset
+            anchors.append(self._anchor)
+            day_offsets.append(self.day_offset)
+        gps_index = np.cumsum(gps_changes)
+        line_times = np.array(anchors)[gps_index] + (trigger_counts - reference_one_pps) / frequency
+
+        # edges, relative to the previous line for lines without trigger
+        counter_diffs = trigger_counts - previous_trigger_counts
+        counter_diffs[counter_diffs > COUNTER_OFFSET] -= COUNTER_OFFSET
+        offsets = counter_diffs / frequency * 1e9
+        offsets[triggers] = 0.0
+        self._add_events(builder, edges, offsets, triggers, line_times, matrix, layout,
+                         day_offsets, gps_index, np.asarray(indices, dtype=np.int64)[rows])
+
+        # state for the next lines
+        self.trigger_count = self.last_trigger_count = int(trigger_counts[-1])
+        if len(triggers):
+            self._event_trigger_count = int(trigger_counts[triggers[-1]])
+        self.prev_last_one_pps = int(previous_one_pps[-1])
+        self.last_one_pps = int(one_pps[-1])
+        self.passed_one_pps = (self.passed_one_pps + len(changes)) % 5
+        if len(polls):
+            self.last_one_pps_poll = int(poll_counts[-1])
+            self.calculated_frequency = float(frequencies[-1])
+        self.last_time = times[-1].decode("ascii")
+        if self.data_timestamps:
+            self.data_time = self._get_data_time(_string_field(matrix[-1:], *layout[GPS_DATE])[0].decode(),
+                                                 float(line_times[-1]), day_offsets[gps_index[-1]])
+
+    def _add_events(self, builder, edges, offsets, triggers, line_times, matrix, layout, day_offsets, gps_index,
+                    line_index):
+        """
+        Assemble the edges of the lines into events, pair rising and
+        falling edges and add the completed events to the builder
+        """
+        count = len(edges)
+        # event of each line, 0 is the event started before the block
+        line_events = np.zeros(count, dtype=np.int64)
+        line_events[triggers] = 1
+        np.cumsum(line_events, out=line_events)
+
+        valid = (edges & BIT5) != 0
+        values = offsets[:, None] + (edges & BIT0_4) * TMC_TICK
+
+        # rising and falling edges in the order of the lines, the edges of
+        # the event started before the block first
+        edge_groups, edge_values = [], []
+        for column, buffers in ((0, self.re), (1, self.fe)):
+            lines, channels = np.nonzero(valid[:, column::2])
+            carried = [(ch, value) for ch in range(4) for value in buffers["ch%d" % ch]]
+            edge_groups.append(np.concatenate([np.array([ch for ch, _ in carried], dtype=np.int64),
+                                               line_events[lines] * 4 + channels]))
+            edge_values.append(np.concatenate([np.array([value for _, value in carried], dtype=np.float64),
+                                               values[:, column::2][lines, channels]]))
+
+        # edges of the last event wait for the next block
+        open_group = len(triggers) * 4
+        for buffers, group, value in zip((self.re, self.fe), edge_groups, edge_values):
+            for ch in range(4):
+                buffers["ch%d" % ch][:] = value[group == open_group + ch].tolist()
+        if not len(triggers):
+            return
+
+        rise_completed = edge_groups[0] < open_group
+        fall_completed = edge_groups[1] < open_group
+        groups, rising, falling = pair_edges(edge_groups[0][rise_completed], edge_values[0][rise_completed],
+                                             edge_groups[1][fall_completed], edge_values[1][fall_completed])
+
+        trigger_times = np.empty(len(triggers))
+        trigger_times[0] = self.last_trigger_time
+        trigger_times[1:] = line_times[triggers[:-1]]
+        self.last_trigger_time = float(line_times[triggers[-1]])
+        trigger_lines = np.empty(len(triggers), dtype=np.int64)
+        trigger_lines[0] = self._trigger_line
+        trigger_lines[1:] = line_index[triggers[:-1]]
+        self._trigger_line = int(line_index[triggers[-1]])
+
+        event_times = None
+        if self.data_timestamps:
+            dates = _string_field(matrix[triggers], *layout[GPS_DATE])
+            event_times = [self.last_trigger_data_time]
+            for i, date in zip(triggers.tolist(), dates.tolist()):
+                event_times.append(self._get_data_time(date.decode("ascii"), float(line_times[i]),
+                                                       day_offsets[gps_index[i]]))
+            self.last_trigger_data_time = event_times.pop()
+            self.event_time = event_times[-1]
+
+        builder.add_events(trigger_times, event_times, trigger_lines, groups // 4, groups % 4, rising, falling)
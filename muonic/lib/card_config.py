@@ -0,0 +1,101 @@
+"""
+Persistent cache of the DAQ card configuration.
+
+The thresholds and the channel configuration of a card rarely change
+between measurements. The last configuration confirmed by each card is
+stored, so a measurement can start with it right away while the card is
+asked for its actual configuration in the background.
+"""
+import datetime
+import json
+import logging
+import os
+
+import muonic
+
+
+__all__ = ["CARD_SETTINGS", "CardConfigCache"]
+
+# settings reported by the card in reply to the TL and DC commands
+CARD_SETTINGS = (["threshold_ch%d" % i for i in range(4)] +
+                 ["gate_width", "veto"] +
+                 ["veto_ch%d" % i for i in range(3)] +
+                 ["active_ch%d" % i for i in range(4)] +
+                 ["coincidence%d" % i for i in range(4)])
+
+
+class CardConfigCache(object):
+    """
+    Stores the card configuration per device in a JSON file.
+
+    :param path: path of the cache file
+    :type path: str
+    :param logger: logger object
+    :type logger: logging.Logger
+    """
+
+    DEFAULT_PATH = os.path.join(muonic.CONFIG_PATH, "card_config.json")
+
+    def __init__(self, path=None, logger=None):
+        if logger is None:
+            logger = logging.getLogger(self.__module__ + '.' + self.__class__.__name__)
+        self.logger = logger
+        self.path = path or self.DEFAULT_PATH
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                devices = json.load(f)
+        except (IOError, OSError):
+            return {}
+        except ValueError:
+            self.logger.warning("Ignoring corrupt card configuration cache %s" % self.path)
+            return {}
+        return devices if isinstance(devices, dict) else {}
+
+    def load(self, device_id):
+        """
+        Last confirmed configuration of a device. Returns None if the device
+        is unknown or the cached configuration is incomplete.
+
+        :param device_id: identifier of the device
+        :type device_id: str
+        :returns: dict or None
+        """
+        entry = self._read().get(device_id)
+        if not isinstance(entry, dict):
+            return None
+        settings = entry.get("settings", {})
+        if not all(key in settings for key in CARD_SETTINGS):
+            return None
+        return dict((key, settings[key]) for key in CARD_SETTINGS)
+
+    def store(self, device_id, settings):
+        """
+        Store the configuration of a device. The file is replaced
+        atomically, so concurrent measurements never read a partial file.
+
+        :param device_id: identifier of the device
+        :type device_id: str
+        :param settings: card settings
+        :type settings: dict
+        :returns: bool -- True if the configuration was written
+        """
+        devices = self._read()
+        devices[device_id] = {
+            "updated": datetime.datetime.utcnow().isoformat(),
+            "settings": dict((key, settings[key]) for key in CARD_SETTINGS if key in settings)
+        }
+
+        tmp_path = "%s.%d.tmp" % (self.path, os.getpid())
+        try:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            with open(tmp_path, "w") as f:
+                json.dump(devices, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+        except (IOError, OSError) as e:
+            self.logger.warning("Could not write card configuration cache %s: %s" % (self.path, e))
+            return False
+        return True
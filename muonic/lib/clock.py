@@ -0,0 +1,269 @@
+"""
+Reconstruction of the DAQ card clock for whole raw data files.
+
+PulseExtractor calculates the time of each line while reading the lines
+one by one: it corrects counter rollovers by comparing each value to the
+previous one and averages the frequency over five PPS. The ClockModel
+does this for all lines of a file at once with numpy. It unwraps the
+counters, finds the PPS edges and their GPS seconds, and interpolates
+the time of each line linearly between the two PPS edges around it, so
+the frequency is fitted for each second separately.
+
+The times belong to the decoded lines, not to events. The events of the
+BatchPulseExtractor refer to their trigger lines, so batch_decays
+--clock-model times its events with the model of each file. By default
+the scripts keep the line times of the BatchPulseExtractor, which are
+the same as in a live measurement.
+"""
+import datetime
+
+import numpy as np
+
+from .batch import decode_lines
+from .utils import DEFAULT_FREQUENCY, NO_GPS_DATE, SECONDS_PER_DAY, gps_time_to_seconds
+
+
+__all__ = ["unwrap_counter", "gps_seconds", "ClockModel"]
+
+# range of the 32 bit trigger counter of the DAQ card
+COUNTER_RANGE = 1 << 32
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def unwrap_counter(values, seconds=None, frequency=DEFAULT_FREQUENCY):
+    """
+    Remove the rollovers of a counter which only counts up, so that the
+    values keep increasing. The counter may roll over several times.
+
+    Without seconds, each step between two values is taken to be less
+    than the counter range. With the GPS seconds of the values, the
+    number of rollovers of each step is the one closest to the seconds
+    passed, so also gaps longer than the counter range (about 172 s at
+    25 MHz) are unwrapped. The seconds are the median of each value and
+    its neighbours, so single values with a broken GPS time do not add
+    rollovers.
+
+    :param values: raw counter values
+    :type values: numpy.ndarray
+    :param seconds: GPS seconds of the values, NaN if unknown
+    :type seconds: numpy.ndarray
+    :param frequency: counts per second
+    :type frequency: float
+    :returns: numpy.ndarray of int64
+    """
+    values = np.asarray(values, dtype=np.int64)
+    unwrapped = np.empty_like(values)
+    if len(values):
+        steps = np.diff(values) % COUNTER_RANGE
+        if seconds is not None:
+            seconds = np.asarray(seconds, dtype=np.float64)
+            # unknown seconds take the previous known ones
+            known = ~np.isnan(seconds)
+            if known.any():
+                filled = np.maximum.accumulate(np.where(known, np.arange(len(seconds)), -1))
+                filled[filled < 0] = np.flatnonzero(known)[0]
+                seconds = seconds[filled]
+            neighbours = np.stack([np.append(seconds[:1], seconds[:-1]), seconds,
+                                   np.append(seconds[1:], seconds[-1:])])
+            seconds = np.median(neighbours, axis=0)
+            with np.errstate(invalid="ignore"):
+                rollovers = np.round((np.diff(seconds) * frequency - steps) / COUNTER_RANGE)
+            rollovers[~(rollovers > 0)] = 0
+            steps += rollovers.astype(np.int64) * COUNTER_RANGE
+        unwrapped[0] = values[0]
+        np.cumsum(steps, out=unwrapped[1:])
+        unwrapped[1:] += values[0]
+    return unwrapped
+
+
+def gps_seconds(times, corrections):
+    """
+    Seconds since day start of the GPS times of the lines, increased by a
+    day after each midnight like the line times of PulseExtractor. Each
+    GPS time is converted once. Lines with an invalid GPS time get NaN.
+
+    :param times: GPS times as hhmmss.sss
+    :type times: numpy.ndarray of bytes
+    :param corrections: GPS time corrections in ms
+    :type corrections: numpy.ndarray of bytes
+    :returns: numpy.ndarray of float64
+    """
+    count = len(times)
+    changes = np.ones(count, dtype=bool)
+    changes[1:] = (times[1:] != times[:-1]) | (corrections[1:] != corrections[:-1])
+    indices = np.flatnonzero(changes)
+
+    values = np.empty(len(indices))
+    for i, (time, correction) in enumerate(zip(times[indices].tolist(), corrections[indices].tolist())):
+        try:
+            values[i] = gps_time_to_seconds(time.decode("ascii"), correction.decode("ascii"))
+        except (ValueError, IndexError, UnicodeDecodeError):
+            values[i] = np.nan
+
+    # passed midnight
+    valid = ~np.isnan(values)
+    seconds = values[valid]
+    midnight = np.zeros(len(seconds))
+    midnight[1:] = seconds[1:] < seconds[:-1] - SECONDS_PER_DAY / 2
+    values[valid] += np.cumsum(midnight) * SECONDS_PER_DAY
+
+    return np.repeat(values, np.diff(np.append(indices, count)))
+
+
+class ClockModel(object):
+    """
+    Clock of a DAQ card reconstructed from the trigger counts, the counts
+    at the last PPS and the GPS times of its lines.
+
+    Each PPS edge gets the latest GPS second of the lines referring to
+    it, as the GPS time of the first lines after a PPS may still be the
+    one of the previous second (delayed PPS switch). If all lines of a
+    second were delayed, the second of the edge is corrected by the
+    seconds of the previous and next edges and the counts between them;
+    GPS times going back by a single second can therefore not be told
+    apart from delayed switches and are ignored. The frequency
+    between two edges is the number of counts per second between them;
+    if it deviates by more than tolerance from the median frequency, the
+    median frequency is used instead.
+
+    The times are float64 seconds since the start of day, the day of the
+    first GPS date of the lines.
+
+    :param trigger_counts: raw trigger counts of the lines
+    :type trigger_counts: numpy.ndarray
+    :param one_pps: raw counts at the last PPS of the lines
+    :type one_pps: numpy.ndarray
+    :param seconds: GPS seconds of the lines, see gps_seconds
+    :type seconds: numpy.ndarray
+    :param day: day of the first line
+    :type day: datetime.datetime
+    :param tolerance: relative deviation of the frequency from the
+                      median frequency which is still accepted
+    :type tolerance: float
+    """
+
+    def __init__(self, trigger_counts, one_pps, seconds, day=NO_GPS_DATE, tolerance=0.01):
+        self.day = day
+        seconds = np.asarray(seconds, dtype=np.float64)
+        # the counts at the last PPS are a copy of the trigger counter,
+        # so they are unwrapped by the counts passed since the PPS
+        since_pps = (np.asarray(trigger_counts, dtype=np.int64) - one_pps) % COUNTER_RANGE
+        edge_index, observed = self._find_edges(unwrap_counter(trigger_counts), since_pps, seconds)
+        self.frequency = self._median_frequency(observed)
+        with np.errstate(invalid="ignore"):
+            long_gaps = (np.diff(seconds) * self.frequency > COUNTER_RANGE / 2).any()
+        if long_gaps:
+            # the counter may have rolled over more than once between two
+            # lines, count the rollovers by the GPS seconds
+            edge_index, observed = self._find_edges(unwrap_counter(trigger_counts, seconds, self.frequency),
+                                                    since_pps, seconds)
+        # after a missing PPS, the lines refer to an edge more than a
+        # second ago; rounding errors only make the seconds too small
+        passed = np.floor(since_pps / self.frequency + 0.01)
+        observed.fill(np.nan)
+        np.fmax.at(observed, edge_index, seconds - passed)
+        self.pps_seconds = self._edge_seconds(observed)
+
+        # counts per second between the edges, the last one also applies
+        # to the lines after the last edge
+        count_steps = np.diff(self.pps_counts)
+        second_steps = np.diff(self.pps_seconds)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            frequencies = count_steps / second_steps
+        frequencies[~(np.abs(frequencies / self.frequency - 1) <= tolerance)] = self.frequency
+        self.frequencies = np.append(frequencies, frequencies[-1] if len(frequencies) else self.frequency)
+
+        edges = np.searchsorted(self.pps_counts, self.trigger_counts, side="right") - 1
+        np.clip(edges, 0, None, out=edges)
+        self.times = (self.pps_seconds[edges] +
+                      (self.trigger_counts - self.pps_counts[edges]) / self.frequencies[edges])
+
+    def _find_edges(self, trigger_counts, since_pps, seconds):
+        """
+        Set the unwrapped trigger and PPS counts and the PPS edges
+
+        :returns: tuple of the edge of each line and the latest GPS
+                  second referring to each edge
+        """
+        self.trigger_counts = trigger_counts
+        self.one_pps = trigger_counts - since_pps
+        self.pps_counts, edge_index = np.unique(self.one_pps, return_inverse=True)
+        observed = np.full(len(self.pps_counts), np.nan)
+        np.fmax.at(observed, edge_index, seconds)
+        return edge_index, observed
+
+    def _median_frequency(self, observed):
+        """
+        Median of the counts per second between the PPS edges with GPS
+        seconds, DEFAULT_FREQUENCY without such edges
+        """
+        second_steps = np.diff(observed)
+        valid = second_steps > 0
+        if not valid.any():
+            return DEFAULT_FREQUENCY
+        return float(np.median(np.diff(self.pps_counts)[valid] / second_steps[valid]))
+
+    def _edge_seconds(self, observed):
+        """
+        Seconds of the PPS edges: the number of seconds passed according
+        to the counts plus the offset to the GPS seconds, corrected for
+        delayed switches
+        """
+        passed = np.zeros(len(self.pps_counts))
+        np.cumsum(np.maximum(np.round(np.diff(self.pps_counts) / self.frequency), 1), out=passed[1:])
+        offsets = observed - passed
+        valid = ~np.isnan(offsets)
+        if not valid.any():
+            return passed
+        # edges without GPS second take the offset of the previous edge
+        # with one, or of the first one
+        filled = np.maximum.accumulate(np.where(valid, np.arange(len(offsets)), -1))
+        filled[filled < 0] = np.flatnonzero(valid)[0]
+        offsets = offsets[filled]
+
+        # the offsets of delayed edges are one second too small, so each
+        # edge takes the largest offset of the edges before it, restarting
+        # after the GPS time went back by more than a second
+        whole = np.round(offsets).astype(np.int64)
+        fraction = offsets - whole
+        runs = np.zeros(len(whole), dtype=np.int64)
+        np.cumsum(np.diff(whole) < -1, out=runs[1:])
+        shift = runs << 40
+        whole = np.maximum.accumulate(whole + shift) - shift
+        # the first edges of the runs are corrected by the next edge
+        starts = np.flatnonzero(np.diff(runs, prepend=-1))
+        starts = starts[starts + 1 < len(whole)]
+        delayed = starts[(runs[starts + 1] == runs[starts]) & (whole[starts + 1] == whole[starts] + 1)]
+        whole[delayed] += 1
+        return passed + whole + fraction
+
+    @classmethod
+    def from_lines(cls, lines, tolerance=0.01):
+        """
+        Reconstruct the clock of the event lines of raw DAQ data
+
+        :param lines: DAQ lines, e.g. of a whole file
+        :type lines: list of str
+        :param tolerance: see ClockModel
+        :type tolerance: float
+        :returns: tuple of the ClockModel and the decoded lines
+                  (muonic.lib.batch.RawLines), the times belong to the
+                  rows of the decoded lines
+        """
+        raw = decode_lines(lines)
+        day = NO_GPS_DATE
+        if len(raw):
+            try:
+                day = datetime.datetime.strptime(raw.dates[0].decode("ascii"), "%d%m%y")
+            except (ValueError, UnicodeDecodeError):
+                pass
+        return cls(raw.trigger_counts, raw.one_pps, gps_seconds(raw.times, raw.corrections), day, tolerance), raw
+
+    def timestamps(self):
+        """
+        Times of the lines as seconds since the epoch
+
+        :returns: numpy.ndarray of float64
+        """
+        return (self.day - EPOCH).total_seconds() + self.times
@@ -1,10 +1,14 @@
 
 import os
 import datetime
+import itertools
 import logging
 from threading import Thread
+from time import perf_counter
 from queue import Queue
 from .analyzers import DataTypes
+from .metrics import REGISTRY
+from .tracing import current_trace
 from uuid import UUID
 
 class AbstractConsumer(object):
@@ -85,7 +89,10 @@ class AbstractMuonicConsumer(AbstractConsumer):
                                                    data.get('query_time'), meta),
             DataTypes.DECAY: lambda: self.push_decay(data.get('decay_time'), data.get('event_time'), meta),
             DataTypes.VELOCITY: lambda: self.push_velocity(data.get('flight_time'), data.get('event_time'), meta),
-            DataTypes.PULSE: lambda: self.push_pulse(data.get('pulse_widths'), data.get('event_time'), meta)
+            DataTypes.PULSE: lambda: self.push_pulse(data.get('pulse_widths'), data.get('event_time'), meta),
+            DataTypes.PLATEAU: lambda: self.push_plateau(data.get('threshold'), data.get('rates'),
+                                                         data.get('errors'), data.get('counts'),
+                                                         data.get('live_time'), meta)
         }
 
         switcher.get(data_type, lambda: 0)()
@@ -162,6 +169,27 @@ class AbstractMuonicConsumer(AbstractConsumer):
         """
         raise NotImplementedError
 
+    def push_plateau(self, threshold, rates, errors, counts, live_time, meta):
+        """
+        Handle a point of a threshold plateau scan. Consumers which do not
+        handle plateau scans ignore it.
+
+        :param threshold: threshold of the scanned channels in mV
+        :type threshold: int
+        :param rates: rates of channel 0-3 at the threshold
+        :type rates: list
+        :param errors: statistical errors of the rates
+        :type errors: list
+        :param counts: pulse counts of channel 0-3
+        :type counts: list
+        :param live_time: measurement time of the point in seconds
+        :type live_time: float
+        :param meta: meta info (run_id and analyzer_id)
+        :type meta: dict
+        :return:
+        """
+        pass
+
 
 class DummyConsumer(AbstractConsumer):
     """
@@ -179,6 +207,8 @@ class BufferedConsumer(AbstractConsumer):
           Such calls should be silently ignored.
     """
 
+    _instance_counter = itertools.count()
+
     def __init__(self, buffer_size, *consumers):
         self.logger = logging.getLogger(self.__module__ + '.' + self.__class__.__name__)
         self.consumers = consumers
@@ -189,6 +219,67 @@ class BufferedConsumer(AbstractConsumer):
         self.analyzer_count = 0
         self._joinable = False
 
+        # metrics
+        self.name = "buffer%d" % next(BufferedConsumer._instance_counter)
+        REGISTRY.gauge("muonic_queue_depth", "Number of items waiting in a queue",
+                       function=lambda: self.queue.qsize(), queue=self.name)
+        REGISTRY.gauge("muonic_queue_capacity", "Maximum number of items in a queue",
+                       function=lambda: self._buffer_size, queue=self.name)
+        self._full_counter = REGISTRY.counter("muonic_queue_full_total",
+                                              "Pushes which found the queue full and had to wait",
+                                              queue=self.name)
+        # consumers and their timers, replaced as a whole when consumers
+        # are added or removed while the buffer thread is running
+        self._targets = [(consumer, self._consumer_timer(consumer)) for consumer in consumers]
+
+    @staticmethod
+    def _consumer_timer(consumer):
+        return REGISTRY.timer("muonic_consumer_seconds", "Time spent in consumers",
+                              consumer=consumer.__class__.__name__)
+
+    def add_consumer(self, consumer, streams=()):
+        """
+        Add a consumer, also while analyzers are running. The consumer is
+        started for the running analyzers before it receives data.
+
+        :param consumer: consumer to add
+        :type consumer: AbstractConsumer
+        :param streams: run id, analyzer id and data types of the running
+                        analyzers
+        :type streams: list of tuples
+        :returns: None
+        """
+        for run_id, analyzer_id, data_types in streams:
+            consumer.start(run_id, analyzer_id, data_types)
+        self.consumers = tuple(self.consumers) + (consumer,)
+        self._targets = self._targets + [(consumer, self._consumer_timer(consumer))]
+
+    def remove_consumer(self, consumer, streams=()):
+        """
+        Remove a consumer, also while analyzers are running. The consumer
+        is stopped for the running analyzers and finished afterwards.
+
+        Raises ValueError if the consumer is not registered.
+
+        :param consumer: consumer to remove
+        :type consumer: AbstractConsumer
+        :param streams: run id, analyzer id and data types of the running
+                        analyzers
+        :type streams: list of tuples
+        :raises: ValueError
+        :returns: None
+        """
+        if consumer not in self.consumers:
+            raise ValueError("consumer is not registered")
+        self.consumers = tuple(c for c in self.consumers if c is not consumer)
+        self._targets = [target for target in self._targets if target[0] is not consumer]
+        # let the buffer thread finish the data it may currently pass to
+        # the consumer
+        self.queue.join()
+        for run_id, analyzer_id, data_types in streams:
+            consumer.stop(run_id, analyzer_id)
+            consumer.finish(analyzer_id)
+
     def start(self, run_id, analyzer_id='', expected_data_types=[]):
         for consumer in self.consumers:
             consumer.start(run_id, analyzer_id, expected_data_types)
@@ -219,14 +310,21 @@ class BufferedConsumer(AbstractConsumer):
         for consumer in self.consumers:
             consumer.finish(analyzer_id)
 
+        if self.analyzer_count == 0:
+            REGISTRY.remove("muonic_queue_depth", queue=self.name)
+            REGISTRY.remove("muonic_queue_capacity", queue=self.name)
+            REGISTRY.remove("muonic_queue_full_total", queue=self.name)
+
     def push(self, data, data_type, run_id, analyzer_id=''):
-        self.queue.put([data, data_type, run_id, analyzer_id])
+        if self.queue.full():
+            self._full_counter.value += 1
+        self.queue.put([data, data_type, run_id, analyzer_id, current_trace()])
 
     def _process_data(self):
         # print("DEBUG BufferedConsumer._process_data BEGIN")
 
         while not self.cancel:
-            self.logger.debug('Processing next item. Buffer size: %d' % self.queue.qsize())
+            self.logger.debug('Processing next item. Buffer size: %d', self.queue.qsize())
 
             if self.queue.full():
                 self.logger.warning('Buffer limit reached')
@@ -236,8 +334,15 @@ class BufferedConsumer(AbstractConsumer):
             if data is None:
                 break
 
-            for consumer in self.consumers:
+            data, trace = data[:4], data[4]
+
+            for consumer, timer in self._targets:
+                t0 = perf_counter()
                 consumer.push(*data)
+                timer.observe(perf_counter() - t0)
+
+            if trace is not None:
+                trace.stamp('consumer')
 
             self.queue.task_done()
 
@@ -262,17 +367,36 @@ class FileConsumer(AbstractMuonicConsumer):
     Writes data to files
     """
 
+    _instance_counter = itertools.count()
+
     # TODO: This consumer can be further simplified by abstracting the string creation with formaters
     # TODO: (i.e. formater receives data and data type) - can then derive from AbstractConsumer instead
     def __init__(self, data_dir, logger = None):
         super(FileConsumer, self).__init__(logger=logger)
         self.data_dir = data_dir
         self.open_files = {}
+        self._write_counters = {}
+        self.name = "file%d" % next(FileConsumer._instance_counter)
+
+    def _count_open_files(self):
+        return sum(len(v) for v in self.open_files.values())
+
+    def _count_write(self, data_type):
+        counter = self._write_counters.get(data_type)
+        if counter is None:
+            counter = REGISTRY.counter("muonic_file_lines_total", "Lines written by file consumers",
+                                       data_type=str(data_type))
+            self._write_counters[data_type] = counter
+        counter.value += 1
 
     def __del__(self):
         self.close_files()
 
     def start(self, run_id, analyzer_id='', expected_data_types=[]):
+        # registered while analyzers run and removed in finish, so the
+        # registry does not keep removed consumers alive
+        REGISTRY.gauge("muonic_open_files", "Files currently opened by file consumers",
+                       function=self._count_open_files, consumer=self.name)
         self.open_files[analyzer_id] = {}
         for dt in expected_data_types:
             try:
@@ -285,7 +409,8 @@ class FileConsumer(AbstractMuonicConsumer):
         self.close_files(analyzer_id)
 
     def finish(self, analyzer_id=''):
-        pass
+        if not self.open_files:
+            REGISTRY.remove("muonic_open_files", consumer=self.name)
 
     def close_files(self, analyzer_id=None):
         if analyzer_id is not None:
@@ -319,6 +444,7 @@ class FileConsumer(AbstractMuonicConsumer):
             return
         file = self.open_files[aid].get(DataTypes.RATE, None)
         if file:
+            self._count_write(DataTypes.RATE)
             file.write(
                 "%s %f %f %f %f %f %f %f %f %f %f %f \n" %
                 (query_time.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3],
@@ -337,6 +463,7 @@ class FileConsumer(AbstractMuonicConsumer):
             return
         file = self.open_files[aid].get(DataTypes.VELOCITY, None)
         if file:
+            self._count_write(DataTypes.VELOCITY)
             file.write("%s %s\n" % (
                 event_time.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3],
                 repr(flight_time)))
@@ -350,6 +477,7 @@ class FileConsumer(AbstractMuonicConsumer):
             return
         file = self.open_files[aid].get(DataTypes.DECAY, None)
         if file:
+            self._count_write(DataTypes.DECAY)
             file.write("%s %d\n" % (event_time.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3],
                                     decay_time))
         else:
@@ -362,18 +490,33 @@ class FileConsumer(AbstractMuonicConsumer):
             return
         file = self.open_files[aid].get(DataTypes.PULSE, None)
         if file:
+            self._count_write(DataTypes.PULSE)
             l = event_time.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3] + ' ' + ' '.join([str(value) for (key, value) in pulse_widths.items()])
             file.write(l + '\n')
         else:
             self.logger.warning('Received %s data from %s: Not in expected data types!'
                                 % (DataTypes.PULSE.name, meta.get('analyzer_id')))
 
+    def push_plateau(self, threshold, rates, errors, counts, live_time, meta):
+        aid = meta.get('analyzer_id')
+        if aid not in self.open_files:  # push called after stop for aid - ignore silently
+            return
+        file = self.open_files[aid].get(DataTypes.PLATEAU, None)
+        if file:
+            self._count_write(DataTypes.PLATEAU)
+            file.write("%d %f %s\n" % (threshold, live_time, ' '.join(
+                    "%f %f %d" % (rates[i], errors[i], counts[i]) for i in range(4))))
+        else:
+            self.logger.warning('Received %s data from %s: Not in expected data types!'
+                                % (DataTypes.PLATEAU.name, meta.get('analyzer_id')))
+
     def push_raw(self, data, meta):
         aid = meta.get('analyzer_id')
         if aid not in self.open_files:  # push called after stop for aid - ignore silently
             return
         file = self.open_files[aid].get(DataTypes.RAW, None)
         if file:
+            self._count_write(DataTypes.RAW)
             file.write(data + '\n')
         else:
             self.logger.warning('Received %s data from %s: Not in expected data types!'
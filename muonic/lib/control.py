@@ -0,0 +1,274 @@
+"""
+Control socket to change a running measurement.
+
+The control server listens on a local Unix socket. Each line sent to the
+socket is a JSON command, each command is answered with one JSON line:
+
+    {"command": "list"}
+    {"command": "add_analyzer", "analyzer": "decay", "options": {"decay_min_time": 300}}
+    {"command": "configure_analyzer", "analyzer": "rate", "options": {"time_window": 10}}
+    {"command": "disable_analyzer", "analyzer": "decay"}
+    {"command": "enable_analyzer", "analyzer": "decay"}
+    {"command": "remove_analyzer", "analyzer": "decay"}
+    {"command": "add_consumer", "consumer": "file", "options": {"data_path": "/data"}}
+    {"command": "remove_consumer", "consumer": "FileConsumer0"}
+
+Answers are {"ok": true, "result": ...} or {"ok": false, "error": "..."}.
+
+Commands are executed by the main loop of the App between two batches of
+DAQ data, so the data keeps flowing into the reader queue meanwhile and
+no data is lost.
+"""
+import concurrent.futures
+import functools
+import json
+import logging
+import os
+import socketserver
+import threading
+
+from .analyzers import BaseAnalyzer
+
+
+__all__ = ["CONSUMERS", "ControlServer"]
+
+# consumers which can be added with add_consumer
+CONSUMERS = {
+    "file": "muonic.lib.consumers.FileConsumer",
+    "raw": "muonic.lib.consumers.DummyConsumer",
+}
+
+
+class _ControlRequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            line = line.strip()
+            if not line:
+                continue
+            reply = self.server.control.handle_line(line.decode("utf-8", "replace"))
+            self.wfile.write(json.dumps(reply, default=str).encode("utf-8") + b"\n")
+
+
+class _UnixControlServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class ControlServer(object):
+    """
+    Serves control commands for a running App on a Unix socket.
+
+    :param app: the App to control
+    :type app: muonic.lib.app.App
+    :param path: path of the Unix socket
+    :type path: str
+    :param consumers: buffered consumers of the analyzers; new analyzers
+                      pass their results to them and new consumers are
+                      added to the first of them
+    :type consumers: list of muonic.lib.consumers.BufferedConsumer
+    :param analyzers: analyzer names mapped to dotted class names
+    :type analyzers: dict
+    :param options: command line options, the defaults for new analyzers
+    :type options: dict
+    :param timeout: seconds to wait for the main loop to run a command
+    :type timeout: float
+    :param logger: logger object
+    :type logger: logging.Logger
+    """
+
+    def __init__(self, app, path, consumers, analyzers=None, options=None, timeout=10.0, logger=None):
+        if logger is None:
+            logger = logging.getLogger(self.__module__ + '.' + self.__class__.__name__)
+        self.logger = logger
+        self.app = app
+        self.path = path
+        self.buffers = list(consumers)
+        self.analyzer_classes = dict(analyzers or {})
+        self.options = dict(options or {})
+        self.timeout = timeout
+
+        # consumers which can be removed, by name
+        self.consumers = {}
+        for buffer in self.buffers:
+            for consumer in buffer.consumers:
+                self._register_consumer(consumer)
+
+        self._server = None
+        self._thread = None
+
+    def _register_consumer(self, consumer):
+        index = 0
+        while "%s%d" % (consumer.__class__.__name__, index) in self.consumers:
+            index += 1
+        name = "%s%d" % (consumer.__class__.__name__, index)
+        self.consumers[name] = consumer
+        return name
+
+    def start(self):
+        if self._server is not None:
+            return
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = _UnixControlServer(self.path, _ControlRequestHandler)
+        self._server.control = self
+        # only the user running muonic may control it
+        os.chmod(self.path, 0o600)
+        self._thread = threading.Thread(target=self._server.serve_forever, name="tCONTROL")
+        self._thread.daemon = True
+        self._thread.start()
+        self.logger.info("Listening for control commands on %s" % self.path)
+
+    def stop(self):
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = None
+        self._thread = None
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    def handle_line(self, line):
+        """
+        Execute a JSON command in the main loop of the App and wait for
+        the result
+
+        :param line: JSON command
+        :type line: str
+        :returns: dict -- the answer
+        """
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("command must be an object")
+            command = request.pop("command", None)
+            handler = getattr(self, "cmd_%s" % command, None) if isinstance(command, str) else None
+            if handler is None:
+                raise ValueError("unknown command %r" % command)
+            if self.app.closed:
+                raise ValueError("the measurement has ended")
+            result = self.app.call_soon(functools.partial(handler, **request)).result(self.timeout)
+        except concurrent.futures.TimeoutError:
+            return {"ok": False, "error": "timeout, no measurement is running"}
+        except (ValueError, KeyError, TypeError, ImportError) as e:
+            return {"ok": False, "error": str(e)}
+        except Exception as e:
+            self.logger.exception("Control command failed")
+            return {"ok": False, "error": "%s: %s" % (e.__class__.__name__, e)}
+        return {"ok": True, "result": result}
+
+    def _analyzers(self):
+        return [x for x in self.app.analyzers if isinstance(x, BaseAnalyzer)]
+
+    def _find_analyzer(self, name):
+        """
+        Analyzer of the chain by class name or command line name, e.g.
+        'decay' or 'DecayAnalyzer'
+
+        :param name: name of the analyzer
+        :type name: str
+        :returns: BaseAnalyzer
+        """
+        class_name = self.analyzer_classes.get(name, name).rpartition('.')[2]
+        for analyzer in self._analyzers():
+            if analyzer.__class__.__name__ == class_name:
+                return analyzer
+        raise ValueError("no analyzer %r running in the main process" % name)
+
+    def _streams(self, analyzers=None):
+        """
+        Run id, analyzer id and data types of the active analyzers
+
+        :returns: list of tuples
+        """
+        streams = []
+        for analyzer in self._analyzers() if analyzers is None else analyzers:
+            if analyzer.active:
+                streams.extend((analyzer.current_run_id, name, data_types)
+                               for name, data_types in analyzer.result_streams())
+        return streams
+
+    def cmd_list(self):
+        return {
+            "run_id": self.app.run_id,
+            "analyzers": [{"name": analyzer.__class__.__name__,
+                           "active": analyzer.active,
+                           "disabled": analyzer.disabled,
+                           "options": dict((option, getattr(analyzer, attribute))
+                                           for option, (attribute, _) in analyzer.CONFIGURABLE.items())}
+                          for analyzer in self._analyzers()],
+            "consumers": sorted(self.consumers)
+        }
+
+    def cmd_add_analyzer(self, analyzer, options=None):
+        if analyzer not in self.analyzer_classes:
+            raise ValueError("unknown analyzer %r, available: %s" %
+                             (analyzer, ", ".join(sorted(self.analyzer_classes))))
+        cls = self.app.import_class(self.analyzer_classes[analyzer])
+        if any(x.__class__ is cls for x in self._analyzers()):
+            raise ValueError("%s is already running" % cls.__name__)
+
+        instance = cls(consumers=self.buffers, **dict(self.options, **(options or {})))
+        if self.app.running:
+            instance.start(self.app.run_id, self.app.daq)
+        self.app.add_analyzer(instance)
+        self.logger.info("Added %s" % cls.__name__)
+        return cls.__name__
+
+    def cmd_remove_analyzer(self, analyzer):
+        instance = self._find_analyzer(analyzer)
+        self.app.analyzers.remove(instance)
+        instance.stop()
+        instance.finish()
+        self.logger.info("Removed %s" % instance.__class__.__name__)
+        return instance.__class__.__name__
+
+    def cmd_configure_analyzer(self, analyzer, options):
+        if not isinstance(options, dict):
+            raise ValueError("options must be an object")
+        instance = self._find_analyzer(analyzer)
+        instance.configure(**options)
+        return instance.__class__.__name__
+
+    def cmd_disable_analyzer(self, analyzer):
+        instance = self._find_analyzer(analyzer)
+        instance.disabled = True
+        return instance.__class__.__name__
+
+    def cmd_enable_analyzer(self, analyzer):
+        instance = self._find_analyzer(analyzer)
+        instance.disabled = False
+        return instance.__class__.__name__
+
+    def cmd_add_consumer(self, consumer, options=None):
+        if consumer not in CONSUMERS:
+            raise ValueError("unknown consumer %r, available: %s" % (consumer, ", ".join(sorted(CONSUMERS))))
+        if not self.buffers:
+            raise ValueError("no consumer buffer to add the consumer to")
+        options = options or {}
+        cls = self.app.import_class(CONSUMERS[consumer])
+        if consumer == "file":
+            if not options.get("data_path"):
+                raise ValueError("the file consumer needs a data_path")
+            instance = cls(data_dir=options["data_path"], logger=self.logger)
+        else:
+            instance = cls()
+
+        self.buffers[0].add_consumer(instance, self._streams())
+        name = self._register_consumer(instance)
+        self.logger.info("Added consumer %s" % name)
+        return name
+
+    def cmd_remove_consumer(self, consumer):
+        instance = self.consumers.get(consumer)
+        if instance is None:
+            raise ValueError("no consumer %r" % consumer)
+        for buffer in self.buffers:
+            if instance in buffer.consumers:
+                buffer.remove_consumer(instance, self._streams())
+        del self.consumers[consumer]
+        self.logger.info("Removed consumer %s" % consumer)
+        return consumer
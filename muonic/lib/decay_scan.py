@@ -0,0 +1,190 @@
+"""
+Scan of the cuts of the decay analysis in one pass over the events.
+
+The DecayScan evaluates many configurations of the DecayAnalyzer cuts
+at once: the decay candidates of the events are determined once per
+channel assignment, and the pulse width and decay time cuts of all
+configurations are applied to them as one boolean matrix. For each
+configuration the number of decays and the muon lifetime are estimated.
+"""
+import collections
+import itertools
+import logging
+
+import numpy as np
+
+from .utils import DecayTriggerThorough
+
+
+__all__ = ["CUT_OPTIONS", "cut_grid", "lifetime", "DecayScan"]
+
+# options of the DecayAnalyzer which can be scanned and their defaults
+CUT_OPTIONS = collections.OrderedDict([
+    ("single_pulse_channel", 0),
+    ("double_pulse_channel", 1),
+    ("veto_pulse_channel", 2),
+    ("min_single_pulse_width", 0),
+    ("max_single_pulse_width", 12000),
+    ("min_double_pulse_width", 0),
+    ("max_double_pulse_width", 12000),
+    ("decay_min_time", 0),
+])
+
+
+def cut_grid(**values):
+    """
+    All combinations of the given values of the cut options, the other
+    options keep their defaults
+
+    :param values: lists of values by option name, see CUT_OPTIONS
+    :type values: dict
+    :returns: list of dict
+    :raises: ValueError if an option is unknown
+    """
+    unknown = set(values) - set(CUT_OPTIONS)
+    if unknown:
+        raise ValueError("unknown cut options: %s" % ", ".join(sorted(unknown)))
+    names = list(values)
+    return [dict(CUT_OPTIONS, **dict(zip(names, combination)))
+            for combination in itertools.product(*[values[name] for name in names])]
+
+
+def lifetime(mean, length, iterations=60):
+    """
+    Maximum likelihood estimate of the lifetime of an exponential decay
+    observed within a window of the given length, from the mean of the
+    decay times measured from the start of the window. Vectorized over
+    the arguments.
+
+    :param mean: mean decay time after the start of the window
+    :type mean: numpy.ndarray
+    :param length: length of the window
+    :type length: numpy.ndarray
+    :param iterations: bisection steps
+    :type iterations: int
+    :returns: numpy.ndarray -- the lifetime, NaN if the decay times are
+              not compatible with an exponential decay
+    """
+    mean, length = np.broadcast_arrays(np.asarray(mean, dtype=np.float64), np.asarray(length, dtype=np.float64))
+    # the mean of the truncated exponential distribution increases from
+    # 0 to length / 2 with the lifetime, bisect on the log of the lifetime
+    low = np.log(length) - 10.0
+    high = np.log(length) + 10.0
+    with np.errstate(over="ignore", invalid="ignore", divide="ignore"):
+        for _ in range(iterations):
+            middle = (low + high) / 2
+            tau = np.exp(middle)
+            too_small = tau - length / np.expm1(length / tau) < mean
+            low = np.where(too_small, middle, low)
+            high = np.where(too_small, high, middle)
+    tau = np.exp((low + high) / 2)
+    tau[~((mean > 0) & (mean < length / 2))] = np.nan
+    return tau
+
+
+class DecayScan(object):
+    """
+    Evaluates a list of cut configurations of the DecayAnalyzer on the same
+    events. The configurations are dicts with the options of CUT_OPTIONS,
+    missing options take their defaults, see also cut_grid.
+
+    :param configurations: cut configurations
+    :type configurations: list of dict
+    :param logger: logger object
+    :type logger: logging.Logger
+    """
+
+    def __init__(self, configurations, logger=None):
+        if logger is None:
+            logger = logging.getLogger(self.__module__ + '.' + self.__class__.__name__)
+        self.logger = logger
+        self.trigger = DecayTriggerThorough(logger)
+
+        self.configurations = []
+        for configuration in configurations:
+            unknown = set(configuration) - set(CUT_OPTIONS)
+            if unknown:
+                raise ValueError("unknown cut options: %s" % ", ".join(sorted(unknown)))
+            self.configurations.append(dict(CUT_OPTIONS, **configuration))
+        self.cuts = dict((name, np.array([configuration[name] for configuration in self.configurations],
+                                         dtype=np.float64)[:, None])
+                         for name in CUT_OPTIONS)
+
+        # configurations by channel assignment
+        assignments = collections.OrderedDict()
+        for index, configuration in enumerate(self.configurations):
+            key = (configuration["single_pulse_channel"], configuration["double_pulse_channel"],
+                   configuration["veto_pulse_channel"])
+            assignments.setdefault(key, []).append(index)
+        self._assignments = [(key, np.array(indices)) for key, indices in assignments.items()]
+
+        # decays and the sum of their decay times in ns per configuration
+        self.event_count = 0
+        self.counts = np.zeros(len(self.configurations), dtype=np.int64)
+        self.sums = np.zeros(len(self.configurations))
+
+    def add_batch(self, batch):
+        """
+        Apply all configurations to a batch of events
+
+        :param batch: events
+        :type batch: muonic.lib.batch.EventBatch
+        :returns: None
+        """
+        self.event_count += len(batch)
+        upper = self.trigger.trigger_window - 1000
+        for (single, double, veto), indices in self._assignments:
+            _, single_widths, double_widths, decay_times = self.trigger.candidates(batch, single, double, veto)
+            if not len(decay_times):
+                continue
+            cuts = dict((name, values[indices]) for name, values in self.cuts.items())
+            # configurations x candidates
+            selected = ((cuts["min_single_pulse_width"] < single_widths) &
+                        (single_widths < cuts["max_single_pulse_width"]) &
+                        (cuts["min_double_pulse_width"] < double_widths) &
+                        (double_widths < cuts["max_double_pulse_width"]) &
+                        (decay_times > cuts["decay_min_time"]) &
+                        (decay_times < upper))
+            self.counts[indices] += np.count_nonzero(selected, axis=1)
+            self.sums[indices] += selected.astype(np.float64).dot(decay_times)
+
+    def results(self):
+        """
+        Number of decays and the estimated lifetime with its statistical
+        error in microseconds for each configuration. The lifetime is
+        fitted to the decay times within the window from decay_min_time to
+        the end of the trigger window.
+
+        :returns: list of dict
+        """
+        start = self.cuts["decay_min_time"][:, 0]
+        length = self.trigger.trigger_window - 1000 - start
+        with np.errstate(invalid="ignore", divide="ignore", over="ignore"):
+            mean = self.sums / self.counts - start
+            tau = lifetime(mean, length)
+            # Fisher information of the truncated exponential distribution
+            variance = tau ** 2 - length ** 2 / (4 * np.sinh(length / (2 * tau)) ** 2)
+            error = tau ** 2 / np.sqrt(self.counts * variance)
+
+        results = []
+        for index, configuration in enumerate(self.configurations):
+            result = dict(configuration)
+            result["decays"] = int(self.counts[index])
+            result["lifetime"] = float(tau[index]) / 1000
+            result["lifetime_error"] = float(error[index]) / 1000
+            results.append(result)
+        return results
+
+    def write_table(self, f):
+        """
+        Write the results as a whitespace separated table with a header
+
+        :param f: file object
+        :type f: file
+        :returns: None
+        """
+        columns = list(CUT_OPTIONS) + ["decays", "lifetime", "lifetime_error"]
+        f.write("# " + " ".join(columns) + "\n")
+        for result in self.results():
+            f.write(" ".join(("%.4f" % result[column]) if isinstance(result[column], float)
+                             else str(result[column]) for column in columns) + "\n")
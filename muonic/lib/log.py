@@ -0,0 +1,197 @@
+"""
+Non-blocking logging setup.
+
+All log records, including the ones of the DAQ reader processes, are put
+into a multiprocessing queue and written to the log file and the console
+by a listener thread of the main process. Log calls in the measurement
+loop therefore never wait for disk or terminal I/O. Records are rate
+limited per call site; suppressed records are summarized in one message
+per site and interval.
+"""
+import logging
+import logging.handlers
+import multiprocessing as mp
+import time
+
+
+__all__ = ["RateLimitedQueueHandler", "setup_logging", "shutdown_logging"]
+
+
+class RateLimitedQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler which limits the number of records per call site.
+
+    Each call site (file and line) may emit burst records per interval.
+    Further records of that site are counted and reported in a single
+    summary record when the interval has passed. Records of level ERROR
+    and above are never suppressed.
+
+    :param queue: queue to put the records in
+    :type queue: multiprocessing.Queue
+    :param burst: records per call site and interval, 0 disables the limit
+    :type burst: int
+    :param interval: interval in seconds
+    :type interval: float
+    """
+
+    def __init__(self, queue, burst=10, interval=10.0):
+        super().__init__(queue)
+        self.burst = burst
+        self.interval = interval
+        # call site -> [window start, records in window, suppressed, example record]
+        self._sites = {}
+        self._next_flush = time.time() + interval
+
+    def handle(self, record):
+        if self.burst and record.levelno < logging.ERROR:
+            now = record.created
+            site = (record.pathname, record.lineno)
+
+            with self.lock:
+                state = self._sites.get(site)
+
+                if state is None:
+                    state = [now, 0, 0, None]
+                    self._sites[site] = state
+                elif now - state[0] >= self.interval:
+                    self._summarize(site, state, now)
+
+                state[1] += 1
+                suppress = state[1] > self.burst
+                if suppress:
+                    state[2] += 1
+                    state[3] = record
+
+                if now >= self._next_flush:
+                    self.flush_summaries()
+
+            if suppress:
+                return False
+
+        return super().handle(record)
+
+    def _summarize(self, site, state, now):
+        """
+        Emit summary for suppressed records of a call site and start
+        a new interval
+
+        :returns: None
+        """
+        suppressed, record = state[2], state[3]
+        if suppressed:
+            summary = logging.makeLogRecord(record.__dict__)
+            summary.msg = "%d similar messages suppressed in the last %.0f s, last one: %s" % (
+                suppressed, now - state[0], record.getMessage())
+            summary.args = None
+            summary.created = now
+            super().handle(summary)
+        state[0] = now
+        state[1] = 0
+        state[2] = 0
+        state[3] = None
+
+    def flush_summaries(self, force=False):
+        """
+        Emit summaries of all call sites whose interval has passed
+
+        :param force: emit summaries regardless of the interval
+        :type force: bool
+        :returns: None
+        """
+        now = time.time()
+        self._next_flush = now + self.interval
+        for site, state in list(self._sites.items()):
+            if state[2] and (force or now - state[0] >= self.interval):
+                self._summarize(site, state, now)
+
+    def prepare(self, record):
+        """
+        Merge message and arguments, but leave the formatting to
+        the listener.
+
+        :param record: log record
+        :type record: logging.LogRecord
+        :returns: logging.LogRecord
+        """
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+_listener = None
+
+
+def setup_logging(log_file='muonic.log', level=logging.INFO, console_level=logging.INFO,
+                  burst=10, interval=10.0):
+    """
+    Set up the root logger to log through a queue to the log file and the
+    console. Processes forked afterwards log through the same queue.
+
+    :param log_file: path of the log file, None to disable file logging
+    :type log_file: str
+    :param level: level of the root logger and the log file
+    :type level: int
+    :param console_level: level of the console output
+    :type console_level: int
+    :param burst: records per call site and interval
+    :type burst: int
+    :param interval: rate limiting interval in seconds
+    :type interval: float
+    :returns: logging.Logger -- the root logger
+    """
+    global _listener
+
+    shutdown_logging()
+
+    logger = logging.getLogger()
+    logger.setLevel(min(level, console_level))
+
+    handlers = []
+
+    if log_file:
+        fh = logging.FileHandler(log_file)
+        fh.setLevel(level)
+        fh.setFormatter(logging.Formatter('%(asctime)s - %(name)s: %(levelname)s - %(message)s'))
+        handlers.append(fh)
+
+    ch = logging.StreamHandler()
+    ch.setLevel(console_level)
+    ch.setFormatter(logging.Formatter('%(name)s: %(levelname)s - %(message)s'))
+    handlers.append(ch)
+
+    log_queue = mp.Queue()
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(RateLimitedQueueHandler(log_queue, burst, interval))
+
+    return logger
+
+
+def shutdown_logging():
+    """
+    Flush pending summaries and stop the listener thread
+
+    :returns: None
+    """
+    global _listener
+
+    if _listener is None:
+        return
+
+    logger = logging.getLogger()
+    for handler in list(logger.handlers):
+        if isinstance(handler, RateLimitedQueueHandler):
+            handler.flush_summaries(force=True)
+            logger.removeHandler(handler)
+
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = None
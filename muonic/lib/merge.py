@@ -0,0 +1,176 @@
+"""
+Merges the time stamped data of several sources, e.g. DAQ cards, into
+one time ordered stream.
+"""
+import heapq
+import itertools
+import logging
+
+from .metrics import REGISTRY
+
+
+__all__ = ["TimeOrderedMerger"]
+
+
+class TimeOrderedMerger(object):
+    """
+    Orders items of several sources by their time stamps. Every source
+    has to deliver its items in time order.
+
+    An item is released once every source has reached its time stamp,
+    either with an item or with a heartbeat (see advance). A source which
+    stops delivering data does not block the others for longer than
+    max_delay seconds: items older than max_delay seconds before the
+    latest time stamp of all sources are released anyway. Items arriving
+    after later items were released are released right away and
+    counted as late.
+
+    :param sources: ids of the sources to wait for
+    :type sources: iterable
+    :param max_delay: maximum time difference between the sources in s
+    :type max_delay: float
+    :param max_items: maximum number of waiting items, the oldest items
+                      are released if there are more
+    :type max_items: int
+    :param name: name of the merger in the metrics
+    :type name: str
+    :param logger: logger object
+    :type logger: logging.Logger
+    """
+
+    def __init__(self, sources=(), max_delay=2.0, max_items=10000, name="merge", logger=None):
+        if logger is None:
+            logger = logging.getLogger(self.__module__ + '.' + self.__class__.__name__)
+        self.logger = logger
+        self.max_delay = max_delay
+        self.max_items = max_items
+
+        # latest time stamp of each source, None before its first item
+        self._latest = dict((source, None) for source in sources)
+        self._heap = []
+        self._sequence = itertools.count()
+        # time stamp of the last released item
+        self.released = None
+
+        REGISTRY.gauge("muonic_queue_depth", "Number of items waiting in a queue",
+                       function=lambda: len(self._heap), queue=name)
+        self._late_counter = REGISTRY.counter("muonic_merge_late_total",
+                                              "Items merged after later items were released",
+                                              merger=name)
+        self._overflow_counter = REGISTRY.counter("muonic_merge_overflow_total",
+                                                  "Items released early because too many items were waiting",
+                                                  merger=name)
+
+    def __len__(self):
+        return len(self._heap)
+
+    @property
+    def sources(self):
+        return list(self._latest)
+
+    def add_source(self, source):
+        """
+        Wait for the items of another source
+
+        :param source: id of the source
+        :type source: object
+        :returns: None
+        """
+        self._latest.setdefault(source, None)
+
+    def remove_source(self, source):
+        """
+        Stop waiting for the items of a source. Its waiting items are
+        still released.
+
+        :param source: id of the source
+        :type source: object
+        :returns: None
+        """
+        self._latest.pop(source, None)
+
+    def advance(self, source, timestamp):
+        """
+        Report that source has no items before timestamp, e.g. on a
+        heartbeat or a status message of the source
+
+        :param source: id of the source
+        :type source: object
+        :param timestamp: time stamp in s
+        :type timestamp: float
+        :returns: None
+        """
+        latest = self._latest.get(source)
+        if latest is None or timestamp > latest:
+            self._latest[source] = timestamp
+
+    def push(self, source, timestamp, item):
+        """
+        Add an item of source
+
+        :param source: id of the source
+        :type source: object
+        :param timestamp: time stamp of the item in s
+        :type timestamp: float
+        :param item: the item
+        :type item: object
+        :returns: None
+        """
+        if source not in self._latest:
+            self.add_source(source)
+        if self.released is not None and timestamp < self.released:
+            self._late_counter.value += 1
+            self.logger.debug("Late item of source %s, %.6f s behind" % (source, self.released - timestamp))
+        heapq.heappush(self._heap, (timestamp, next(self._sequence), source, item))
+        self.advance(source, timestamp)
+
+    def watermark(self):
+        """
+        Time stamp up to which the items are released
+
+        :returns: float or None
+        """
+        latest = [timestamp for timestamp in self._latest.values() if timestamp is not None]
+        if not latest:
+            return None
+        newest = max(latest) - self.max_delay
+        if len(latest) < len(self._latest):
+            # some sources did not deliver anything yet
+            return newest
+        return max(min(latest), newest)
+
+    def _pop(self):
+        timestamp, _, source, item = heapq.heappop(self._heap)
+        if self.released is None or timestamp > self.released:
+            self.released = timestamp
+        return source, item
+
+    def pop_ready(self):
+        """
+        Release the items which cannot be preceded by items of another
+        source any more
+
+        :returns: list of (source, item) tuples in time order
+        """
+        ready = []
+        while len(self._heap) > self.max_items:
+            self._overflow_counter.value += 1
+            ready.append(self._pop())
+
+        watermark = self.watermark()
+        if watermark is None:
+            return ready
+        while self._heap and self._heap[0][0] <= watermark:
+            ready.append(self._pop())
+        return ready
+
+    def flush(self):
+        """
+        Release all waiting items, e.g. at the end of a measurement
+
+        :returns: list of (source, item) tuples in time order
+        """
+        ready = []
+        while self._heap:
+            ready.append(self._pop())
+        return ready
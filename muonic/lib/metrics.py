@@ -0,0 +1,407 @@
+"""
+Lightweight metrics for the measurement pipeline.
+
+Counters, gauges and timers are plain python objects which are updated
+in the hot path with a single attribute update. Exporters render them in
+the Prometheus text format, either periodically to a file (to be picked
+up by the node exporter textfile collector) or on request via HTTP on a
+local TCP port or a Unix socket.
+"""
+import logging
+import os
+import threading
+import time
+
+from .scheduler import SCHEDULER
+
+
+__all__ = ["Counter", "Gauge", "Timer", "MetricsRegistry", "REGISTRY",
+           "PrometheusTextfileExporter", "MetricsServer"]
+
+
+class Counter(object):
+    """
+    Monotonically increasing counter
+    """
+
+    __slots__ = ["value"]
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, value=1):
+        self.value += value
+
+
+class Gauge(object):
+    """
+    Value that can go up and down. If a function is given, the value is
+    determined by calling it at export time.
+
+    :param function: callable returning the current value
+    :type function: callable
+    """
+
+    __slots__ = ["_value", "function"]
+
+    def __init__(self, function=None):
+        self._value = 0
+        self.function = function
+
+    def set(self, value):
+        self._value = value
+
+    @property
+    def value(self):
+        if self.function is not None:
+            return self.function()
+        return self._value
+
+
+class Timer(object):
+    """
+    Number of observations and accumulated time in seconds
+    """
+
+    __slots__ = ["count", "total"]
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+
+
+class MetricsRegistry(object):
+    """
+    Collection of named metrics with labels.
+
+    Metrics are created on first access and cached, so callers should keep
+    a reference to the metric object instead of looking it up for every
+    update.
+    """
+
+    TYPES = {Counter: "counter", Gauge: "gauge", Timer: "summary"}
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._help = {}
+        self._types = {}
+
+    def _get(self, metric_class, name, help_text, labels):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(key)
+                if metric is None:
+                    if self._types.setdefault(name, metric_class) is not metric_class:
+                        raise ValueError("metric %s already registered with another type" % name)
+                    self._help.setdefault(name, help_text)
+                    metric = metric_class()
+                    self._metrics[key] = metric
+        return metric
+
+    def counter(self, name, help_text='', **labels):
+        """
+        Get counter for name and labels
+
+        :param name: metric name
+        :type name: str
+        :param help_text: description of the metric
+        :type help_text: str
+        :returns: Counter
+        """
+        return self._get(Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text='', function=None, **labels):
+        """
+        Get gauge for name and labels
+
+        :param name: metric name
+        :type name: str
+        :param help_text: description of the metric
+        :type help_text: str
+        :param function: callable returning the current value
+        :type function: callable
+        :returns: Gauge
+        """
+        gauge = self._get(Gauge, name, help_text, labels)
+        if function is not None:
+            gauge.function = function
+        return gauge
+
+    def timer(self, name, help_text='', **labels):
+        """
+        Get timer for name and labels
+
+        :param name: metric name
+        :type name: str
+        :param help_text: description of the metric
+        :type help_text: str
+        :returns: Timer
+        """
+        return self._get(Timer, name, help_text, labels)
+
+    def remove(self, name, **labels):
+        """
+        Remove metric, e.g. a gauge whose object went away
+
+        :param name: metric name
+        :type name: str
+        :returns: None
+        """
+        with self._lock:
+            self._metrics.pop((name, tuple(sorted(labels.items()))), None)
+
+    def collect(self):
+        """
+        Snapshot of all metric values. Timers contribute a _count and
+        a _sum sample.
+
+        :returns: list of (name, type, help, labels, value) tuples
+        """
+        with self._lock:
+            items = sorted(self._metrics.items(), key=lambda item: item[0])
+
+        samples = []
+        for (name, labels), metric in items:
+            metric_type = self.TYPES[type(metric)]
+            help_text = self._help.get(name, '')
+            if isinstance(metric, Timer):
+                samples.append((name + "_count", metric_type, help_text, labels, metric.count))
+                samples.append((name + "_sum", metric_type, help_text, labels, metric.total))
+            else:
+                try:
+                    value = metric.value
+                except Exception:
+                    # a gauge function failed, e.g. a closed queue
+                    continue
+                samples.append((name, metric_type, help_text, labels, value))
+        return samples
+
+    def render(self, previous=None):
+        """
+        Render all metrics in the Prometheus text exposition format.
+
+        If a dict is passed as previous, it is used to keep the counter
+        values between calls and an additional '<name>_per_second' gauge is
+        rendered for each counter.
+
+        :param previous: state of the last call
+        :type previous: dict
+        :returns: str
+        """
+        now = time.monotonic()
+        lines = []
+        rates = []
+        seen = set()
+
+        for name, metric_type, help_text, labels, value in self.collect():
+            family = name
+            if metric_type == "summary":
+                family = name.rsplit("_", 1)[0]
+            if family not in seen:
+                seen.add(family)
+                if help_text:
+                    lines.append("# HELP %s %s" % (family, help_text))
+                lines.append("# TYPE %s %s" % (family, metric_type))
+
+            label_str = _format_labels(labels)
+            lines.append("%s%s %s" % (name, label_str, _format_value(value)))
+
+            if previous is not None and metric_type == "counter":
+                last_value, last_time = previous.get((name, labels), (value, None))
+                previous[(name, labels)] = (value, now)
+                if last_time is not None and now > last_time:
+                    rate_name = name[:-len("_total")] if name.endswith("_total") else name
+                    if rate_name + "_per_second" not in seen:
+                        seen.add(rate_name + "_per_second")
+                        rates.append("# TYPE %s_per_second gauge" % rate_name)
+                    rates.append("%s_per_second%s %s" %
+                                 (rate_name, label_str,
+                                  _format_value((value - last_value) / (now - last_time))))
+
+        lines.extend(rates)
+
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                             for k, v in labels)
+
+
+def _format_value(value):
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, int):
+        return "%d" % value
+    return repr(float(value))
+
+
+# registry used by the muonic pipeline
+REGISTRY = MetricsRegistry()
+
+
+class PrometheusTextfileExporter(object):
+    """
+    Periodically rewrites a file with the current metrics. The file is
+    replaced atomically, so readers never see a partially written file.
+
+    :param path: path of the metrics file
+    :type path: str
+    :param interval: update interval in seconds
+    :type interval: float
+    :param registry: metrics registry
+    :type registry: MetricsRegistry
+    :param scheduler: scheduler running the periodic updates
+    :type scheduler: muonic.lib.scheduler.Scheduler
+    :param logger: logger object
+    :type logger: logging.Logger
+    """
+
+    def __init__(self, path, interval=10.0, registry=None, scheduler=None, logger=None):
+        if logger is None:
+            logger = logging.getLogger(self.__module__ + '.' + self.__class__.__name__)
+        self.logger = logger
+        self.path = path
+        self.interval = interval
+        self.registry = registry or REGISTRY
+        self.scheduler = scheduler or SCHEDULER
+        self._previous = {}
+        self._lock = threading.Lock()
+        self._call = None
+
+    def write(self):
+        """
+        Write the current metrics to the file
+
+        :returns: None
+        """
+        tmp_path = self.path + ".tmp"
+        # the final write in stop may overlap with a scheduled one
+        with self._lock:
+            try:
+                with open(tmp_path, "w") as f:
+                    f.write(self.registry.render(self._previous))
+                os.replace(tmp_path, self.path)
+            except (IOError, OSError) as e:
+                self.logger.warning("Could not write metrics file %s: %s" % (self.path, e))
+
+    def start(self):
+        if self._call is not None:
+            return
+        self._call = self.scheduler.call_every(self.interval, self.write)
+
+    def stop(self):
+        if self._call is None:
+            return
+        self._call.cancel()
+        self._call = None
+        # final state
+        self.write()
+
+
+def _http_server(address):
+    """
+    Create HTTP server serving the metrics. The http modules are only
+    imported here, as most measurements do not serve metrics.
+
+    :param address: TCP port or Unix socket path
+    :type address: int or str
+    :returns: socketserver.BaseServer
+    """
+    import socketserver
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+    class MetricsRequestHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = self.server.registry.render(self.server.previous).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    class UnixHTTPServer(socketserver.UnixStreamServer):
+
+        def get_request(self):
+            request, _ = super().get_request()
+            # BaseHTTPRequestHandler expects a (host, port) client address
+            return request, ("local", 0)
+
+    if isinstance(address, int):
+        return HTTPServer(("127.0.0.1", address), MetricsRequestHandler)
+
+    if os.path.exists(address):
+        os.unlink(address)
+    server = UnixHTTPServer(address, MetricsRequestHandler)
+    # only the user running muonic may read the metrics
+    os.chmod(address, 0o600)
+    return server
+
+
+class MetricsServer(object):
+    """
+    Serves the current metrics via HTTP. The address is either a port
+    number on localhost or the path of a Unix socket.
+
+    :param address: TCP port or Unix socket path
+    :type address: int or str
+    :param registry: metrics registry
+    :type registry: MetricsRegistry
+    :param logger: logger object
+    :type logger: logging.Logger
+    """
+
+    def __init__(self, address, registry=None, logger=None):
+        if logger is None:
+            logger = logging.getLogger(self.__module__ + '.' + self.__class__.__name__)
+        self.logger = logger
+        self.address = address
+        self.registry = registry or REGISTRY
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        if self._server is not None:
+            return
+
+        address = self.address
+        if isinstance(address, str) and address.isdigit():
+            address = int(address)
+
+        self._server = _http_server(address)
+        self._server.registry = self.registry
+        self._server.previous = {}
+
+        self._thread = threading.Thread(target=self._server.serve_forever, name="tMETRICSHTTP")
+        self._thread.daemon = True
+        self._thread.start()
+        self.logger.info("Serving metrics on %s" % self.address)
+
+    def stop(self):
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        if not isinstance(self._server.server_address, tuple):
+            try:
+                os.unlink(self._server.server_address)
+            except OSError:
+                pass
+        self._server = None
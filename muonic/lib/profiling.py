@@ -0,0 +1,295 @@
+"""
+Profiling of measurement runs.
+
+Runs the measurement under cProfile or a sampling profiler and traces
+memory allocations with tracemalloc. When the measurement is closed, a
+summary with the CPU time spent in each analyzer and consumer and the top
+allocation sites is written next to the measurement data, together with
+pstats and callgrind files (cProfile) or collapsed stacks (sampling) that
+can be inspected with the usual tools.
+"""
+import collections
+import cProfile
+import datetime
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+
+__all__ = ["Profiler"]
+
+
+class _CPUTimer(object):
+    """
+    Wraps a callable and accumulates the CPU time of the calling thread
+    spent in it.
+
+    :param func: callable to wrap
+    :type func: callable
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self.calls = 0
+        self.cpu_time = 0.0
+
+    def __call__(self, *args, **kwargs):
+        t0 = time.thread_time()
+        try:
+            return self.func(*args, **kwargs)
+        finally:
+            self.cpu_time += time.thread_time() - t0
+            self.calls += 1
+
+
+class _SamplingProfiler(object):
+    """
+    Periodically samples the stacks of all threads and counts them in
+    collapsed form, ready to be turned into a flame graph.
+
+    :param interval: sampling interval in seconds
+    :type interval: float
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def enable(self):
+        self._thread = threading.Thread(target=self._run, name="tPROFILER")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def disable(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        names = {}
+        while not self._stop_event.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append("%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename),
+                                                 code.co_firstlineno))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def write(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write("%s %d\n" % (stack, count))
+
+
+def _write_callgrind(stats, path):
+    """
+    Convert cProfile statistics into the callgrind format understood
+    by KCachegrind/QCachegrind.
+
+    :param stats: profile statistics
+    :type stats: pstats.Stats
+    :param path: output path
+    :type path: str
+    :returns: None
+    """
+    # invert the caller relations of pstats
+    callees = collections.defaultdict(list)
+    for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+        for caller, caller_stats in callers.items():
+            callees[caller].append((func, caller_stats))
+
+    def name(func):
+        filename, line, funcname = func
+        return filename, line, "%s:%d(%s)" % (os.path.basename(filename), line, funcname)
+
+    with open(path, "w") as f:
+        f.write("version: 1\ncreator: muonic\nevents: Microseconds\n\n")
+        for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+            filename, line, funcname = name(func)
+            f.write("fl=%s\nfn=%s\n%d %d\n" % (filename, funcname, line, int(tt * 1e6)))
+            for callee, (c_cc, c_nc, c_tt, c_ct) in callees.get(func, []):
+                c_filename, c_line, c_funcname = name(callee)
+                f.write("cfl=%s\ncfn=%s\ncalls=%d %d\n%d %d\n" %
+                        (c_filename, c_funcname, c_nc, c_line, line, int(c_ct * 1e6)))
+            f.write("\n")
+
+
+class Profiler(object):
+    """
+    Profiles a measurement run of an App.
+
+    :param mode: 'cprofile' for deterministic profiling of the main
+                 thread or 'sampling' to sample the stacks of all threads
+    :type mode: str
+    :param output_dir: directory to write the results to
+    :type output_dir: str
+    :param trace_frames: number of frames stored per allocation by
+                         tracemalloc, 0 disables memory tracing
+    :type trace_frames: int
+    :param logger: logger object
+    :type logger: logging.Logger
+    """
+
+    MODES = ["cprofile", "sampling"]
+
+    def __init__(self, mode="cprofile", output_dir=None, trace_frames=10, logger=None):
+        if logger is None:
+            logger = logging.getLogger(self.__module__ + '.' + self.__class__.__name__)
+        self.logger = logger
+
+        if mode not in self.MODES:
+            raise ValueError("unknown profiling mode '%s', choose one of %s" % (mode, self.MODES))
+
+        self.mode = mode
+        self.output_dir = output_dir or os.getcwd()
+        self.trace_frames = trace_frames
+        self.running = False
+
+        self._profiler = None
+        self._timers = collections.OrderedDict()
+        self._wrapped = []
+        self._start_time = None
+
+    def _wrap(self, obj, attribute, label):
+        timer = _CPUTimer(getattr(obj, attribute))
+        setattr(obj, attribute, timer)
+        self._wrapped.append((obj, attribute))
+        self._timers.setdefault(label, []).append(timer)
+
+    def instrument(self, analyzers):
+        """
+        Measure the CPU time spent in the analyzers and in the
+        consumers they publish to.
+
+        :param analyzers: analyzer chain of the App
+        :type analyzers: list
+        :returns: None
+        """
+        seen = set()
+        for analyzer in analyzers:
+            if hasattr(analyzer, "extract"):
+                self._wrap(analyzer, "extract", "analyzer %s" % analyzer.__class__.__name__)
+            elif hasattr(analyzer, "calculate"):
+                self._wrap(analyzer, "calculate", "analyzer %s" % analyzer.__class__.__name__)
+
+            for consumer in getattr(analyzer, "consumers", []):
+                # look into buffered consumers, they only pass the data on
+                for inner in getattr(consumer, "consumers", [consumer]):
+                    if id(inner) not in seen:
+                        seen.add(id(inner))
+                        self._wrap(inner, "push", "consumer %s" % inner.__class__.__name__)
+
+    def start(self, analyzers=()):
+        """
+        Start profiling
+
+        :param analyzers: analyzer chain of the App
+        :type analyzers: list
+        :returns: None
+        """
+        if self.running:
+            return
+
+        self.instrument(analyzers)
+
+        if self.trace_frames and not tracemalloc.is_tracing():
+            tracemalloc.start(self.trace_frames)
+
+        if self.mode == "cprofile":
+            self._profiler = cProfile.Profile()
+        else:
+            self._profiler = _SamplingProfiler()
+
+        self._start_time = time.monotonic()
+        self._profiler.enable()
+        self.running = True
+        self.logger.info("Profiling measurement with %s" % self.mode)
+
+    def stop(self):
+        """
+        Stop profiling and write the results
+
+        :returns: list of written files
+        """
+        if not self.running:
+            return []
+
+        self._profiler.disable()
+        self.running = False
+        duration = time.monotonic() - self._start_time
+
+        snapshot = None
+        if tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+
+        # restore the original methods
+        for obj, attribute in self._wrapped:
+            try:
+                delattr(obj, attribute)
+            except AttributeError:
+                pass
+        self._wrapped = []
+
+        if not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+
+        prefix = os.path.join(self.output_dir, "profile_%s" %
+                              datetime.datetime.utcnow().strftime('%Y-%m-%d_%H-%M-%S'))
+        files = []
+
+        if self.mode == "cprofile":
+            self._profiler.dump_stats(prefix + ".pstats")
+            _write_callgrind(pstats.Stats(self._profiler), prefix + ".callgrind")
+            files += [prefix + ".pstats", prefix + ".callgrind"]
+        else:
+            self._profiler.write(prefix + ".collapsed")
+            files.append(prefix + ".collapsed")
+
+        with open(prefix + ".txt", "w") as f:
+            self._write_summary(f, duration, snapshot)
+        files.append(prefix + ".txt")
+
+        self.logger.info("Wrote profiling results to %s" % ", ".join(files))
+        return files
+
+    def _write_summary(self, f, duration, snapshot):
+        f.write("Profiling mode: %s\n" % self.mode)
+        f.write("Wall time: %.3f s\n\n" % duration)
+
+        f.write("CPU time per analyzer and consumer\n")
+        f.write("%-45s %12s %12s %14s\n" % ("", "calls", "CPU time/s", "per call/us"))
+        for label, timers in self._timers.items():
+            calls = sum(timer.calls for timer in timers)
+            cpu_time = sum(timer.cpu_time for timer in timers)
+            f.write("%-45s %12d %12.4f %14.2f\n" %
+                    (label, calls, cpu_time, cpu_time / calls * 1e6 if calls else 0.0))
+        f.write("\nAnalyzers running in worker processes are not covered.\n")
+
+        if self.mode == "cprofile":
+            f.write("\nTop functions by internal time\n")
+            stats = pstats.Stats(self._profiler, stream=f)
+            stats.sort_stats("tottime").print_stats(20)
+        else:
+            f.write("\n%d stack samples taken\n" % self._profiler.samples)
+
+        if snapshot is not None:
+            f.write("\nTop allocation sites\n")
+            for stat in snapshot.statistics("lineno")[:20]:
+                f.write("%s\n" % stat)
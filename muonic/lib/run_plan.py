@@ -0,0 +1,201 @@
+"""
+Back-to-back measurements from a run plan.
+
+A run plan is a JSON file describing a sequence of runs, which are
+executed one after another with the same DAQ connection, reader and
+worker processes. Each run has its own run id, duration, card settings
+and, optionally, its own selection of analyzers:
+
+    {
+        "defaults": {"duration": 3600, "settings": {"gate_width": 100}},
+        "runs": [
+            {"name": "threshold-250", "settings": {"threshold_ch0": 250}},
+            {"name": "threshold-300", "settings": {"threshold_ch0": 300},
+             "analyzers": ["rate"]}
+        ]
+    }
+
+The settings of a run are applied on top of the settings of the previous
+runs. Settings given in "defaults" are applied before the first run.
+"""
+import json
+import logging
+
+from .card_config import CARD_SETTINGS
+
+
+__all__ = ["PlannedRun", "load_run_plan", "RunPlanExecutor"]
+
+
+class PlannedRun(object):
+    """
+    A single run of a run plan
+
+    :param name: name of the run
+    :type name: str
+    :param duration: duration of the run in seconds
+    :type duration: float
+    :param settings: card settings to apply before the run
+    :type settings: dict
+    :param analyzers: names of the analyzers to run, None for all
+    :type analyzers: list of str or None
+    """
+
+    def __init__(self, name, duration, settings=None, analyzers=None):
+        self.name = name
+        self.duration = duration
+        self.settings = settings or {}
+        self.analyzers = analyzers
+
+    def __repr__(self):
+        return "PlannedRun(%r, %r, %r, %r)" % (self.name, self.duration, self.settings, self.analyzers)
+
+
+def _parse_run(entry, defaults, label, analyzer_names):
+    if not isinstance(entry, dict):
+        raise ValueError("%s: expected an object" % label)
+
+    unknown = sorted(set(entry) - {"name", "duration", "settings", "analyzers"})
+    if unknown:
+        raise ValueError("%s: unknown keys %s" % (label, ", ".join(unknown)))
+
+    duration = entry.get("duration", defaults.get("duration"))
+    if not isinstance(duration, (int, float)) or isinstance(duration, bool) or duration <= 0:
+        raise ValueError("%s: duration must be a positive number of seconds" % label)
+
+    settings = entry.get("settings", {})
+    if not isinstance(settings, dict):
+        raise ValueError("%s: settings must be an object" % label)
+    unknown = sorted(key for key in settings if key not in CARD_SETTINGS)
+    if unknown:
+        raise ValueError("%s: unknown settings %s" % (label, ", ".join(unknown)))
+
+    analyzers = entry.get("analyzers", defaults.get("analyzers"))
+    if analyzers is not None:
+        if not isinstance(analyzers, list):
+            raise ValueError("%s: analyzers must be a list" % label)
+        unknown = sorted(name for name in analyzers if name not in analyzer_names)
+        if unknown:
+            raise ValueError("%s: unknown analyzers %s" % (label, ", ".join(map(str, unknown))))
+
+    return PlannedRun(str(entry.get("name", label)), float(duration), dict(settings), analyzers)
+
+
+def load_run_plan(path, analyzer_names=(), default_duration=None):
+    """
+    Read and validate a run plan.
+
+    Raises ValueError if the plan is invalid.
+
+    :param path: path of the JSON run plan
+    :type path: str
+    :param analyzer_names: names allowed in the analyzer selection of a run
+    :type analyzer_names: iterable of str
+    :param default_duration: duration of runs without a duration, if the
+                             plan has no default duration either
+    :type default_duration: float
+    :returns: tuple of default settings (dict) and list of PlannedRun
+    :raises: ValueError
+    """
+    with open(path) as f:
+        try:
+            plan = json.load(f)
+        except ValueError as e:
+            raise ValueError("%s is not valid JSON: %s" % (path, e))
+
+    if isinstance(plan, list):
+        plan = {"runs": plan}
+    if not isinstance(plan, dict) or not isinstance(plan.get("runs"), list) or not plan["runs"]:
+        raise ValueError("%s: the run plan needs a non-empty list of runs" % path)
+
+    defaults = plan.get("defaults", {})
+    if not isinstance(defaults, dict):
+        raise ValueError("%s: defaults must be an object" % path)
+    if default_duration and "duration" not in defaults:
+        defaults = dict(defaults, duration=default_duration)
+    default_settings = defaults.get("settings", {})
+    if not isinstance(default_settings, dict):
+        raise ValueError("%s: default settings must be an object" % path)
+    unknown = sorted(key for key in default_settings if key not in CARD_SETTINGS)
+    if unknown:
+        raise ValueError("%s: unknown default settings %s" % (path, ", ".join(unknown)))
+
+    analyzer_names = set(analyzer_names)
+    runs = [_parse_run(entry, defaults, "run %d" % (i + 1), analyzer_names)
+            for i, entry in enumerate(plan["runs"])]
+    return dict(default_settings), runs
+
+
+class RunPlanExecutor(object):
+    """
+    Executes the runs of a run plan with a single App, i.e. without
+    reconnecting to the DAQ card between the runs.
+
+    :param app: the App to run the measurements with
+    :type app: muonic.lib.app.App
+    :param runs: runs to execute
+    :type runs: list of PlannedRun
+    :param default_settings: settings to apply before the first run
+    :type default_settings: dict
+    :param analyzers: analyzers which can be selected per run, by name
+    :type analyzers: dict
+    :param logger: logger object
+    :type logger: logging.Logger
+    """
+
+    def __init__(self, app, runs, default_settings=None, analyzers=None, logger=None):
+        if logger is None:
+            logger = logging.getLogger(self.__module__ + '.' + self.__class__.__name__)
+        self.logger = logger
+        self.app = app
+        self.runs = runs
+        self.default_settings = default_settings or {}
+        self.analyzers = analyzers or {}
+        # (name, run id) of the finished runs
+        self.completed = []
+
+    def select_analyzers(self, names):
+        """
+        Enable the analyzers with the given names and disable the others.
+
+        :param names: names of the analyzers to enable, None for all
+        :type names: list of str or None
+        :returns: None
+        """
+        for name, analyzer in self.analyzers.items():
+            analyzer.disabled = names is not None and name not in names
+
+    def run(self):
+        """
+        Execute all runs and close the App afterwards. Stops early if the
+        App was closed, e.g. by a signal, or the DAQ provider has no more
+        data.
+
+        :returns: list of (name, run id) tuples of the executed runs
+        """
+        if self.default_settings:
+            self.app.apply_settings(self.default_settings)
+
+        try:
+            for i, run in enumerate(self.runs):
+                if self.app.closed or self.app.daq.finished:
+                    self.logger.warning("Run plan aborted before run %d of %d" % (i + 1, len(self.runs)))
+                    break
+
+                # pass the data received between the runs through the
+                # inactive analyzers
+                self.app.process_incoming()
+
+                self.logger.info("Starting run %d of %d: %s (%.0f s)" %
+                                 (i + 1, len(self.runs), run.name, run.duration))
+                if run.settings:
+                    self.app.apply_settings(run.settings)
+                self.select_analyzers(run.analyzers)
+
+                run_id = self.app.run(duration=run.duration, close=False)
+                self.completed.append((run.name, run_id))
+                self.logger.info("Finished run %s with run-id %s" % (run.name, run_id))
+        finally:
+            self.app.close()
+
+        return self.completed
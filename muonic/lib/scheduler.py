@@ -0,0 +1,192 @@
+"""
+Timer service for periodic and delayed jobs.
+
+All periodic work of a measurement, like querying the scalars, writing
+metrics or flushing log summaries, runs in a single scheduler thread
+instead of one sleeping thread per job. Scheduled calls can be cancelled
+at any time and never run after cancel returned, unless the scheduler
+already took them to run.
+"""
+import heapq
+import logging
+import os
+import threading
+import time
+
+
+__all__ = ["ScheduledCall", "Scheduler", "SCHEDULER"]
+
+
+class ScheduledCall(object):
+    """
+    Handle of a scheduled call
+
+    :param when: monotonic time of the next call
+    :type when: float
+    :param interval: interval of periodic calls, None for a single call
+    :type interval: float
+    :param callback: callable to call
+    :type callback: callable
+    :param args: arguments of the call
+    :type args: tuple
+    :param lock: lock of the scheduler taking the calls to run
+    :type lock: threading.Condition
+    """
+
+    __slots__ = ["when", "interval", "callback", "args", "cancelled", "_lock"]
+
+    def __init__(self, when, interval, callback, args, lock):
+        self.when = when
+        self.interval = interval
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+        self._lock = lock
+
+    def __lt__(self, other):
+        return self.when < other.when
+
+    def cancel(self):
+        """
+        Cancel the call. The scheduler takes calls to run under the same
+        lock, so after cancel returned the call either was already taken
+        to run or never runs. Periodic calls are not scheduled again.
+
+        :returns: None
+        """
+        with self._lock:
+            self.cancelled = True
+
+
+class Scheduler(object):
+    """
+    Runs callbacks at given times in a single thread. The thread is
+    started with the first scheduled call.
+
+    Callbacks should return quickly, as they delay all other calls.
+
+    :param logger: logger object
+    :type logger: logging.Logger
+    """
+
+    def __init__(self, logger=None):
+        if logger is None:
+            logger = logging.getLogger(self.__module__ + '.' + self.__class__.__name__)
+        self.logger = logger
+        self._reset()
+
+    def _reset(self):
+        self._condition = threading.Condition()
+        self._queue = []
+        self._thread = None
+        self._stopping = False
+
+    def _schedule(self, delay, interval, callback, args):
+        call = ScheduledCall(time.monotonic() + delay, interval, callback, args, self._condition)
+        with self._condition:
+            heapq.heappush(self._queue, call)
+            self._condition.notify()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="tSCHEDULER")
+                self._thread.daemon = True
+                self._thread.start()
+        return call
+
+    def call_later(self, delay, callback, *args):
+        """
+        Call callback once after delay seconds
+
+        :param delay: delay in seconds
+        :type delay: float
+        :param callback: callable to call
+        :type callback: callable
+        :returns: ScheduledCall
+        """
+        return self._schedule(delay, None, callback, args)
+
+    def call_every(self, interval, callback, *args, first_delay=None):
+        """
+        Call callback every interval seconds. The first call happens after
+        first_delay seconds, by default after one interval.
+
+        :param interval: interval in seconds
+        :type interval: float
+        :param callback: callable to call
+        :type callback: callable
+        :param first_delay: delay of the first call in seconds
+        :type first_delay: float
+        :returns: ScheduledCall
+        """
+        if interval <= 0:
+            raise ValueError("interval must be positive")
+        if first_delay is None:
+            first_delay = interval
+        return self._schedule(first_delay, interval, callback, args)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if self._stopping:
+                        # the state is only cleared by the thread itself,
+                        # a new thread can start once this one is gone
+                        if self._thread is threading.current_thread():
+                            self._thread = None
+                            self._stopping = False
+                        return
+                    if not self._queue:
+                        self._condition.wait()
+                        continue
+                    call = self._queue[0]
+                    if call.cancelled:
+                        heapq.heappop(self._queue)
+                        continue
+                    wait_time = call.when - time.monotonic()
+                    if wait_time <= 0:
+                        # the call counts as running from here on, cancel
+                        # waits for the lock and cannot come in between
+                        heapq.heappop(self._queue)
+                        break
+                    self._condition.wait(wait_time)
+
+            try:
+                call.callback(*call.args)
+            except Exception:
+                self.logger.exception("Scheduled call of %r failed" % call.callback)
+
+            if call.interval is not None:
+                with self._condition:
+                    if call.cancelled:
+                        continue
+                    # keep the pace, but do not try to catch up missed calls
+                    call.when = max(call.when + call.interval, time.monotonic())
+                    heapq.heappush(self._queue, call)
+
+    def stop(self):
+        """
+        Stop the scheduler thread. Pending calls stay scheduled and run
+        when the scheduler is used the next time.
+
+        Called from a scheduled call, the thread stops after the call
+        returned, as it cannot wait for itself.
+
+        :returns: None
+        """
+        with self._condition:
+            thread = self._thread
+            if thread is None:
+                return
+            self._stopping = True
+            self._condition.notify()
+
+        if thread is not threading.current_thread():
+            thread.join()
+
+
+# scheduler shared by the muonic pipeline
+SCHEDULER = Scheduler()
+
+if hasattr(os, "register_at_fork"):
+    # child processes, like the analyzer workers, start with an empty
+    # scheduler of their own
+    os.register_at_fork(after_in_child=SCHEDULER._reset)
@@ -0,0 +1,277 @@
+"""
+Per event latency tracing.
+
+The reader processes stamp every line with the monotonic host time at
+which it was received. Along the way through the pipeline the latency
+since that moment is recorded at each stage into HDR style histograms.
+A configurable fraction of the traces is kept completely, so single
+events can be inspected stage by stage.
+"""
+import collections
+import json
+import logging
+import threading
+import time
+
+from .metrics import REGISTRY
+
+
+__all__ = ["LatencyHistogram", "Trace", "Tracer", "current_trace", "set_current_trace"]
+
+
+class LatencyHistogram(object):
+    """
+    Log-linear histogram of latencies, similar to a HdrHistogram.
+
+    Values are recorded in nanoseconds. Each power of two is split into
+    2 ** (significant_bits - 1) linear sub buckets, so the relative error of
+    each recorded value is below 2 ** (1 - significant_bits).
+
+    :param significant_bits: resolution of the sub buckets
+    :type significant_bits: int
+    :param max_value: largest value to be recorded in ns, larger values
+                      are clamped
+    :type max_value: int
+    """
+
+    def __init__(self, significant_bits=7, max_value=1 << 40):
+        self.significant_bits = significant_bits
+        self.sub_bucket_count = 1 << significant_bits
+        self.half_count = self.sub_bucket_count >> 1
+        self.max_value = max_value
+        self.counts = [0] * (self._index(max_value) + 1)
+        self.total_count = 0
+        self.max_recorded = 0
+
+    def _index(self, value):
+        if value < self.sub_bucket_count:
+            return value
+        shift = value.bit_length() - self.significant_bits
+        return self.sub_bucket_count + (shift - 1) * self.half_count + (value >> shift) - self.half_count
+
+    def _value(self, index):
+        """
+        Highest value which is counted in bucket index
+
+        :param index: bucket index
+        :type index: int
+        :returns: int
+        """
+        if index < self.sub_bucket_count:
+            return index
+        shift = (index - self.sub_bucket_count) // self.half_count + 1
+        mantissa = (index - self.sub_bucket_count) % self.half_count + self.half_count
+        return ((mantissa + 1) << shift) - 1
+
+    def record(self, seconds):
+        """
+        Record latency
+
+        :param seconds: latency in seconds
+        :type seconds: float
+        :returns: None
+        """
+        value = int(seconds * 1e9)
+        if value < 0:
+            value = 0
+        elif value > self.max_value:
+            value = self.max_value
+        self.counts[self._index(value)] += 1
+        self.total_count += 1
+        if value > self.max_recorded:
+            self.max_recorded = value
+
+    def percentile(self, percentile):
+        """
+        Latency below which the given percentage of values falls
+
+        :param percentile: percentile between 0 and 100
+        :type percentile: float
+        :returns: float -- latency in seconds
+        """
+        if not self.total_count:
+            return 0.0
+        threshold = max(1, int(percentile / 100.0 * self.total_count + 0.5))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= threshold:
+                return min(self._value(index), self.max_recorded) / 1e9
+        return self.max_recorded / 1e9
+
+    def summary(self, percentiles=(50, 90, 99, 99.9)):
+        """
+        Summary of the recorded values
+
+        :param percentiles: percentiles to report
+        :type percentiles: tuple
+        :returns: dict
+        """
+        result = {"count": self.total_count, "max": self.max_recorded / 1e9}
+        for percentile in percentiles:
+            result["p%s" % percentile] = self.percentile(percentile)
+        return result
+
+
+class Trace(object):
+    """
+    Latency trace of a single line
+
+    :param tracer: tracer collecting the latencies
+    :type tracer: Tracer
+    :param received: monotonic time the line was received
+    :type received: float
+    :param sampled: keep all stages of this trace
+    :type sampled: bool
+    """
+
+    __slots__ = ["tracer", "received", "stages"]
+
+    def __init__(self, tracer, received, sampled=False):
+        self.tracer = tracer
+        self.received = received
+        self.stages = [] if sampled else None
+
+    def stamp(self, stage):
+        """
+        Record the latency since the line was received for stage
+
+        :param stage: name of the pipeline stage
+        :type stage: str
+        :returns: None
+        """
+        latency = time.monotonic() - self.received
+        self.tracer.record(stage, latency)
+        if self.stages is not None:
+            self.stages.append((stage, latency))
+
+
+_local = threading.local()
+
+
+def current_trace():
+    """
+    Trace of the line currently processed by this thread
+
+    :returns: Trace or None
+    """
+    return getattr(_local, "trace", None)
+
+
+def set_current_trace(trace):
+    """
+    Set trace of the line currently processed by this thread
+
+    :param trace: trace
+    :type trace: Trace or None
+    :returns: None
+    """
+    _local.trace = trace
+
+
+class Tracer(object):
+    """
+    Collects latency histograms per pipeline stage and keeps every n-th
+    trace completely.
+
+    :param sample_every: keep every n-th trace, 0 disables sampling
+    :type sample_every: int
+    :param max_traces: number of sampled traces to keep
+    :type max_traces: int
+    :param registry: metrics registry to export percentiles to
+    :type registry: muonic.lib.metrics.MetricsRegistry
+    :param logger: logger object
+    :type logger: logging.Logger
+    """
+
+    EXPORTED_PERCENTILES = (50, 99, 99.9)
+
+    def __init__(self, sample_every=1000, max_traces=1000, registry=None, logger=None):
+        if logger is None:
+            logger = logging.getLogger(self.__module__ + '.' + self.__class__.__name__)
+        self.logger = logger
+        self.sample_every = sample_every
+        self.registry = registry or REGISTRY
+        self.histograms = collections.OrderedDict()
+        self.traces = collections.deque(maxlen=max_traces)
+        self._lock = threading.Lock()
+        self._counter = 0
+
+    def add_stage(self, stage):
+        """
+        Create histogram for stage and export its percentiles
+
+        :param stage: name of the pipeline stage
+        :type stage: str
+        :returns: LatencyHistogram
+        """
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = LatencyHistogram()
+                self.histograms[stage] = histogram
+                for percentile in self.EXPORTED_PERCENTILES:
+                    self.registry.gauge("muonic_latency_seconds",
+                                        "Latency since the line was received by the reader",
+                                        function=lambda p=percentile: histogram.percentile(p),
+                                        stage=stage, quantile="%g" % (percentile / 100.0))
+        return histogram
+
+    def record(self, stage, latency):
+        """
+        Record latency of a stage which is not stamped on a trace, like
+        the stages inside of the analyzer processes
+
+        :param stage: name of the pipeline stage
+        :type stage: str
+        :param latency: latency since the line was received in seconds
+        :type latency: float
+        :returns: None
+        """
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.add_stage(stage)
+        histogram.record(latency)
+
+    def begin(self, received, raw=None):
+        """
+        Start trace for a line
+
+        :param received: monotonic time the line was received, or None if
+                         unknown
+        :type received: float
+        :param raw: the raw line, stored with sampled traces
+        :type raw: str
+        :returns: Trace
+        """
+        if received is None:
+            received = time.monotonic()
+        self._counter += 1
+        sampled = self.sample_every and not self._counter % self.sample_every
+        trace = Trace(self, received, sampled)
+        if sampled:
+            self.traces.append((raw, trace))
+        return trace
+
+    def summary(self):
+        """
+        Latency summary for each stage
+
+        :returns: dict
+        """
+        return collections.OrderedDict((stage, histogram.summary())
+                                       for stage, histogram in list(self.histograms.items()))
+
+    def dump(self, path):
+        """
+        Write latency summary and sampled traces as JSON lines to path
+
+        :param path: output path
+        :type path: str
+        :returns: None
+        """
+        with open(path, "w") as f:
+            f.write(json.dumps({"summary": self.summary()}) + "\n")
+            for raw, trace in list(self.traces):
+                f.write(json.dumps({"raw": raw, "stages": trace.stages}) + "\n")
+        self.logger.info("Wrote %d latency traces to %s" % (len(self.traces), path))
@@ -5,10 +5,12 @@ edges of the pulses.
 """
 from __future__ import print_function
 import datetime
+import functools
 import logging
 
 
-__all__ = ["PulseExtractor", "DecayTriggerThorough", "VelocityTrigger"]
+__all__ = ["gps_time_to_seconds", "PulseEvent", "PulseEventPool", "PulseExtractor", "iter_events",
+           "iter_events_from_files", "DecayTriggerThorough", "VelocityTrigger"]
 
 # for the pulses 
 # 8 bits give a hex number
@@ -34,6 +36,172 @@ TMC_TICK = 1.25  # nsec
 MAX_TRIGGER_WINDOW = 9960.0  # nsec for mudecay!
 DEFAULT_FREQUENCY = 25.0e6
 
+# day of the data time if the DAQ card has no GPS date
+NO_GPS_DATE = datetime.datetime(1970, 1, 1)
+
+SECONDS_PER_DAY = 86400
+
+
+@functools.lru_cache(maxsize=1024)
+def gps_time_to_seconds(time, correction):
+    """
+    Convert the GPS time of a DAQ line into seconds since day start.
+    The time only changes once per second, so the results are cached.
+
+    :param time: GPS time as hhmmss.sss
+    :type time: str
+    :param correction: correction of the GPS time in ms, e.g. '+0042'
+    :type correction: str
+    :returns: float
+    """
+    time_fields = time.split(".")
+    t = time_fields[0]
+
+    secs_since_day_start = (int(t[0:2]) * 3600 +
+                            int(t[2:4]) * 60 + int(t[4:6]))
+
+    # FIXME: Why time_fields[1] / 1000?
+    return float(secs_since_day_start + int(time_fields[1]) / 1000.0 +
+                 int(correction) / 1000.0)
+
+
+class _EdgeTable(dict):
+    """
+    Maps the hex fields of the edges in DAQ lines to the TMC time of the
+    edge in ns, or to None if the valid bit is not set. Holds all 256
+    values in upper and lower case, other spellings are decoded and
+    added on first use.
+    """
+
+    def __missing__(self, field):
+        value = int(field, 16)
+        edge = (value & BIT0_4) * TMC_TICK if value & BIT5 else None
+        self[field] = edge
+        return edge
+
+
+EDGE_TABLE = _EdgeTable()
+for _byte in range(256):
+    EDGE_TABLE["%02X" % _byte] = EDGE_TABLE["%02x" % _byte] = (
+            (_byte & BIT0_4) * TMC_TICK if _byte & BIT5 else None)
+del _byte
+
+# channels and the fields of their rising and falling edges in DAQ lines
+EDGE_FIELDS = (("ch0", 1, 2), ("ch1", 3, 4), ("ch2", 5, 6), ("ch3", 7, 8))
+
+
+class PulseEvent(object):
+    """
+    Pulses of a trigger: the trigger time and, for each channel, a list
+    of (rising edge, falling edge) tuples in ns after the trigger.
+
+    Behaves like the tuple (trigger_time, ch0, ch1, ch2, ch3) used
+    before, e.g. pulses[1:] are the pulses of the channels.
+
+    :param trigger_time: time of the trigger in seconds since day start
+    :type trigger_time: float
+    """
+
+    __slots__ = ["trigger_time", "ch0", "ch1", "ch2", "ch3"]
+
+    def __init__(self, trigger_time=0, ch0=None, ch1=None, ch2=None, ch3=None):
+        self.trigger_time = trigger_time
+        self.ch0 = [] if ch0 is None else ch0
+        self.ch1 = [] if ch1 is None else ch1
+        self.ch2 = [] if ch2 is None else ch2
+        self.ch3 = [] if ch3 is None else ch3
+
+    @property
+    def channels(self):
+        """
+        Pulses of the channels 0 to 3
+
+        :returns: tuple of lists
+        """
+        return self.ch0, self.ch1, self.ch2, self.ch3
+
+    def as_tuple(self):
+        """
+        The event as (trigger_time, ch0, ch1, ch2, ch3) tuple
+
+        :returns: tuple
+        """
+        return self.trigger_time, self.ch0, self.ch1, self.ch2, self.ch3
+
+    def clear(self):
+        """
+        Remove all pulses, keeping the lists for reuse
+
+        :returns: None
+        """
+        self.trigger_time = 0
+        del self.ch0[:]
+        del self.ch1[:]
+        del self.ch2[:]
+        del self.ch3[:]
+
+    def __len__(self):
+        return 5
+
+    def __getitem__(self, index):
+        return (self.trigger_time, self.ch0, self.ch1, self.ch2, self.ch3)[index]
+
+    def __iter__(self):
+        return iter((self.trigger_time, self.ch0, self.ch1, self.ch2, self.ch3))
+
+    def __eq__(self, other):
+        if isinstance(other, (PulseEvent, tuple)):
+            return self.as_tuple() == tuple(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "PulseEvent(%r, %r, %r, %r, %r)" % self.as_tuple()
+
+
+class PulseEventPool(object):
+    """
+    Keeps released events for reuse, so that their lists do not have to
+    be allocated again for every trigger.
+
+    Only release events which are not referenced any more, e.g. after
+    the analysis of an event is done.
+
+    :param size: maximum number of events kept
+    :type size: int
+    """
+
+    def __init__(self, size=1024):
+        self.size = size
+        self._free = []
+
+    def acquire(self):
+        """
+        Get an empty event
+
+        :returns: PulseEvent
+        """
+        if self._free:
+            return self._free.pop()
+        return PulseEvent()
+
+    def release(self, event):
+        """
+        Return an event to the pool
+
+        :param event: event which is not used any more
+        :type event: PulseEvent
+        :returns: None
+        """
+        if len(self._free) < self.size:
+            event.clear()
+            self._free.append(event)
+
 
 class PulseExtractor:
     """
@@ -41,15 +209,64 @@ class PulseExtractor:
     If a pulse file is given, all the extracted pulses will be
     written into it.
 
+    If data_timestamps is set, the time of the data is calculated from the
+    GPS date and time of the DAQ lines. It is added to each message as
+    'data_time' and to each event as 'event_time'.
+
     :param logger: logger object
     :type logger: logging.Logger
-    :param filename: filename of the pulse file
-    :type filename: str
+    :param data_timestamps: add the times of the data to the messages
+    :type data_timestamps: bool
+    :param pool: pool to take the events from, the caller has to release
+                 them after use
+    :type pool: PulseEventPool
+
+    Events whose trigger flag is missing, e.g. after garbage or a reset
+    of the card, would grow until the next trigger. Such events are
+    evicted once they have more than max_pulses rising or falling edges
+    in a channel, or once a line is more than max_window trigger counts
+    after the trigger. Their further lines are ignored, the event is not
+    returned and counted in evicted_events.
+
+    :param max_pulses: maximum number of edges per channel of an event,
+                       None for no limit
+    :type max_pulses: int
+    :param max_window: maximum number of trigger counts between the
+                       trigger and the last line of an event, None for
+                       no limit
+    :type max_window: int
     """
 
-    def __init__(self, logger):
+    def __init__(self, logger, data_timestamps=False, pool=None, max_pulses=None, max_window=None):
         self.logger = logger
         self._write_pulses = False
+        self.pool = pool
+
+        # bounds of the events, see class docstring
+        self.max_pulses = max_pulses
+        self.max_window = max_window
+        self.evicted_events = {"pulses": 0, "window": 0}
+        # trigger count of the current event, and if it was evicted
+        self._event_trigger_count = 0
+        self._evicted = False
+
+        # time of the last line and of the last completed event
+        self.data_timestamps = data_timestamps
+        self.data_time = None
+        self.event_time = None
+        self.last_trigger_data_time = None
+        self._date = None
+        self._day = NO_GPS_DATE
+
+        # GPS time of the current second, the line times are calculated
+        # relative to it
+        self._gps_time = None
+        self._gps_correction = None
+        self._gps_seconds = None
+        self._anchor = 0.0
+        # seconds added to the line times after passing midnight, so that
+        # they keep increasing
+        self.day_offset = 0
 
         # start time and duration
         self.start_time = datetime.datetime.utcnow()
@@ -86,6 +303,10 @@ class PulseExtractor:
         pulses = self.extract(msg.get('raw'))
         if pulses is not None:
             msg['pulses'] = pulses
+            if self.data_timestamps:
+                msg['event_time'] = self.event_time
+        if self.data_time is not None:
+            msg['data_time'] = self.data_time
         return True
 
 
@@ -109,24 +330,14 @@ class PulseExtractor:
         :type counter_diff: int
         :return: None
         """
-        
-        rising_edges = {
-            "ch0": int(line[1], 16), "ch1": int(line[3], 16),
-            "ch2": int(line[5], 16), "ch3": int(line[7], 16)
-        }
-        falling_edges = {
-            "ch0": int(line[2], 16), "ch1": int(line[4], 16),
-            "ch2": int(line[6], 16), "ch3": int(line[8], 16)
-        }
-
-        for ch in ["ch0", "ch1", "ch2", "ch3"]:
-            re = rising_edges[ch]
-            fe = falling_edges[ch]
-
-            if re & BIT5:
-                self.re[ch].append(counter_diff + (re & BIT0_4) * TMC_TICK)
-            if fe & BIT5:
-                self.fe[ch].append(counter_diff + (fe & BIT0_4) * TMC_TICK)
+        table = EDGE_TABLE
+        for ch, re_field, fe_field in EDGE_FIELDS:
+            re = table[line[re_field]]
+            if re is not None:
+                self.re[ch].append(counter_diff + re)
+            fe = table[line[fe_field]]
+            if fe is not None:
+                self.fe[ch].append(counter_diff + fe)
 
     def _order_and_clean_pulses(self):
         """
@@ -136,31 +347,38 @@ class PulseExtractor:
         Remove also single leading or falling edges
         NEW: We add virtual falling edges!
 
-        :returns: dict of lists
+        :returns: PulseEvent
         """
-        pulses = {"ch0": [], "ch1": [], "ch2": [], "ch3": []}
+        event = self.pool.acquire() if self.pool is not None else PulseEvent()
 
-        for ch in ["ch0", "ch1", "ch2", "ch3"]:
+        for (ch, _, _), pulses in zip(EDGE_FIELDS, event.channels):
+            falling_edges = self.last_fe[ch]
+            fe_count = len(falling_edges)
             for index, re in enumerate(self.last_re[ch]):
                 # add the virtual falling edge if necessary
-                try:
-                    fe = self.last_fe[ch][index]
-                    if fe < re:
-                        fe = MAX_TRIGGER_WINDOW
-                except IndexError:
+                fe = falling_edges[index] if index < fe_count else MAX_TRIGGER_WINDOW
+                if fe < re:
                     fe = MAX_TRIGGER_WINDOW
-                    
-                pulses[ch].append((re, fe))
-                
-            pulses[ch] = sorted(pulses[ch])
-
-            # self.pulses[ch] = [(re,fe) for re,fe in self.last_re[ch],
-            #                    self.last_fe[ch])
-            # for i in self.pulses[ch]:
-            #     if not i[0] < i[1]:
-            #         #self.chan0.remove(i)
-            #         self.pulses[ch] = (i[0],MAX_TRIGGER_WINDOW)
-        return pulses
+                pulses.append((re, fe))
+
+            pulses.sort()
+
+        return event
+
+    def _evict(self, reason):
+        """
+        Drop the pulses of the current event and ignore its further lines
+
+        :param reason: 'pulses' or 'window'
+        :type reason: str
+        :returns: None
+        """
+        self.evicted_events[reason] += 1
+        self._evicted = True
+        for ch in self.re:
+            del self.re[ch][:]
+            del self.fe[ch][:]
+        self.logger.debug("Evicted event at trigger time %s, too many %s", self.last_trigger_time, reason)
 
     def _get_evt_time(self, time, correction, trigger_count, one_pps):
         """
@@ -168,25 +386,52 @@ class PulseExtractor:
         If gps is not available, only relative event time based on counts
         is returned
 
+        The GPS time is only converted when it changes. After midnight,
+        a day is added to the times, so they keep increasing.
+
         :param time: event time
         :param correction:
         :param trigger_count:
         :param one_pps:
         :returns: float
         """
-        time_fields = time.split(".")
-        t = time_fields[0]
-
-        secs_since_day_start = (int(t[0:2]) * 3600 +
-                                int(t[2:4]) * 60 + int(t[4:6]))
-
-        # FIXME: Why time_fields[1] / 1000?
-        gps_time = float(secs_since_day_start + int(time_fields[1]) / 1000.0 +
-                         int(correction) / 1000.0)
-
-        line_time = gps_time + float((trigger_count - one_pps) /
-                                     self.calculated_frequency)
-        return line_time
+        if time != self._gps_time or correction != self._gps_correction:
+            seconds = gps_time_to_seconds(time, correction)
+            if self._gps_seconds is not None and seconds < self._gps_seconds - SECONDS_PER_DAY / 2:
+                # passed midnight
+                self.day_offset += SECONDS_PER_DAY
+            self._gps_time = time
+            self._gps_correction = correction
+            self._gps_seconds = seconds
+            self._anchor = seconds + self.day_offset
+
+        return self._anchor + (trigger_count - one_pps) / self.calculated_frequency
+
+    def _get_data_time(self, date, line_time, day_offset=None):
+        """
+        Get the time of a line from its GPS date and the line time in
+        seconds since day start. Without GPS date the time is relative
+        to NO_GPS_DATE.
+
+        :param date: GPS date as ddmmyy
+        :type date: str
+        :param line_time: seconds since day start, including day_offset
+        :type line_time: float
+        :param day_offset: day offset included in line_time, defaults to
+                           the current one
+        :type day_offset: int
+        :returns: datetime.datetime
+        """
+        if date != self._date:
+            self._date = date
+            try:
+                self._day = datetime.datetime.strptime(date, "%d%m%y")
+            except ValueError:
+                self._day = NO_GPS_DATE
+        if self._day is not NO_GPS_DATE:
+            # the date already counts the days passed
+            line_time -= self.day_offset if day_offset is None else day_offset
+        return self._day + datetime.timedelta(seconds=line_time)
 
     def extract(self, line):
         """
@@ -198,7 +443,7 @@ class PulseExtractor:
 
         :param line: DAQ message
         :type line: str
-        :returns: tuple
+        :returns: PulseEvent or None
         """
 
         # ignore status messages
@@ -259,28 +504,38 @@ class PulseExtractor:
 
         self.last_time = time
 
+        if self.data_timestamps:
+            self.data_time = self._get_data_time(line[11], line_time)
+
         if int(line[1], 16) & BIT7:  # a trigger flag!
             self.ini = False
              
             # a new trigger! we have to evaluate the
             # last one and get the new pulses
-            self.last_re = self.re
-            self.last_fe = self.fe
+            # (the edge buffers are swapped and reused)
+            self.last_re, self.re = self.re, self.last_re
+            self.last_fe, self.fe = self.fe, self.last_fe
 
-            pulses = self._order_and_clean_pulses()
-            extracted_pulses = (self.last_trigger_time, pulses["ch0"],
-                                pulses["ch1"], pulses["ch2"], pulses["ch3"])
+            if self._evicted:
+                extracted_pulses = None
+                self._evicted = False
+            else:
+                extracted_pulses = self._order_and_clean_pulses()
+                extracted_pulses.trigger_time = self.last_trigger_time
 
             # as the pulses for the last event are done,
             # reinitialize data structures
             # for the next event
             self.last_trigger_time = line_time
-            self.re = {"ch0": [], "ch1": [], "ch2": [], "ch3": []}
-            self.fe = {"ch0": [], "ch1": [], "ch2": [], "ch3": []}
+            self.event_time = self.last_trigger_data_time
+            self.last_trigger_data_time = self.data_time
+            for ch in self.re:
+                del self.re[ch][:]
+                del self.fe[ch][:]
 
             # calculate edges of the new pulses
             self._calculate_edges(line)
-            self.last_trigger_count = trigger_count
+            self.last_trigger_count = self._event_trigger_count = trigger_count
         
             return extracted_pulses
         else:    
@@ -288,6 +543,11 @@ class PulseExtractor:
             # adding more pulses to the event
             if self.ini:
                 self.last_one_pps = int(line[9], 16)
+            elif self._evicted:
+                # the rest of an evicted event is ignored
+                pass
+            elif self.max_window is not None and trigger_count - self._event_trigger_count > self.max_window:
+                self._evict("window")
             else:
                 counter_diff = (self.trigger_count - self.last_trigger_count)
                 # print(counter_diff, counter_diff > int(0xffffffff))
@@ -299,10 +559,87 @@ class PulseExtractor:
 
                 self._calculate_edges(line, counter_diff=counter_diff * 1e9)
 
+                if self.max_pulses is not None:
+                    max_pulses = self.max_pulses
+                    for ch in self.re:
+                        if len(self.re[ch]) > max_pulses or len(self.fe[ch]) > max_pulses:
+                            self._evict("pulses")
+                            break
+
         # end of if trigger flag
         self.last_trigger_count = trigger_count
 
 
+def iter_events(lines, logger=None, data_timestamps=False, extractor=None):
+    """
+    Extract the events of raw DAQ lines, e.g. of an open raw data file.
+    The lines are read one at a time, so the memory used does not grow
+    with the number of lines. Lines which do not match the line pattern
+    of the DAQ providers or cannot be decoded are skipped with a warning.
+
+    :param lines: raw DAQ lines
+    :type lines: iterable of str
+    :param logger: logger object
+    :type logger: logging.Logger
+    :param data_timestamps: yield the time of the data of each event too
+    :type data_timestamps: bool
+    :param extractor: extractor to use, e.g. to continue the extraction
+                      of previous lines
+    :type extractor: PulseExtractor
+    :returns: generator of PulseEvent, or of (event_time, PulseEvent)
+              tuples if data_timestamps is set
+    """
+    from muonic.daq.provider import BaseDAQProvider
+
+    if logger is None:
+        logger = logging.getLogger(__name__)
+    if extractor is None:
+        extractor = PulseExtractor(logger, data_timestamps=data_timestamps)
+    pattern = BaseDAQProvider.LINE_PATTERN
+
+    for line in lines:
+        if pattern.match(line) is None:
+            logger.warning("Skipping garbage line: %s", line.rstrip("\r\n"))
+            continue
+        try:
+            event = extractor.extract(line.strip())
+        except (ValueError, IndexError) as e:
+            logger.warning("Could not extract line %s: %s", line.rstrip("\r\n"), e)
+            continue
+        if event is not None:
+            yield (extractor.event_time, event) if data_timestamps else event
+
+
+def iter_events_from_files(paths, logger=None, data_timestamps=False):
+    """
+    Extract the events of raw data files, one file after another, like
+    iter_events. The files are treated as one measurement, so the event
+    open at the end of a file is completed by the next file. Files
+    compressed with gzip or bzip2 are recognized by their extension.
+
+    :param paths: paths of the raw data files
+    :type paths: str or list of str
+    :param logger: logger object
+    :type logger: logging.Logger
+    :param data_timestamps: yield the time of the data of each event too
+    :type data_timestamps: bool
+    :returns: generator of PulseEvent, or of (event_time, PulseEvent)
+              tuples if data_timestamps is set
+    """
+    from muonic.daq.replay import open_raw_file
+
+    if isinstance(paths, str):
+        paths = [paths]
+    if logger is None:
+        logger = logging.getLogger(__name__)
+    extractor = PulseExtractor(logger, data_timestamps=data_timestamps)
+
+    for path in paths:
+        with open_raw_file(path) as f:
+            for item in iter_events(f, logger, data_timestamps, extractor):
+                yield item
+
+
 class VelocityTrigger:
     """
     A velocity "trigger", so that czts can be defined
@@ -377,7 +714,8 @@ class DecayTriggerThorough:
                 min_single_pulse_width=0, max_single_pulse_width=12000,
                 min_double_pulse_width=0, max_double_pulse_width=12000):
         """
-        Trigger on a certain combination of single and double pulses
+        Trigger on a certain combination of single and double pulses.
+        A veto channel outside of 0 to 3 means no veto.
 
         :param trigger_pulses: detected pulses
         :type trigger_pulses: list
@@ -403,16 +741,17 @@ class DecayTriggerThorough:
         ttp = trigger_pulses
         pulses1 = len(ttp[single_channel])  # single pulse
         pulses2 = len(ttp[double_channel])  # double pulse
-        pulses3 = len(ttp[veto_channel])    # veto pulses
+        # veto pulses
+        pulses3 = len(ttp[veto_channel]) if 0 <= veto_channel < 4 else 0
 
         # reject events with too few pulses in some setups good value
         # will be three (single pulse + double pulse required) and no hits
         # in the veto channel3 change this if only one channel is available
         if (pulses1 + pulses2 < 2) or pulses3:
             # reject event if it has to few pulses or veto pulses
-            self.logger.debug(("Rejecting decay with single pulses %s, " +
-                              "double pulses %s and veto pulses %s") %
-                              (repr(pulses1), repr(pulses2), repr(pulses3)))
+            self.logger.debug("Rejecting decay with single pulses %r, "
+                              "double pulses %r and veto pulses %r",
+                              pulses1, pulses2, pulses3)
             return None
 
         # muon it might have entered the second channel then we do
@@ -465,14 +804,103 @@ class DecayTriggerThorough:
         # there is an artifact at the end of the trigger window, so -1000
         if ((decay_time > min_decay_time) and
                 (decay_time < self.trigger_window - 1000)):
-            self.logger.debug("Decay with decay time %d found " % decay_time)
+            self.logger.debug("Decay with decay time %d found ", decay_time)
             return decay_time
 
-        self.logger.debug(("Rejecting decay with single pulses %s, " +
-                          "double pulses %s and veto pulses %s") %
-                          (repr(pulses1), repr(pulses2), repr(pulses3)))
+        self.logger.debug("Rejecting decay with single pulses %r, "
+                          "double pulses %r and veto pulses %r",
+                          pulses1, pulses2, pulses3)
         return None
 
+    def candidates(self, batch, single_channel=2, double_channel=3, veto_channel=4):
+        """
+        Events of a batch with the pulse counts required by trigger,
+        before the cuts on pulse widths and decay times. A veto channel
+        outside of 0 to 3 means no veto.
+
+        :param batch: events
+        :type batch: muonic.lib.batch.EventBatch
+        :param single_channel: channel index
+        :type single_channel: int
+        :param double_channel: channel index
+        :type double_channel: int
+        :param veto_channel: channel index
+        :type veto_channel: int
+        :returns: tuple of numpy.ndarray -- the indices of the events,
+                  the widths of the single and double pulses and the
+                  decay times
+        """
+        import numpy as np
+
+        counts = batch.counts
+        pulses1 = counts[:, single_channel]
+        pulses2 = counts[:, double_channel]
+        if 0 <= veto_channel < 4:
+            accepted = counts[:, veto_channel] == 0
+        else:
+            accepted = np.ones(len(counts), dtype=bool)
+
+        if single_channel == double_channel:
+            accepted &= pulses2 >= 2
+        else:
+            accepted &= (pulses2 >= 2) & (pulses1 == 1)
+        events = np.flatnonzero(accepted)
+
+        # first pulse of the single channel, first and last pulse of the
+        # double channel
+        single = batch.offsets[4 * events + single_channel]
+        first = batch.offsets[4 * events + double_channel]
+        last = batch.offsets[4 * events + double_channel + 1] - 1
+        single_pulse_width = batch.falling[single] - batch.rising[single]
+        double_pulse_width = batch.falling[last] - batch.rising[last]
+        # subtract rising edges, falling edges might be virtual
+        decay_times = batch.rising[last] - batch.rising[first]
+        return events, single_pulse_width, double_pulse_width, decay_times
+
+    def trigger_batch(self, batch, single_channel=2, double_channel=3,
+                      veto_channel=4, min_decay_time=0,
+                      min_single_pulse_width=0, max_single_pulse_width=12000,
+                      min_double_pulse_width=0, max_double_pulse_width=12000):
+        """
+        Trigger on all events of a batch at once with the same conditions
+        as trigger. A veto channel outside of 0 to 3 means no veto.
+
+        :param batch: events
+        :type batch: muonic.lib.batch.EventBatch
+        :param single_channel: channel index
+        :type single_channel: int
+        :param double_channel: channel index
+        :type double_channel: int
+        :param veto_channel: channel index
+        :type veto_channel: int
+        :param min_decay_time: minimum decay time
+        :type min_decay_time: int
+        :param min_single_pulse_width: minimum single pulse width
+        :type min_single_pulse_width: int
+        :param max_single_pulse_width: maximum single pulse width
+        :type max_single_pulse_width: int
+        :param min_double_pulse_width: minimum double pulse width
+        :type min_double_pulse_width: int
+        :param max_double_pulse_width: maximum double pulse width
+        :type max_double_pulse_width: int
+        :returns: tuple of numpy.ndarray -- the decay times in ns and the
+                  indices of the events with a decay
+        """
+        import numpy as np
+
+        events, single_pulse_width, double_pulse_width, decay_times = self.candidates(
+                batch, single_channel, double_channel, veto_channel)
+
+        # there is an artifact at the end of the trigger window, so -1000
+        selected = ((min_single_pulse_width < single_pulse_width) &
+                    (single_pulse_width < max_single_pulse_width) &
+                    (min_double_pulse_width < double_pulse_width) &
+                    (double_pulse_width < max_double_pulse_width) &
+                    (decay_times > min_decay_time) &
+                    (decay_times < self.trigger_window - 1000))
+        self.logger.debug("Found %d decays in %d events", np.count_nonzero(selected), len(batch))
+        return decay_times[selected], events[selected]
+
 
 if __name__ == '__main__':
     import sys 
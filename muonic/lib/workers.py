@@ -0,0 +1,466 @@
+"""
+Run groups of analyzers in worker processes.
+
+The main process publishes every message which passed the pulse extraction
+into a ring buffer in shared memory. Each worker process reads the stream
+from there, runs its own analyzers on it and sends the results back to the
+main process, where they are handed to the regular consumers.
+
+Each message travels together with the time its line was received, so
+the workers can report the latency of their analyzers to the tracer of
+the main process. These stages show up in the latency histograms, but
+not in the sampled traces of single lines.
+"""
+import multiprocessing as mp
+import pickle
+import struct
+import threading
+import time
+
+from muonic.daq import DAQIOError
+from muonic.daq.provider import BaseDAQProvider
+from .analyzers import BaseAnalyzer
+from .consumers import AbstractConsumer
+from .metrics import REGISTRY
+from .tracing import current_trace
+
+
+__all__ = ["SharedMessageRing", "AnalyzerProcessPool"]
+
+
+class SharedMessageRing(object):
+    """
+    Single producer, multiple consumer ring buffer of byte strings in shared
+    memory.
+
+    The writer never blocks. Readers keep their own read position and skip
+    messages which were overwritten before they could read them. Each slot
+    starts with the sequence number and the length of the stored message,
+    so readers can detect if a slot got overwritten while they copied it.
+
+    :param slots: number of slots in the ring
+    :type slots: int
+    :param slot_size: size of each slot in bytes, including the slot header
+    :type slot_size: int
+    """
+
+    SLOT_HEADER = struct.Struct("QI")
+
+    def __init__(self, slots=4096, slot_size=4096):
+        self.slots = slots
+        self.slot_size = slot_size
+        self._buffer = mp.RawArray('B', slots * slot_size)
+        self._head = mp.RawValue('Q', 0)
+        self._view = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_view"] = None
+        return state
+
+    @property
+    def view(self):
+        """
+        Byte view on the shared buffer, created lazily in each process
+
+        :returns: memoryview
+        """
+        if self._view is None:
+            self._view = memoryview(self._buffer).cast('B')
+        return self._view
+
+    @property
+    def head(self):
+        """
+        Sequence number of the next message to be written
+
+        :returns: int
+        """
+        return self._head.value
+
+    @property
+    def max_message_size(self):
+        """
+        Maximum size of a message fitting into one slot
+
+        :returns: int
+        """
+        return self.slot_size - self.SLOT_HEADER.size
+
+    def write(self, payload):
+        """
+        Append message to the ring. Returns False if the message is too
+        large to fit into a slot.
+
+        :param payload: message
+        :type payload: bytes
+        :returns: bool
+        """
+        size = len(payload)
+        if size > self.max_message_size:
+            return False
+
+        seq = self._head.value
+        offset = (seq % self.slots) * self.slot_size
+        view = self.view
+
+        # invalidate the slot before overwriting it
+        self.SLOT_HEADER.pack_into(view, offset, 0, 0)
+        start = offset + self.SLOT_HEADER.size
+        view[start:start + size] = payload
+        self.SLOT_HEADER.pack_into(view, offset, seq + 1, size)
+        self._head.value = seq + 1
+        return True
+
+    def read(self, seq):
+        """
+        Read the next message at or after sequence number seq.
+
+        Returns a tuple of the message (None if no message is available),
+        the sequence number to continue reading from and the number of
+        messages lost because they were overwritten.
+
+        :param seq: sequence number to read
+        :type seq: int
+        :returns: tuple
+        """
+        head = self._head.value
+        lost = 0
+
+        if head - seq > self.slots:
+            # the writer lapped us
+            lost = head - seq - self.slots
+            seq = head - self.slots
+
+        while seq < head:
+            offset = (seq % self.slots) * self.slot_size
+            slot_seq, size = self.SLOT_HEADER.unpack_from(self.view, offset)
+
+            if slot_seq == seq + 1:
+                start = offset + self.SLOT_HEADER.size
+                payload = bytes(self.view[start:start + size])
+
+                # check if the slot was overwritten while copying
+                if self.SLOT_HEADER.unpack_from(self.view, offset)[0] == seq + 1:
+                    return payload, seq + 1, lost
+
+            lost += 1
+            seq += 1
+
+        return None, seq, lost
+
+
+class _ResultForwarder(AbstractConsumer):
+    """
+    Consumer used inside of the worker processes. Forwards all calls
+    to the result queue of the worker pool.
+
+    :param results: result queue
+    :type results: multiprocessing.Queue
+    """
+
+    def __init__(self, results):
+        self.results = results
+
+    def push(self, data, data_type, run_id, analyzer_id=''):
+        self.results.put(('push', (data, data_type, run_id, analyzer_id)))
+
+    def start(self, run_id, analyzer_id='', expected_data_types=[]):
+        self.results.put(('start', (run_id, analyzer_id, expected_data_types)))
+
+    def stop(self, run_id, analyzer_id=''):
+        self.results.put(('stop', (run_id, analyzer_id)))
+
+
+class _DAQCommandProxy(BaseDAQProvider):
+    """
+    DAQ handle used inside of the worker processes. Commands are sent
+    back to the main process which owns the real DAQ provider.
+
+    :param results: result queue
+    :type results: multiprocessing.Queue
+    """
+
+    def __init__(self, results, logger=None):
+        BaseDAQProvider.__init__(self, logger)
+        self.results = results
+
+    def get(self, *args):
+        raise DAQIOError("Worker processes cannot read from the DAQ")
+
+    def put(self, *args):
+        self.results.put(('daq', args))
+
+    def data_available(self):
+        return False
+
+
+def _run_worker(ring, specs, run_id, results, stop_event):
+    """
+    Main loop of a worker process. Sets up the analyzers of the group
+    and feeds them with messages from the ring buffer until the stop
+    event is set.
+
+    :param ring: ring buffer holding the message stream
+    :type ring: SharedMessageRing
+    :param specs: analyzer classes and their options
+    :type specs: list of tuples
+    :param run_id: unique id of the current run
+    :type run_id: UUID
+    :param results: result queue
+    :type results: multiprocessing.Queue
+    :param stop_event: event to stop the worker
+    :type stop_event: multiprocessing.Event
+    :returns: None
+    """
+    forwarder = _ResultForwarder(results)
+    daq = _DAQCommandProxy(results)
+    analyzers = [cls(consumers=[forwarder], **options) for cls, options in specs]
+
+    for analyzer in analyzers:
+        analyzer.start(run_id, daq)
+
+    min_sleep_time = 0.001  # seconds
+    max_sleep_time = 0.05  # seconds
+    sleep_time = min_sleep_time
+
+    # the ring is created for each run, so the messages published
+    # before the worker got here are read too
+    seq = 0
+    lost = 0
+    stopping = False
+    completed = set()
+    # latencies of the analyzers, sent in batches to the tracer
+    latencies = []
+
+    while True:
+        payload, seq, dropped = ring.read(seq)
+        lost += dropped
+
+        if payload is None or len(latencies) >= 1000:
+            if latencies:
+                results.put(('latency', latencies))
+                latencies = []
+
+        if payload is None:
+            # drain the ring once more after the stop request
+            if stopping:
+                break
+            stopping = stop_event.is_set()
+            sleep_time = min(1.5 * sleep_time, max_sleep_time)
+            time.sleep(sleep_time)
+            continue
+
+        sleep_time = min_sleep_time
+        msg, received = pickle.loads(payload)
+
+        for analyzer in analyzers:
+            if analyzer.active:
+                result = analyzer(msg)
+                if received is not None:
+                    latencies.append((analyzer.__class__.__name__, time.monotonic() - received))
+                if analyzer.completed and analyzer not in completed:
+                    completed.add(analyzer)
+                    results.put(('completed', analyzer.__class__.__name__))
+                if not result:
+                    break
+
+    for analyzer in analyzers:
+        analyzer.stop()
+
+    results.put(('lost', lost))
+
+
+class AnalyzerProcessPool(BaseAnalyzer):
+    """
+    Runs groups of analyzers in their own worker processes.
+
+    Analyzers are given as (class, options) tuples and get instantiated
+    inside of the workers. Their results are passed to the consumers of
+    the pool. Within a group analyzers are called in order, just like
+    inside of the App. The pool is completed once all analyzers which
+    can complete have completed in their workers.
+
+    :param groups: list of analyzer groups
+    :type groups: list of lists of (class, dict) tuples
+    :param consumers: consumers receiving the results of all analyzers
+    :type consumers: list
+    :param logger: logger object
+    :type logger: logging.Logger
+    :param slots: number of messages the ring buffer can hold
+    :type slots: int
+    :param slot_size: maximum size of a pickled message in bytes
+    :type slot_size: int
+    """
+
+    def __init__(self, groups, consumers=[], logger=None, slots=4096, slot_size=4096):
+        super().__init__(consumers, logger)
+        self.groups = [list(group) for group in groups if group]
+        self.slots = slots
+        self.slot_size = slot_size
+        # number of analyzers in the workers which can complete
+        self._completable = sum(1 for group in self.groups for cls, _ in group if cls.CAN_COMPLETE)
+        self.CAN_COMPLETE = self._completable > 0
+
+        self.ring = None
+        self.workers = []
+        self._results = None
+        self._stop_event = None
+        self._result_thread = None
+        self._tracer = None
+        self._completed_count = 0
+
+        # messages which could not be delivered to the workers
+        self._oversized = REGISTRY.counter("muonic_dropped_total", "Data dropped in the pipeline",
+                                           reason="ring_oversized")
+        self._lost = REGISTRY.counter("muonic_dropped_total", "Data dropped in the pipeline",
+                                      reason="ring_overrun")
+        REGISTRY.gauge("muonic_queue_depth", "Number of items waiting in a queue",
+                       function=self._result_queue_depth, queue="worker_results")
+
+    @property
+    def analyzer_names(self):
+        """
+        Names of the analyzers running in the worker processes
+
+        :returns: list of str
+        """
+        return [cls.__name__ for group in self.groups for cls, _ in group]
+
+    def result_streams(self):
+        """
+        Names and result data types of the analyzers running in the
+        worker processes
+
+        :returns: list of (str, list of DataTypes) tuples
+        """
+        return [(cls.__name__, cls.RESULT_DATA_TYPES) for group in self.groups for cls, _ in group]
+
+    def calculate(self, msg):
+        """
+        Publish message to the worker processes
+
+        :param msg: message from daq
+        :type msg: dict
+        :returns: bool
+        """
+        trace = current_trace()
+        received = None
+        if trace is not None:
+            self._tracer = trace.tracer
+            received = trace.received
+
+        if not self.ring.write(pickle.dumps((msg, received), pickle.HIGHEST_PROTOCOL)):
+            self._oversized.value += 1
+            self.logger.warning("Message too large for worker ring buffer, dropped")
+        return True
+
+    def _start_consumers(self, run_id):
+        """
+        Start the worker processes. Analyzers inside of the workers
+        start the consumers themselves.
+
+        :param run_id: unique id of the current run
+        :type run_id: UUID
+        :returns: None
+        """
+        self.ring = SharedMessageRing(self.slots, self.slot_size)
+        self.completed = False
+        self._completed_count = 0
+        self._results = mp.Queue()
+        self._stop_event = mp.Event()
+
+        self._result_thread = threading.Thread(target=self._process_results, name="tRESULTS")
+        self._result_thread.start()
+
+        self.workers = []
+        for i, group in enumerate(self.groups):
+            worker = mp.Process(target=_run_worker, name="pANALYZER%d" % i,
+                                args=(self.ring, group, run_id, self._results, self._stop_event))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+        self.logger.info("Started %d analyzer processes" % len(self.workers))
+
+    def _stop_consumers(self):
+        """
+        Stop the worker processes and wait until all their results
+        are handed to the consumers.
+
+        :returns: None
+        """
+        if self._stop_event is None:
+            return
+
+        self._stop_event.set()
+        for worker in self.workers:
+            worker.join()
+
+        # poison the result thread
+        self._results.put(None)
+        self._result_thread.join()
+
+        if self._lost.value:
+            self.logger.warning("Analyzer processes lost %d messages so far" % self._lost.value)
+
+        self.workers = []
+        self._stop_event = None
+
+    def _process_results(self):
+        """
+        Hand results from the worker processes to the consumers
+
+        :returns: None
+        """
+        while True:
+            try:
+                item = self._results.get()
+            except (EOFError, OSError):
+                break
+
+            if item is None:
+                break
+
+            kind, args = item
+            if kind == 'push':
+                for consumer in self.consumers:
+                    consumer.push(*args)
+            elif kind == 'start':
+                for consumer in self.consumers:
+                    consumer.start(*args)
+            elif kind == 'stop':
+                for consumer in self.consumers:
+                    consumer.stop(*args)
+            elif kind == 'daq':
+                self.daq_put(*args)
+            elif kind == 'completed':
+                self.logger.info("%s completed in analyzer process" % args)
+                # each analyzer reports its completion only once
+                self._completed_count += 1
+                if self._completed_count >= self._completable:
+                    self.completed = True
+            elif kind == 'latency':
+                if self._tracer is not None:
+                    for stage, latency in args:
+                        self._tracer.record(stage, latency)
+            elif kind == 'lost':
+                self._lost.value += args
+
+    def _result_queue_depth(self):
+        if self._results is None:
+            return 0
+        try:
+            return self._results.qsize()
+        except NotImplementedError:
+            return 0
+
+    def finish(self):
+        """
+        Finish the consumers for each analyzer of the pool
+
+        :returns: None
+        """
+        for name in self.analyzer_names:
+            for consumer in self.consumers:
+                consumer.finish(name)
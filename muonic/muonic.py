@@ -1,31 +1,22 @@
 import os
 import configargparse
 import logging
-from .lib.app import App
-from .lib.analyzers import DummyAnalyzer, RateAnalyzer, PulseAnalyzer, DecayAnalyzer, VelocityAnalyzer
-from .lib.consumers import DummyConsumer, FileConsumer, BufferedConsumer
+from . import __version__
 
-# setup logging
 logger = logging.getLogger()
-logger.setLevel(logging.DEBUG)
 
-# create file handler which logs even debug messages
-fh = logging.FileHandler('muonic.log')
-fh.setLevel(logging.DEBUG)
+# analyzers which can be selected on the command line, they are only
+# imported if selected
+ANALYZERS = [
+    ("rate_analyzer", "muonic.lib.analyzers.RateAnalyzer"),
+    ("pulse_analyzer", "muonic.lib.analyzers.PulseAnalyzer"),
+    ("decay_analyzer", "muonic.lib.analyzers.DecayAnalyzer"),
+    ("velocity_analyzer", "muonic.lib.analyzers.VelocityAnalyzer"),
+    ("plateau_analyzer", "muonic.lib.analyzers.PlateauScanAnalyzer"),
+]
 
-# create console handler with a higher log level
-ch = logging.StreamHandler()
-ch.setLevel(logging.INFO)
-
-# create formatter and add it to the handlers
-file_formatter = logging.Formatter('%(asctime)s - %(name)s: %(levelname)s - %(message)s')
-console_formatter = logging.Formatter('%(name)s: %(levelname)s - %(message)s')
-fh.setFormatter(file_formatter)
-ch.setFormatter(console_formatter)
-
-# add the handlers to the logger
-logger.addHandler(fh)
-logger.addHandler(ch)
+# analyzer names used in run plans
+ANALYZER_NAMES = dict((option[:-len("_analyzer")], option) for option, name in ANALYZERS)
 
 def main():
 
@@ -37,17 +28,40 @@ def main():
     p.add('-d', '--data-provider', required=False)
     p.add("-s", "--sim", dest="sim", help="use simulation mode for testing without hardware",
           action="store_true", default=False)
-    p.add("--port", dest="port", help="listen to daq on port ", default=None)
+    p.add("--port", dest="port", action="append", default=None,
+          help="serial device of a DAQ card, repeat for several cards (default: detect one card)")
+    p.add("--max-event-pulses", dest="max_event_pulses", type=int, default=0,
+          help="evict events with more edges per channel, e.g. after a missing trigger flag (default 0: no limit)")
+    p.add("--max-event-window", dest="max_event_window", type=int, default=0,
+          help="evict events whose lines span more trigger counts, e.g. 2500000 for 0.1s at 25MHz "
+               "(default 0: no limit)")
+    p.add("--merge-delay", dest="merge_delay", type=float, default=2.0,
+          help="with several cards, maximum time in s to wait for the events of the other cards")
+    p.add("--replay", dest="replay", nargs="+", metavar="FILE", default=None,
+          help="analyze archived raw DAQ data (plain, .gz or .bz2) instead of reading from a DAQ card")
+    p.add("--follow", dest="follow", action="store_true", default=False,
+          help="with --replay, follow archives while they are written by --acquire-only")
+    p.add("--acquire-only", dest="acquire_only", metavar="ARCHIVE", default=None,
+          help="only write the DAQ data to this gzip archive, to be analyzed with --replay")
     p.add("-t", "--timewindow", dest="time_window",
           help="time window for the measurement in s (default 5s)",
           type=float, default=5.0)
     p.add("-m", "--measurement-duration", dest="meas_duration", required=False,
           help="Duration of measurement in seconds", type=float)
-    #p.add("-d", "--debug", dest="log_level", help="switch to loglevel debug", action="store_const", const=logging.DEBUG, default=logging.INFO)
+    p.add("--run-plan", dest="run_plan", metavar="FILE", default=None,
+          help="execute the runs of this JSON run plan back to back, without reconnecting to the DAQ card")
+    p.add("--log-level", dest="log_level", help="level of the messages written to muonic.log",
+          choices=["DEBUG", "INFO", "WARNING", "ERROR"], default="INFO")
+    p.add("--log-rate-limit", dest="log_rate_limit",
+          help="maximum number of log messages per call site within 10s (0: unlimited)",
+          type=int, default=10)
+    p.add("--no-config-cache", dest="config_cache",
+          help="do not start with the cached DAQ card configuration, wait for the card to report it",
+          action="store_false", default=True)
     p.add("-n", "--nostatus", dest="write_daq_status",
           help="do not write DAQ status messages to RAW data files",
           action="store_false", default=True)
-    p.add("-v", "--version", dest="version", help="show current version", action="store_true", default=False)
+    p.add("-v", "--version", help="show current version", action="version", version="muonic %s" % __version__)
 
     # Consumers:
     p.add("--raw", dest="raw_consumer", help="View raw DAQ data", action="store_true", default=False)
@@ -60,15 +74,100 @@ def main():
     p.add("-D", "--Django", nargs=1, metavar=("USER"), help="Initialize Django consumer with USER", default=None)
     p.add("-G", "--GUI", dest="GUI", help="Invoke GUI", action="store_true", default=False)
 
+    # Live reconfiguration
+    p.add("--control-socket", dest="control_socket", metavar="PATH", default=None,
+          help="Accept JSON commands to add, remove and configure analyzers and consumers on this Unix socket")
+
+    # Live coincidences between stations
+    p.add("--publish-events", dest="publish_events", metavar="HOST:PORT", default=None,
+          help="Send the events to a muonic-aggregator for coincidences with other stations")
+    p.add("--station-id", dest="station_id", default=None,
+          help="Name of this station at the aggregator (default: host name)")
+
+    # Metrics
+    p.add("--metrics-file", dest="metrics_file",
+          help="Periodically write pipeline metrics in Prometheus text format to this file",
+          type=str, default=None)
+    p.add("--metrics-interval", dest="metrics_interval", help="Update interval of the metrics file in s",
+          type=float, default=10.0)
+    p.add("--metrics-listen", dest="metrics_listen",
+          help="Serve pipeline metrics via HTTP on this local port or Unix socket path",
+          type=str, default=None)
+
+    # Latency tracing
+    p.add("--latency-tracing", dest="latency_tracing",
+          help="Record per stage latency histograms; send SIGUSR1 to dump sampled traces",
+          action="store_true", default=False)
+    p.add("--trace-sample", dest="trace_sample", help="Keep every n-th latency trace completely",
+          type=int, default=1000)
+
+    # Profiling
+    p.add("--profile", dest="profile", nargs="?", const="cprofile", default=None,
+          choices=["cprofile", "sampling"],
+          help="Profile the measurement with cProfile (default) or a sampling profiler and " +
+               "write the results next to the data")
+
     # Analyzers
     p.add("--buffer-size", dest="buf_size", help="Buffer size for analyzed data", type=int, default=255)
     p.add("--rate", dest="rate_analyzer", help="Analyze rates", action="store_true", default=False)
     p.add("--pulse", dest="pulse_analyzer", help="Analyze pulses", action="store_true", default=False)
     p.add("--decay", dest="decay_analyzer", help="Analyze decays", action="store_true", default=False)
     p.add("--velocity", dest="velocity_analyzer", help="Analyze velocity", action="store_true", default=False)
+    p.add("--plateau-scan", dest="plateau_analyzer", action="store_true", default=False,
+          help="Scan the thresholds for the plateau of the rate curves, set them to the plateau and stop")
+    p.add("--scan-channels", dest="scan_channels", nargs="+", type=int, choices=range(4), default=None,
+          help="Channels to scan (default all)")
+    p.add("--scan-range", dest="scan_range", nargs=2, type=int, metavar=("MIN", "MAX"), default=[20, 400],
+          help="Threshold range of the scan in mV")
+    p.add("--scan-precision", dest="scan_precision", type=float, default=0.05,
+          help="Relative statistical error of the rate at which a scan point is complete")
+    p.add("--scan-max-dwell", dest="scan_max_dwell", type=float, default=60.0,
+          help="Maximum measurement time per scan point in s")
+    p.add("--scan-max-points", dest="scan_max_points", type=int, default=30,
+          help="Maximum number of scan points")
+    p.add("--rate-card", dest="rate_card", type=int, default=0,
+          help="with several cards, index of the card whose scalars are used for the rates")
+    p.add("--analyzer-processes", dest="analyzer_processes",
+          help="Run the analyzers in this number of worker processes (0: run them in the main process)",
+          type=int, default=0)
 
     options = vars(p.parse_args())
 
+    if options.get("plateau_analyzer") and options.get("replay"):
+        p.error("--plateau-scan needs a DAQ card, it cannot be combined with --replay")
+
+    if options.get("port") and len(options.get("port")) > 1:
+        if options.get("acquire_only"):
+            p.error("--acquire-only records a single DAQ card, give only one --port")
+        if not 0 <= options.get("rate_card") < len(options.get("port")):
+            p.error("--rate-card must be the index of one of the --port cards")
+
+    run_plan = None
+    if options.get("run_plan"):
+        if options.get("replay"):
+            p.error("--run-plan cannot be combined with --replay")
+        from .lib.run_plan import load_run_plan
+        try:
+            run_plan = load_run_plan(options.get("run_plan"), analyzer_names=ANALYZER_NAMES,
+                                     default_duration=options.get("meas_duration"))
+        except (IOError, OSError, ValueError) as e:
+            p.error("invalid run plan: %s" % e)
+        if any(run.analyzers is not None for run in run_plan[1]):
+            if options.get("analyzer_processes") > 0:
+                p.error("analyzers cannot be selected per run together with --analyzer-processes")
+            if options.get("acquire_only"):
+                p.error("analyzers cannot be selected per run together with --acquire-only, " +
+                        "analyze the archive with --replay instead")
+
+    # import the pipeline only after parsing the arguments, so that --help
+    # and --version return immediately
+    from .lib.app import App
+    from .lib.consumers import DummyConsumer, FileConsumer, BufferedConsumer
+    from .lib.log import setup_logging, shutdown_logging
+
+    setup_logging(level=getattr(logging, options.get("log_level")),
+                  console_level=logging.INFO, burst=options.get("log_rate_limit"))
+
     consumers = []
 
     # consumers.append(DummyConsumer())
@@ -140,19 +239,58 @@ def main():
 
         bf = [BufferedConsumer(options.get("buf_size"), *consumers)]
 
-        if options.get("rate_analyzer"):
-           analyzers.append(RateAnalyzer(consumers=bf, **options))
-
-        if options.get("pulse_analyzer"):
-            analyzers.append(PulseAnalyzer(consumers=bf, **options))
-
-        if options.get("decay_analyzer"):
-            analyzers.append(DecayAnalyzer(consumers=bf, **options))
-
-        if options.get("velocity_analyzer"):
-            analyzers.append(VelocityAnalyzer(consumers=bf, **options))
+        # all analyzers used by the run plan are created, they are enabled
+        # per run
+        selected = set(option for option, name in ANALYZERS if options.get(option))
+        if run_plan is not None:
+            for run in run_plan[1]:
+                selected.update(ANALYZER_NAMES[name] for name in run.analyzers or [])
+        analyzer_options = [(option, name) for option, name in ANALYZERS if option in selected]
+        analyzer_classes = [App.import_class(name) for option, name in analyzer_options]
+
+        if options.get("acquire_only") and analyzer_classes:
+            logger.warning("Analyzers are not run in acquisition only mode, " +
+                           "analyze the archive with --replay instead")
+            analyzer_classes = []
+
+        processes = options.get("analyzer_processes")
+        if processes > 0 and analyzer_classes:
+            # distribute the analyzers round robin over the worker processes
+            groups = [[] for _ in range(min(processes, len(analyzer_classes)))]
+            for i, analyzer_class in enumerate(analyzer_classes):
+                groups[i % len(groups)].append((analyzer_class, options))
+            from .lib.workers import AnalyzerProcessPool
+            analyzers.append(AnalyzerProcessPool(groups, consumers=bf))
+        else:
+            for analyzer_class in analyzer_classes:
+                analyzers.append(analyzer_class(consumers=bf, **options))
 
         app = App(options=options, analyzers=analyzers, logger=logger)
-        app.run()
+
+        control = None
+        if options.get("control_socket"):
+            from .lib.control import ControlServer
+            control = ControlServer(app, options.get("control_socket"), bf,
+                                    analyzers=dict((option[:-len("_analyzer")], name)
+                                                   for option, name in ANALYZERS),
+                                    options=options, logger=logger)
+            control.start()
+
+        if run_plan is not None:
+            from .lib.run_plan import RunPlanExecutor
+            by_name = {}
+            if processes == 0:
+                option_names = dict((option, name) for name, option in ANALYZER_NAMES.items())
+                by_name = dict((option_names[option], analyzer)
+                               for (option, _), analyzer in zip(analyzer_options, analyzers))
+            default_settings, runs = run_plan
+            RunPlanExecutor(app, runs, default_settings, analyzers=by_name, logger=logger).run()
+        else:
+            app.run()
+
+        if control is not None:
+            control.stop()
+
+    shutdown_logging()
 
 #"""
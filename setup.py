@@ -45,5 +45,6 @@ setup(name=muonic.__name__,
       ],
 
       entry_points={
-          "console_scripts": ["muonic=muonic.muonic:main"]
+          "console_scripts": ["muonic=muonic.muonic:main",
+                              "muonic-aggregator=muonic.aggregator:main"]
       })
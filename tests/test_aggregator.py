@@ -0,0 +1,92 @@
+import datetime
+import os
+import shutil
+import socket
+import tempfile
+import time
+import unittest
+
+from muonic.lib.aggregator import Aggregator, EventPublisher, StationCoincidenceFinder, parse_address, time_to_ns
+
+
+def event(station, time_ns, card=0):
+    return {"type": "event", "station": station, "card": card, "time_ns": time_ns, "pulses": [0.0, [], [], [], []]}
+
+
+class AggregatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.output = os.path.join(self.directory, "coincidences.txt")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_parse_address(self):
+        self.assertEqual(parse_address("example.org:8000"), ("example.org", 8000))
+        self.assertEqual(parse_address(8000, default_host="0.0.0.0"), ("0.0.0.0", 8000))
+        for address in ["host:0", "host:70000", "host:port"]:
+            with self.assertRaises(ValueError):
+                parse_address(address)
+
+    def test_time_to_ns(self):
+        timestamp = datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=1718000000, microseconds=123456)
+        self.assertEqual(time_to_ns(timestamp), 1718000000123456000)
+
+    def test_coincidence_finder(self):
+        found = []
+        finder = StationCoincidenceFinder(window=100, min_stations=2, callback=found.append)
+        for station, time_ns in [("a", 0), ("a", 50), ("b", 1000), ("a", 1100), ("c", 1101), ("b", 5000)]:
+            finder.add(station, {"time_ns": time_ns})
+        finder.flush()
+        self.assertEqual(finder.count, 1)
+        self.assertEqual([(station, e["time_ns"]) for station, e in found[0]], [("b", 1000), ("a", 1100)])
+
+    def test_merged_stations(self):
+        aggregator = Aggregator("1", output=self.output, window=1000, max_delay=5.0)
+        # the messages are passed without listening for stations
+        aggregator._file = open(self.output, "a")
+        start = 1700000000 * 10 ** 9
+        # the second station is late, its events are merged by time
+        messages = [("a", {"type": "hello"}), ("b", {"type": "hello"}),
+                    ("a", event("a", start)), ("a", event("a", start + 10 ** 9)),
+                    ("b", event("b", start + 500, card=1)), ("b", event("b", start + 2 * 10 ** 9)),
+                    ("a", None), ("b", None)]
+        for message in messages:
+            aggregator.messages.put(message)
+        aggregator.close()
+        self.assertEqual(aggregator.finder.count, 1)
+        with open(self.output) as f:
+            self.assertEqual(f.read(), "2023-11-14T22:13:20 2 a 0 0 b 1 500\n")
+
+    def test_publish(self):
+        # find a free port for the aggregator
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        aggregator = Aggregator("127.0.0.1:%d" % port, window=1000, max_delay=0.0)
+        aggregator.start()
+        publishers = [EventPublisher("127.0.0.1:%d" % port, station, retry_interval=0.1) for station in "ab"]
+        try:
+            event_time = datetime.datetime(2024, 1, 1)
+            for publisher in publishers:
+                publisher.start()
+                publisher({"pulses": (0.0, [(0.0, 10.0)], [], [], []), "event_time": event_time})
+            for publisher in publishers:
+                publisher.stop()
+
+            events = 0
+            end = time.monotonic() + 5
+            while events < 2 and time.monotonic() < end:
+                station, message = aggregator.messages.get(timeout=5)
+                aggregator._handle(station, message)
+                events += message is not None and message["type"] == "event"
+        finally:
+            for publisher in publishers:
+                publisher.stop()
+            aggregator.close()
+        self.assertEqual(aggregator.finder.count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from muonic.analysis_scripts.batch_decays import batch_decays
+from muonic.analysis_scripts.decay_cut_scan import decay_cut_scan
+
+SIMULATED_DATA = os.path.join(os.path.dirname(__file__), os.pardir, "muonic", "daq", "simdaq.txt")
+
+# lines as they come from glitches of the serial connection
+GARBAGE_LINES = [
+    "ZZF7E1F8 00 00 00 00 00 00 00 00 00000002 000000.000 000000 V 00 8 +0000\n",
+    "66795E\x00\xff 00 24 00 00 00 00 00 00000002 000000.000 000000 V 00 8 +0000\n",
+    "66795EE0 00 24 00 00 00 00 00 00 00000002 00ab00.0x0 000000 V 00 8 +0000\n",
+    "66795EE0 00 24 00\n",
+]
+
+
+class AnalysisScriptTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        with open(SIMULATED_DATA) as f:
+            lines = f.readlines()
+        self.clean_file = self._write("clean.txt", lines)
+        # garbage every 5000 lines, so the blocks of the scripts contain it
+        for index in range(len(lines) - len(lines) % 5000, 0, -5000):
+            lines[index:index] = GARBAGE_LINES
+        self.garbage_file = self._write("garbage.txt", lines)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _write(self, name, lines):
+        path = os.path.join(self.directory, name)
+        with open(path, "w") as f:
+            f.writelines(lines)
+        return path
+
+    def _read(self, name):
+        with open(os.path.join(self.directory, name)) as f:
+            return f.read()
+
+    def test_batch_decays_skips_garbage(self):
+        batch_decays([self.clean_file, "-o", os.path.join(self.directory, "clean_decays.txt")])
+        with self.assertLogs(level="WARNING"):
+            batch_decays([self.garbage_file, "-o", os.path.join(self.directory, "garbage_decays.txt")])
+        decays = self._read("clean_decays.txt")
+        self.assertTrue(decays)
+        self.assertEqual(self._read("garbage_decays.txt"), decays)
+
+    def test_batch_decays_clock_model(self):
+        batch_decays([self.clean_file, "-o", os.path.join(self.directory, "decays.txt")])
+        with self.assertLogs(level="WARNING"):
+            batch_decays([self.garbage_file, self.clean_file, "--clock-model",
+                          "-o", os.path.join(self.directory, "clock_decays.txt")])
+        decays = [line.split()[-1] for line in self._read("decays.txt").splitlines()]
+        clock_decays = [line.split()[-1] for line in self._read("clock_decays.txt").splitlines()]
+        # the same decays, only timed differently
+        self.assertEqual(clock_decays[:len(decays)], decays)
+        self.assertEqual(len(clock_decays), 2 * len(decays))
+
+    def test_decay_cut_scan_skips_garbage(self):
+        cuts = ["--decay-min-time", "0", "20", "--min-single-pulse-width", "0", "10"]
+        decay_cut_scan([self.clean_file, "-o", os.path.join(self.directory, "clean_scan.txt")] + cuts)
+        with self.assertLogs(level="WARNING"):
+            decay_cut_scan([self.garbage_file, "-o", os.path.join(self.directory, "garbage_scan.txt")] + cuts)
+        table = self._read("clean_scan.txt")
+        self.assertEqual(len(table.splitlines()), 5)
+        self.assertEqual(self._read("garbage_scan.txt"), table)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from muonic.lib.card_config import CARD_SETTINGS, CardConfigCache
+
+
+class CardConfigCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "config", "card_config.json")
+        self.cache = CardConfigCache(self.path)
+        self.settings = dict((key, i) for i, key in enumerate(CARD_SETTINGS))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_store_and_load(self):
+        self.assertIsNone(self.cache.load("card0"))
+        self.assertTrue(self.cache.store("card0", dict(self.settings, meas_duration=60)))
+        self.assertTrue(self.cache.store("card1", dict(self.settings, gate_width=42)))
+        self.assertEqual(self.cache.load("card0"), self.settings)
+        self.assertEqual(self.cache.load("card1")["gate_width"], 42)
+        self.assertEqual(os.listdir(os.path.dirname(self.path)), ["card_config.json"])
+
+    def test_incomplete_configuration(self):
+        settings = dict(self.settings)
+        del settings["veto"]
+        self.cache.store("card0", settings)
+        self.assertIsNone(self.cache.load("card0"))
+
+    def test_corrupt_file(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, "w") as f:
+            f.write("{not json")
+        with self.assertLogs(level="WARNING"):
+            self.assertIsNone(self.cache.load("card0"))
+        with self.assertLogs(level="WARNING"):
+            self.assertTrue(self.cache.store("card0", self.settings))
+        with open(self.path) as f:
+            self.assertEqual(list(json.load(f)), ["card0"])
+
+    def test_unwritable_path(self):
+        # the parent of the cache file is a file
+        open(os.path.join(self.directory, "config"), "w").close()
+        with self.assertLogs(level="WARNING"):
+            self.assertFalse(self.cache.store("card0", self.settings))
+
+
+if __name__ == '__main__':
+    unittest.main()
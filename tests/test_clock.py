@@ -0,0 +1,85 @@
+import datetime
+import logging
+import unittest
+
+import numpy as np
+
+from muonic.analysis_scripts.batch_decays import clock_model_times
+from muonic.lib.batch import BatchPulseExtractor
+from muonic.lib.clock import COUNTER_RANGE, ClockModel, unwrap_counter
+
+FREQUENCY = 25e6
+
+
+def raw_lines(times, first_count=123456):
+    """
+    DAQ lines with a trigger at each of the given times in seconds since
+    day start, from a card counting with FREQUENCY
+    """
+    counts = np.floor(first_count + FREQUENCY * (times - times[0])).astype(np.int64)
+    pps_counts = np.floor(first_count + FREQUENCY * (np.floor(times) - times[0])).astype(np.int64)
+    lines = []
+    for count, pps_count, second in zip(counts.tolist(), pps_counts.tolist(), np.floor(times).tolist()):
+        second = int(second)
+        lines.append("%08X 80 01 00 01 00 01 00 01 %08X %02d%02d%02d.000 181026 12 V 00 +0000\n" %
+                     (count % COUNTER_RANGE, pps_count % COUNTER_RANGE,
+                      second // 3600, second % 3600 // 60, second % 60))
+    return lines
+
+
+class UnwrapCounterTest(unittest.TestCase):
+
+    def test_rollover(self):
+        values = np.array([COUNTER_RANGE - 10, COUNTER_RANGE - 5, 3, 8])
+        self.assertEqual(unwrap_counter(values).tolist(),
+                         [COUNTER_RANGE - 10, COUNTER_RANGE - 5, COUNTER_RANGE + 3, COUNTER_RANGE + 8])
+
+    def test_gap_longer_than_counter_range(self):
+        # 400 s at 25 MHz are more than two counter ranges
+        step = int(400 * FREQUENCY)
+        values = np.array([0, 1000, 1000 + step, 2000 + step]) % COUNTER_RANGE
+        seconds = np.array([0., 0., 400., 400.])
+        self.assertEqual(unwrap_counter(values, seconds, FREQUENCY).tolist(),
+                         [0, 1000, 1000 + step, 2000 + step])
+
+    def test_single_broken_second(self):
+        values = np.array([10, 20, 30, 40])
+        seconds = np.array([0., 900., 0., np.nan])
+        self.assertEqual(unwrap_counter(values, seconds, FREQUENCY).tolist(), [10, 20, 30, 40])
+
+
+class ClockModelTest(unittest.TestCase):
+
+    def test_gap_longer_than_counter_range(self):
+        rng = np.random.RandomState(1)
+        times = np.concatenate([1000.2 + np.sort(rng.uniform(0, 20, 2000)),
+                                1300.5 + np.sort(rng.uniform(0, 20, 2000))])
+        model, raw = ClockModel.from_lines(raw_lines(times))
+        self.assertEqual(len(raw), len(times))
+        self.assertLess(np.abs(model.times - times).max(), 1e-7)
+        passed = (model.trigger_counts[-1] - model.trigger_counts[0]) / FREQUENCY
+        self.assertAlmostEqual(passed, times[-1] - times[0], places=6)
+
+    def test_times_of_event_trigger_lines(self):
+        rng = np.random.RandomState(2)
+        times = 43200.3 + np.sort(rng.uniform(0, 30, 3000))
+        lines = raw_lines(times)
+        lines.insert(1500, "garbage\x00\n")
+        times = np.insert(times, 1500, np.nan)
+        clock_times = clock_model_times(lines, 0)
+
+        extractor = BatchPulseExtractor(logging.getLogger(__name__))
+        with self.assertLogs(level="WARNING"):
+            batches = [extractor.extract_batch(lines[:1000]), extractor.extract_batch(lines[1000:])]
+        trigger_lines = np.concatenate([batch.trigger_lines for batch in batches])
+        # each line has a trigger flag, the first event is the one before
+        # the first trigger
+        self.assertEqual(trigger_lines.tolist(), [-1] + [i for i in range(len(lines) - 1) if i != 1500])
+
+        day = datetime.datetime(2026, 10, 18)
+        errors = [(clock_times[line] - day).total_seconds() - times[line] for line in trigger_lines[1:].tolist()]
+        self.assertLess(np.abs(errors).max(), 1e-6)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import concurrent.futures
+import json
+import os
+import time
+import unittest
+
+from muonic.lib.analyzers import DecayAnalyzer, VelocityAnalyzer
+from muonic.lib.app import App
+from muonic.lib.control import ControlServer
+
+SIMULATED_DATA = os.path.join(os.path.dirname(__file__), os.pardir, "muonic", "daq", "simdaq.txt")
+
+
+class ControlServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = App(options={"replay": [SIMULATED_DATA]})
+        self.decay = DecayAnalyzer()
+        self.velocity = VelocityAnalyzer()
+        self.app.add_analyzers([self.decay, self.velocity])
+        # the socket is not started, the commands are passed to handle_line
+        self.control = ControlServer(self.app, None, [], analyzers={
+            "decay": "muonic.lib.analyzers.DecayAnalyzer",
+            "velocity": "muonic.lib.analyzers.VelocityAnalyzer"})
+
+    def tearDown(self):
+        self.app.close()
+
+    def command(self, **request):
+        # run the main loop of the App until the command is done
+        with concurrent.futures.ThreadPoolExecutor(1) as pool:
+            reply = pool.submit(self.control.handle_line, json.dumps(request))
+            while not reply.done():
+                self.app._run_pending_calls()
+                time.sleep(0.001)
+        return reply.result()
+
+    def configure(self, analyzer, **options):
+        return self.command(command="configure_analyzer", analyzer=analyzer, options=options)
+
+    def test_configure(self):
+        self.assertEqual(self.configure("decay", single_pulse_channel=2, decay_min_time="300"),
+                         {"ok": True, "result": "DecayAnalyzer"})
+        self.assertEqual((self.decay.single_pulse_channel, self.decay.decay_min_time), (2, 300))
+        self.assertTrue(self.configure("velocity", upper_channel=3)["ok"])
+        self.assertEqual(self.velocity.upper_channel, 3)
+
+    def test_invalid_channels(self):
+        for analyzer, options in [("decay", {"veto_pulse_channel": 4}),
+                                  ("decay", {"single_pulse_channel": -1}),
+                                  ("velocity", {"lower_channel": 4}),
+                                  ("velocity", {"upper_channel": "a"})]:
+            reply = self.configure(analyzer, **options)
+            self.assertFalse(reply["ok"], options)
+            self.assertIn("invalid value for", reply["error"])
+        self.assertEqual((self.decay.single_pulse_channel, self.decay.veto_pulse_channel), (0, 2))
+        self.assertEqual((self.velocity.upper_channel, self.velocity.lower_channel), (0, 1))
+
+    def test_invalid_cuts(self):
+        reply = self.configure("decay", decay_min_time=-1)
+        self.assertEqual(reply, {"ok": False, "error": "invalid value for decay_min_time: -1"})
+        # nothing is changed if one of the options is invalid
+        self.assertFalse(self.configure("decay", min_single_pulse_width=10, max_double_pulse_width=-5)["ok"])
+        self.assertEqual((self.decay.min_single_pulse_width, self.decay.max_double_pulse_width), (0, 12000))
+
+    def test_invalid_commands(self):
+        self.assertFalse(self.configure("decay", trigger_window=100)["ok"])
+        self.assertFalse(self.configure("rate", time_window=10)["ok"])
+        self.assertFalse(self.command(command="configure_analyzer", analyzer="decay", options=[1])["ok"])
+        self.assertFalse(self.command(command="shutdown")["ok"])
+        self.assertEqual(self.control.handle_line("[]"), {"ok": False, "error": "command must be an object"})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import logging
+import os
+import unittest
+
+import numpy as np
+
+from muonic.daq.replay import open_raw_file
+from muonic.lib.batch import BatchPulseExtractor, EventBatch
+from muonic.lib.utils import DecayTriggerThorough, PulseEvent
+
+SIMULATED_DATA = os.path.join(os.path.dirname(__file__), os.pardir, "muonic", "daq", "simdaq.txt")
+
+logger = logging.getLogger(__name__)
+
+
+def event_batch(events):
+    """
+    EventBatch of a list of PulseEvents
+    """
+    counts = [len(channel) for event in events for channel in event.channels]
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    pulses = [pulse for event in events for channel in event.channels for pulse in channel]
+    edges = np.array(pulses, dtype=np.float64).reshape(-1, 2)
+    return EventBatch(np.array([event.trigger_time for event in events]), None, offsets, edges[:, 0], edges[:, 1])
+
+
+class DecayTriggerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.trigger = DecayTriggerThorough(logger)
+        self.events = [
+            # decay in the default channels
+            PulseEvent(0, ch2=[(0, 50)], ch3=[(0, 50), (2000, 2050)]),
+            # pulses in the other channels do not veto by default
+            PulseEvent(1, ch0=[(10, 40)], ch2=[(0, 50)], ch3=[(0, 50), (3000, 3050)]),
+            # no second pulse
+            PulseEvent(2, ch2=[(0, 50)], ch3=[(0, 50)]),
+            # too late, at the end of the trigger window
+            PulseEvent(3, ch2=[(0, 50)], ch3=[(0, 50), (9500, 9550)]),
+            # two pulses in the single pulse channel
+            PulseEvent(4, ch2=[(0, 50), (100, 150)], ch3=[(0, 50), (2000, 2050)]),
+        ]
+
+    def compare(self, events, **options):
+        expected = [(index, decay) for index, decay in
+                    enumerate(self.trigger.trigger(event.channels, **options) for event in events)
+                    if decay is not None]
+        decays, indices = self.trigger.trigger_batch(event_batch(events), **options)
+        self.assertEqual(list(zip(indices.tolist(), decays.tolist())), expected)
+        return expected
+
+    def test_default_arguments(self):
+        self.assertEqual(self.compare(self.events), [(0, 2000), (1, 3000)])
+
+    def test_veto(self):
+        self.assertEqual(self.compare(self.events, veto_channel=0), [(0, 2000)])
+
+    def test_same_channel(self):
+        events = [PulseEvent(0, ch1=[(0, 50), (2000, 2050)]), PulseEvent(1, ch1=[(0, 50)])]
+        self.assertEqual(self.compare(events, single_channel=1, double_channel=1), [(0, 2000)])
+
+    def test_simulated_data(self):
+        extractor = BatchPulseExtractor(logger)
+        with open_raw_file(SIMULATED_DATA) as f:
+            events = list(extractor.extract_batch(f.readlines()))
+        self.compare(events)
+        self.assertTrue(self.compare(events, single_channel=0, double_channel=1, veto_channel=2))
+        self.compare(events, single_channel=0, double_channel=1, min_decay_time=500)
+
+
+if __name__ == '__main__':
+    unittest.main()
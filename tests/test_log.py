@@ -0,0 +1,60 @@
+import logging
+import queue
+import unittest
+
+from muonic.lib.log import RateLimitedQueueHandler
+
+
+def record(created, lineno=10, level=logging.INFO, msg="message %d", args=(1,)):
+    return logging.makeLogRecord({"name": "test", "pathname": "test.py", "lineno": lineno, "levelno": level,
+                                  "levelname": logging.getLevelName(level), "created": created,
+                                  "msg": msg, "args": args})
+
+
+class RateLimitedQueueHandlerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.queue = queue.Queue()
+        self.handler = RateLimitedQueueHandler(self.queue, burst=2, interval=10.0)
+
+    def messages(self):
+        messages = []
+        while not self.queue.empty():
+            messages.append(self.queue.get_nowait().msg)
+        return messages
+
+    def test_burst_per_call_site(self):
+        for i in range(5):
+            self.handler.handle(record(100 + i, args=(i,)))
+        self.handler.handle(record(105, lineno=20))
+        # errors are never suppressed
+        self.handler.handle(record(106, level=logging.ERROR))
+        self.assertEqual(self.messages(), ["message 0", "message 1", "message 1", "message 1"])
+
+    def test_summary_after_interval(self):
+        for i in range(5):
+            self.handler.handle(record(100 + i, args=(i,)))
+        self.messages()
+        self.handler.handle(record(111, args=(5,)))
+        self.assertEqual(self.messages(), ["3 similar messages suppressed in the last 11 s, last one: message 4",
+                                           "message 5"])
+
+    def test_flush_summaries(self):
+        for i in range(3):
+            self.handler.handle(record(100 + i, args=(i,)))
+        self.messages()
+        self.handler.flush_summaries(force=True)
+        self.assertEqual(len(self.messages()), 1)
+        # nothing left to summarize
+        self.handler.flush_summaries(force=True)
+        self.assertEqual(self.messages(), [])
+
+    def test_no_limit(self):
+        self.handler.burst = 0
+        for i in range(5):
+            self.handler.handle(record(100 + i, args=(i,)))
+        self.assertEqual(len(self.messages()), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
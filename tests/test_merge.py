@@ -0,0 +1,76 @@
+import unittest
+
+from muonic.lib.merge import TimeOrderedMerger
+from muonic.lib.metrics import REGISTRY
+
+
+class TimeOrderedMergerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.name = self.id()
+        self.merger = TimeOrderedMerger(["card0", "card1"], max_delay=2.0, max_items=100, name=self.name)
+
+    def tearDown(self):
+        REGISTRY.remove("muonic_queue_depth", queue=self.name)
+        REGISTRY.remove("muonic_merge_late_total", merger=self.name)
+        REGISTRY.remove("muonic_merge_overflow_total", merger=self.name)
+
+    def push(self, source, *timestamps):
+        for timestamp in timestamps:
+            self.merger.push(source, timestamp, "%s@%s" % (source, timestamp))
+
+    def items(self, ready):
+        return [item for _, item in ready]
+
+    def test_order_across_cards(self):
+        self.push("card0", 1.0, 1.2, 1.4)
+        # card1 did not deliver yet, its items could come first
+        self.assertEqual(self.merger.pop_ready(), [])
+        self.push("card1", 1.1, 1.3)
+        self.assertEqual(self.items(self.merger.pop_ready()), ["card0@1.0", "card1@1.1", "card0@1.2", "card1@1.3"])
+        self.push("card1", 1.5)
+        self.assertEqual(self.items(self.merger.pop_ready()), ["card0@1.4"])
+        self.assertEqual(self.items(self.merger.flush()), ["card1@1.5"])
+        self.assertEqual(len(self.merger), 0)
+
+    def test_same_time_stamp(self):
+        self.push("card1", 1.0)
+        self.push("card0", 1.0)
+        self.push("card1", 1.0)
+        # items with the same time stamp keep their order of arrival
+        self.assertEqual(self.items(self.merger.pop_ready()), ["card1@1.0", "card0@1.0", "card1@1.0"])
+
+    def test_heartbeat(self):
+        self.push("card0", 1.0, 1.5)
+        self.merger.advance("card1", 1.2)
+        self.assertEqual(self.items(self.merger.pop_ready()), ["card0@1.0"])
+        # older heartbeats do not move the source back
+        self.merger.advance("card1", 0.5)
+        self.assertEqual(self.merger.watermark(), 1.2)
+
+    def test_silent_card(self):
+        self.push("card0", 1.0, 2.0, 3.5)
+        # card1 blocks the items until they are older than max_delay
+        self.assertEqual(self.items(self.merger.pop_ready()), ["card0@1.0"])
+        self.merger.remove_source("card1")
+        self.assertEqual(self.items(self.merger.pop_ready()), ["card0@2.0", "card0@3.5"])
+
+    def test_late_items(self):
+        self.push("card0", 5.0)
+        self.push("card1", 5.0)
+        self.merger.pop_ready()
+        self.push("card1", 4.0)
+        self.assertEqual(self.items(self.merger.pop_ready()), ["card1@4.0"])
+        self.assertEqual(REGISTRY.counter("muonic_merge_late_total", merger=self.name).value, 1)
+        self.assertEqual(self.merger.released, 5.0)
+
+    def test_overflow(self):
+        self.merger.max_items = 2
+        self.push("card0", 1.0, 2.0, 3.0, 4.0)
+        self.assertEqual(self.items(self.merger.pop_ready()), ["card0@1.0", "card0@2.0"])
+        self.assertEqual(REGISTRY.counter("muonic_merge_overflow_total", merger=self.name).value, 2)
+        self.assertEqual(len(self.merger), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+import uuid
+
+from muonic.lib.consumers import AbstractConsumer, BufferedConsumer
+from muonic.lib.metrics import REGISTRY, MetricsRegistry
+
+
+class Sink(AbstractConsumer):
+
+    def __init__(self):
+        self.items = []
+
+    def push(self, data, data_type, run_id, analyzer_id=''):
+        self.items.append(data)
+
+    def start(self, run_id, analyzer_id='', expected_data_types=[]):
+        pass
+
+    def stop(self, run_id, analyzer_id=''):
+        pass
+
+
+def queue_labels(registry=REGISTRY):
+    return set(dict(labels).get("queue") for name, _, _, labels, _ in registry.collect()
+               if name.startswith("muonic_queue"))
+
+
+class MetricsRegistryTest(unittest.TestCase):
+
+    def test_metrics_are_cached(self):
+        registry = MetricsRegistry()
+        counter = registry.counter("test_total", "Test", stage="a")
+        counter.value += 2
+        self.assertIs(registry.counter("test_total", stage="a"), counter)
+        self.assertIsNot(registry.counter("test_total", stage="b"), counter)
+
+    def test_type_conflict(self):
+        registry = MetricsRegistry()
+        registry.counter("test_total", stage="a")
+        with self.assertRaises(ValueError):
+            registry.gauge("test_total", stage="b")
+
+    def test_render(self):
+        registry = MetricsRegistry()
+        registry.counter("test_total", "Test counter", stage="a").value = 3
+        registry.gauge("test_depth", "Test gauge", function=lambda: 1.5)
+        timer = registry.timer("test_seconds", "Test timer")
+        timer.observe(0.25)
+
+        text = registry.render()
+        self.assertIn('# TYPE test_total counter\ntest_total{stage="a"} 3\n', text)
+        self.assertIn("test_depth 1.5\n", text)
+        self.assertIn("test_seconds_count 1\ntest_seconds_sum 0.25\n", text)
+
+    def test_remove(self):
+        registry = MetricsRegistry()
+        registry.gauge("test_depth", function=lambda: 1, queue="a")
+        registry.remove("test_depth", queue="a")
+        self.assertEqual(registry.collect(), [])
+
+
+class BufferedConsumerMetricsTest(unittest.TestCase):
+
+    def test_queue_metrics_removed_on_finish(self):
+        sink = Sink()
+        buffer = BufferedConsumer(10, sink)
+        self.assertIn(buffer.name, queue_labels())
+
+        run_id = uuid.uuid4()
+        buffer.start(run_id, "Test")
+        buffer.push("data", "RAW", run_id, "Test")
+        buffer.stop(run_id, "Test")
+        buffer.finish("Test")
+
+        self.assertEqual(sink.items, ["data"])
+        self.assertNotIn(buffer.name, queue_labels())
+
+
+if __name__ == '__main__':
+    unittest.main()
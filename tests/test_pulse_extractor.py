@@ -0,0 +1,161 @@
+import datetime
+import logging
+import os
+import unittest
+
+from muonic.daq.replay import open_raw_file
+from muonic.lib.batch import BatchPulseExtractor
+from muonic.lib.utils import PulseEvent, PulseEventPool, PulseExtractor
+
+SIMULATED_DATA = os.path.join(os.path.dirname(__file__), os.pardir, "muonic", "daq", "simdaq.txt")
+
+logger = logging.getLogger(__name__)
+
+
+def line(count, ch0_rising="00", ch0_falling="00"):
+    """
+    DAQ line at trigger count with the given edge fields of channel 0
+    """
+    return "%08X %s %s 00 00 00 00 00 00 0000A000 120000.000 181026 12 V 00 +0000\n" % (
+        count, ch0_rising, ch0_falling)
+
+
+def trigger(count):
+    # trigger flag and a rising edge in channel 0
+    return line(count, "A0")
+
+
+def event(count):
+    # complete pulse in channel 0
+    return [trigger(count), line(count + 10, "00", "21")]
+
+
+def extract_lines(extractor, lines):
+    # the first trigger returns the empty event before it
+    return [event for event in map(extractor.extract, lines) if event is not None and any(event.channels)]
+
+
+class PulseExtractorBoundsTest(unittest.TestCase):
+
+    def setUp(self):
+        # an event whose trigger flag went missing: its lines grow the
+        # previous event
+        self.long_event = [trigger(1000)] + [line(1000 + 10 * i, "21", "22") for i in range(1, 6)]
+        self.late_line = [trigger(1000), line(1000 + 5000, "00", "21")]
+
+    def check(self, lines, expected_events, expected_evicted, **bounds):
+        extractor = PulseExtractor(logger, **bounds)
+        events = extract_lines(extractor, lines)
+        self.assertEqual(len(events), expected_events)
+        self.assertEqual(extractor.evicted_events, expected_evicted)
+
+        batch_extractor = BatchPulseExtractor(logger, **bounds)
+        batch = batch_extractor.extract_batch(lines)
+        self.assertEqual(int((batch.counts.sum(axis=1) > 0).sum()), expected_events)
+        self.assertEqual(batch_extractor.evicted_events, expected_evicted)
+        return events
+
+    def test_no_bounds(self):
+        lines = event(100) + self.long_event + self.late_line + event(20000) + [trigger(30000)]
+        events = self.check(lines, 4, {"pulses": 0, "window": 0})
+        self.assertEqual(len(events[1].channels[0]), 6)
+
+    def test_too_many_pulses(self):
+        lines = event(100) + self.long_event + event(20000) + [trigger(30000)]
+        events = self.check(lines, 2, {"pulses": 1, "window": 0}, max_pulses=3)
+        # the events before and after the evicted one are kept
+        self.assertEqual([len(e.channels[0]) for e in events], [1, 1])
+
+    def test_pulses_at_bound_are_kept(self):
+        lines = self.long_event + [trigger(30000)]
+        self.check(lines, 1, {"pulses": 0, "window": 0}, max_pulses=6)
+
+    def test_too_long_window(self):
+        lines = event(100) + self.late_line + event(20000) + [trigger(30000)]
+        self.check(lines, 2, {"pulses": 0, "window": 1}, max_window=1000)
+
+    def test_window_at_bound_is_kept(self):
+        lines = self.late_line + [trigger(30000)]
+        self.check(lines, 1, {"pulses": 0, "window": 0}, max_window=5000)
+
+
+class MidnightRolloverTest(unittest.TestCase):
+
+    def setUp(self):
+        def timed_line(count, time, date, ch0_rising="00", ch0_falling="00"):
+            # the one pps counter equals the trigger count, so the line
+            # times are the GPS times
+            return "%08X %s %s 00 00 00 00 00 00 %08X %s %s 12 V 00 +0000\n" % (
+                count, ch0_rising, ch0_falling, count, time, date)
+
+        self.lines = [
+            timed_line(100, "235959.500", "181026", "A0"), timed_line(110, "235959.500", "181026", "00", "21"),
+            timed_line(200, "000000.500", "191026", "A0"), timed_line(210, "000000.500", "191026", "00", "21"),
+            timed_line(300, "000001.500", "191026", "A0"),
+        ]
+        self.event_times = [datetime.datetime(2026, 10, 18, 23, 59, 59, 500000),
+                            datetime.datetime(2026, 10, 19, 0, 0, 0, 500000)]
+
+    def test_event_time(self):
+        extractor = PulseExtractor(logger)
+        self.assertEqual(extractor._get_evt_time("235959.000", "+0000", 0, 0), 86399.0)
+        self.assertEqual(extractor._get_evt_time("235959.000", "+0000", 25000000, 0), 86400.0)
+        self.assertEqual(extractor.day_offset, 0)
+        # the times keep increasing after midnight
+        self.assertEqual(extractor._get_evt_time("000000.000", "+0000", 0, 0), 86400.0)
+        self.assertEqual(extractor._get_evt_time("000001.000", "+0000", 0, 0), 86401.0)
+        self.assertEqual(extractor.day_offset, 86400)
+
+    def test_extract(self):
+        extractor = PulseExtractor(logger, data_timestamps=True)
+        events = []
+        for line in self.lines:
+            event = extractor.extract(line)
+            if event is not None and any(event.channels):
+                events.append((event.trigger_time, extractor.event_time))
+        self.assertEqual(events, list(zip([86399.5, 86400.5], self.event_times)))
+        self.assertEqual(extractor.data_time, datetime.datetime(2026, 10, 19, 0, 0, 1, 500000))
+
+        batch = BatchPulseExtractor(logger, data_timestamps=True).extract_batch(self.lines)
+        self.assertEqual(batch.trigger_times[1:].tolist(), [86399.5, 86400.5])
+        self.assertEqual(list(batch.event_times[1:]), self.event_times)
+
+
+class PulseEventPoolTest(unittest.TestCase):
+
+    def test_reuse(self):
+        pool = PulseEventPool(size=1)
+        first = pool.acquire()
+        first.trigger_time = 1.5
+        first.ch0.append((0, 10))
+        ch0 = first.ch0
+        second = PulseEvent(2.0, ch1=[(5, 15)])
+        pool.release(first)
+        # the pool is full, the second event is dropped
+        pool.release(second)
+
+        event = pool.acquire()
+        self.assertIs(event, first)
+        self.assertIs(event.ch0, ch0)
+        self.assertEqual(event, (0, [], [], [], []))
+        self.assertIsNot(pool.acquire(), second)
+
+    def test_pooled_extraction(self):
+        with open_raw_file(SIMULATED_DATA) as f:
+            lines = f.readlines()
+        expected = [event.as_tuple() for event in map(PulseExtractor(logger).extract, lines)
+                    if event is not None]
+
+        pool = PulseEventPool()
+        extractor = PulseExtractor(logger, pool=pool)
+        events = []
+        for event in map(extractor.extract, lines):
+            if event is not None:
+                events.append((event.trigger_time,) + tuple(list(channel) for channel in event.channels))
+                pool.release(event)
+        self.assertEqual(events, expected)
+        self.assertTrue(pool._free)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from muonic.lib.app import App
+from muonic.lib.run_plan import load_run_plan
+
+SIMULATED_DATA = os.path.join(os.path.dirname(__file__), os.pardir, "muonic", "daq", "simdaq.txt")
+
+
+class LoadRunPlanTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def load(self, plan, **kwargs):
+        path = os.path.join(self.directory, "plan.json")
+        with open(path, "w") as f:
+            json.dump(plan, f)
+        return load_run_plan(path, analyzer_names=["rate", "decay"], **kwargs)
+
+    def test_valid_plan(self):
+        settings, runs = self.load({
+            "defaults": {"duration": 60, "settings": {"gate_width": 100}},
+            "runs": [
+                {"name": "low", "settings": {"threshold_ch0": 250}},
+                {"duration": 30, "analyzers": ["rate"]},
+            ]
+        })
+        self.assertEqual(settings, {"gate_width": 100})
+        self.assertEqual([(run.name, run.duration, run.settings, run.analyzers) for run in runs],
+                         [("low", 60.0, {"threshold_ch0": 250}, None), ("run 2", 30.0, {}, ["rate"])])
+
+    def test_default_duration(self):
+        _, runs = self.load([{"name": "a"}], default_duration=10)
+        self.assertEqual(runs[0].duration, 10.0)
+        with self.assertRaises(ValueError):
+            self.load([{"name": "a"}])
+
+    def test_invalid_plans(self):
+        for plan in [[], {"runs": {}},
+                     [{"duration": 10, "settings": {"threshold_ch9": 1}}],
+                     [{"duration": 10, "analyzers": ["pulses"]}],
+                     [{"duration": 10, "colour": "red"}],
+                     [{"duration": True}],
+                     {"defaults": {"settings": {"unknown": 1}}, "runs": [{"duration": 10}]}]:
+            with self.assertRaises(ValueError, msg=plan):
+                self.load(plan)
+
+
+class AppSettingsTest(unittest.TestCase):
+
+    def test_settings_not_shared(self):
+        first = App(options={"replay": [SIMULATED_DATA]})
+        second = App(options={"replay": [SIMULATED_DATA]})
+        try:
+            default = second.get_setting("threshold_ch0")
+            first.update_setting("threshold_ch0", default + 1)
+            self.assertEqual(first.get_setting("threshold_ch0"), default + 1)
+            self.assertEqual(second.get_setting("threshold_ch0"), default)
+        finally:
+            first.close()
+            second.close()
+        third = App(options={"replay": [SIMULATED_DATA]})
+        try:
+            self.assertEqual(third.get_setting("threshold_ch0"), default)
+        finally:
+            third.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
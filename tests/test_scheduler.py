@@ -0,0 +1,89 @@
+import threading
+import time
+import unittest
+
+from muonic.lib.scheduler import Scheduler
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = Scheduler()
+
+    def tearDown(self):
+        self.scheduler.stop()
+
+    def test_call_later(self):
+        called = threading.Event()
+        self.scheduler.call_later(0.01, called.set)
+        self.assertTrue(called.wait(2))
+
+    def test_cancelled_call_never_runs(self):
+        calls = []
+        call = self.scheduler.call_later(0.05, calls.append, 1)
+        call.cancel()
+        time.sleep(0.1)
+        self.assertEqual(calls, [])
+
+    def test_cancel_periodic_call(self):
+        calls = []
+        ran = threading.Event()
+
+        def callback():
+            calls.append(1)
+            ran.set()
+
+        call = self.scheduler.call_every(0.01, callback, first_delay=0)
+        self.assertTrue(ran.wait(2))
+        call.cancel()
+        count = len(calls)
+        time.sleep(0.05)
+        self.assertEqual(len(calls), count)
+
+    def test_stop_and_restart(self):
+        called = threading.Event()
+        self.scheduler.call_later(0.01, called.set)
+        self.assertTrue(called.wait(2))
+        thread = self.scheduler._thread
+        self.scheduler.stop()
+        self.assertFalse(thread.is_alive())
+        self.assertIsNone(self.scheduler._thread)
+
+        called.clear()
+        self.scheduler.call_later(0.01, called.set)
+        self.assertTrue(called.wait(2))
+
+    def test_pending_calls_survive_stop(self):
+        called = threading.Event()
+        self.scheduler.call_later(0.05, called.set)
+        self.scheduler.stop()
+        self.assertFalse(called.wait(0.1))
+        # the next call restarts the thread, the pending call runs as well
+        self.scheduler.call_later(10, lambda: None)
+        self.assertTrue(called.wait(2))
+
+    def test_stop_from_scheduled_call(self):
+        stopped = threading.Event()
+        threads = []
+
+        def stop():
+            threads.append(threading.current_thread())
+            self.scheduler.stop()
+            stopped.set()
+
+        self.scheduler.call_later(0, stop)
+        self.assertTrue(stopped.wait(2))
+        thread = threads[0]
+        thread.join(2)
+        self.assertFalse(thread.is_alive())
+        self.assertIsNone(self.scheduler._thread)
+
+        # a new thread serves the next calls
+        called = threading.Event()
+        self.scheduler.call_later(0, called.set)
+        self.assertTrue(called.wait(2))
+        self.assertIsNot(self.scheduler._thread, thread)
+
+
+if __name__ == '__main__':
+    unittest.main()
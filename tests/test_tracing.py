@@ -0,0 +1,98 @@
+import json
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from muonic.lib.metrics import MetricsRegistry
+from muonic.lib.tracing import LatencyHistogram, Tracer, current_trace, set_current_trace
+
+
+class LatencyHistogramTest(unittest.TestCase):
+
+    def test_relative_error(self):
+        histogram = LatencyHistogram(significant_bits=7)
+        rng = random.Random(1)
+        for _ in range(1000):
+            value = rng.randint(1, 1 << 39)
+            # the highest value of the bucket of value
+            upper = histogram._value(histogram._index(value))
+            self.assertLessEqual(value, upper)
+            self.assertLess((upper - value) / float(value), 2 ** -6)
+
+    def test_percentiles(self):
+        histogram = LatencyHistogram()
+        self.assertEqual(histogram.percentile(50), 0.0)
+        for microseconds in range(1, 101):
+            histogram.record(microseconds * 1e-6)
+        self.assertAlmostEqual(histogram.percentile(50), 50e-6, delta=1e-6)
+        self.assertAlmostEqual(histogram.percentile(99), 99e-6, delta=1e-6)
+        self.assertAlmostEqual(histogram.percentile(100), 100e-6, delta=2e-9)
+        self.assertEqual(histogram.summary(percentiles=(50,))["count"], 100)
+
+    def test_clamping(self):
+        histogram = LatencyHistogram(max_value=1000)
+        histogram.record(-1.0)
+        histogram.record(1.0)
+        self.assertEqual(histogram.total_count, 2)
+        self.assertEqual(histogram.percentile(50), 0.0)
+        self.assertEqual(histogram.max_recorded, 1000)
+
+
+class TracerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = MetricsRegistry()
+        self.tracer = Tracer(sample_every=2, max_traces=2, registry=self.registry)
+
+    def test_stages(self):
+        for i in range(5):
+            trace = self.tracer.begin(None, raw="line %d" % i)
+            trace.stamp("extract")
+            trace.stamp("consumer")
+        self.tracer.record("worker", 0.5)
+
+        self.assertEqual(list(self.tracer.summary()), ["extract", "consumer", "worker"])
+        self.assertEqual(self.tracer.summary()["extract"]["count"], 5)
+        # every second trace, at most max_traces of them
+        self.assertEqual([raw for raw, _ in self.tracer.traces], ["line 1", "line 3"])
+        self.assertEqual([stage for stage, _ in self.tracer.traces[0][1].stages], ["extract", "consumer"])
+
+        quantiles = dict((dict(labels)["quantile"], value) for name, _, _, labels, value in self.registry.collect()
+                         if name == "muonic_latency_seconds" and dict(labels)["stage"] == "worker")
+        self.assertEqual(sorted(quantiles), ["0.5", "0.99", "0.999"])
+        self.assertAlmostEqual(quantiles["0.5"], 0.5, delta=0.5 * 2 ** -6)
+
+    def test_no_sampling(self):
+        self.tracer.sample_every = 0
+        self.tracer.begin(None).stamp("extract")
+        self.assertEqual(len(self.tracer.traces), 0)
+
+    def test_current_trace(self):
+        trace = self.tracer.begin(None)
+        set_current_trace(trace)
+        try:
+            self.assertIs(current_trace(), trace)
+        finally:
+            set_current_trace(None)
+        self.assertIsNone(current_trace())
+
+    def test_dump(self):
+        directory = tempfile.mkdtemp()
+        try:
+            for i in range(2):
+                self.tracer.begin(None, raw="line %d" % i).stamp("extract")
+            path = os.path.join(directory, "traces.jsonl")
+            self.tracer.dump(path)
+            with open(path) as f:
+                lines = [json.loads(line) for line in f]
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(lines[0]["summary"]["extract"]["count"], 2)
+        self.assertEqual([(line["raw"], [stage for stage, _ in line["stages"]]) for line in lines[1:]],
+                         [("line 1", ["extract"])])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import queue
+import unittest
+
+from muonic.lib.analyzers import BaseAnalyzer
+from muonic.lib.tracing import Tracer
+from muonic.lib.workers import AnalyzerProcessPool, SharedMessageRing
+
+
+class Scan(BaseAnalyzer):
+
+    CAN_COMPLETE = True
+
+
+class Counter(BaseAnalyzer):
+
+    def calculate(self, msg):
+        return True
+
+
+class SharedMessageRingTest(unittest.TestCase):
+
+    def read_all(self, ring, seq=0):
+        messages = []
+        lost = 0
+        while True:
+            payload, seq, dropped = ring.read(seq)
+            lost += dropped
+            if payload is None:
+                return messages, seq, lost
+            messages.append(payload)
+
+    def test_read_in_order(self):
+        ring = SharedMessageRing(slots=8, slot_size=64)
+        for i in range(5):
+            self.assertTrue(ring.write(b"%d" % i))
+        messages, seq, lost = self.read_all(ring)
+        self.assertEqual(messages, [b"0", b"1", b"2", b"3", b"4"])
+        self.assertEqual((seq, lost), (5, 0))
+
+    def test_wrap_around(self):
+        ring = SharedMessageRing(slots=4, slot_size=64)
+        seq = 0
+        received = []
+        for i in range(10):
+            ring.write(b"%d" % i)
+            if i % 2:
+                messages, seq, lost = self.read_all(ring, seq)
+                self.assertEqual(lost, 0)
+                received.extend(messages)
+        self.assertEqual(received, [b"%d" % i for i in range(10)])
+        self.assertEqual(ring.head, 10)
+
+    def test_lapped_reader_loses_oldest(self):
+        ring = SharedMessageRing(slots=4, slot_size=64)
+        for i in range(10):
+            ring.write(b"%d" % i)
+        messages, seq, lost = self.read_all(ring)
+        self.assertEqual(messages, [b"6", b"7", b"8", b"9"])
+        self.assertEqual((seq, lost), (10, 6))
+
+    def test_oversized_message(self):
+        ring = SharedMessageRing(slots=4, slot_size=32)
+        self.assertFalse(ring.write(b"x" * ring.max_message_size + b"x"))
+        self.assertTrue(ring.write(b"x" * ring.max_message_size))
+        self.assertEqual(ring.head, 1)
+
+
+class AnalyzerProcessPoolResultsTest(unittest.TestCase):
+
+    def process(self, pool, *items):
+        pool._results = queue.Queue()
+        for item in items:
+            pool._results.put(item)
+        pool._results.put(None)
+        pool._process_results()
+
+    def test_completed_once_all_scans_completed(self):
+        pool = AnalyzerProcessPool([[(Counter, {}), (Scan, {})], [(Scan, {})]])
+        self.assertTrue(pool.CAN_COMPLETE)
+        self.process(pool, ('completed', 'Scan'))
+        self.assertFalse(pool.completed)
+        self.process(pool, ('completed', 'Scan'))
+        self.assertTrue(pool.completed)
+
+    def test_pool_without_scans_cannot_complete(self):
+        pool = AnalyzerProcessPool([[(Counter, {})]])
+        self.assertFalse(pool.CAN_COMPLETE)
+
+    def test_worker_latencies_reach_tracer(self):
+        tracer = Tracer()
+        pool = AnalyzerProcessPool([[(Counter, {})]])
+        pool._tracer = tracer
+        self.process(pool, ('latency', [('Counter', 0.001), ('Counter', 0.002)]))
+        self.assertEqual(tracer.summary()['Counter']['count'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()